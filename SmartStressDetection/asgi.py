@@ -2,6 +2,8 @@
 ASGI config for SmartStressDetection project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+WebSocket connections to STRESS_STREAM_PATH go to the webcam stream app;
+everything else is handled by Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from stressdetector.streaming import router  # noqa: E402
+
+application = router(django_application)
+
+# Keep the stress model warm for the lifetime of this worker process
+from stressdetector.inference import preload_engine  # noqa: E402
+
+preload_engine()
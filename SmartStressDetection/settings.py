@@ -35,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings include every other middleware
+    'stressdetector.profiling.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,7 +50,8 @@ ROOT_URLCONF = 'SmartStressDetection.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing each render for the request metrics
+        'BACKEND': 'stressdetector.profiling.TimedDjangoTemplates',
         'DIRS': [BASE_DIR / "templates"],  # or []
         'APP_DIRS': True,
         'OPTIONS': {
@@ -69,6 +72,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Concurrent writers wait for the lock instead of failing, and
+        # transactions take the write lock up front so they cannot deadlock
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # File-backed (not shared-cache in-memory) so tests can run
+        # concurrent writers
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -113,4 +127,96 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 # Redirect URLs after login/logout
 LOGIN_REDIRECT_URL = '/'
-LOGOUT_REDIRECT_URL = '/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/'
+
+# Stress model settings
+# Versioned artifacts live in STRESS_MODEL_REGISTRY/<version>/ and the one
+# named in its ACTIVE file is served (see stressdetector.registry); without
+# an ACTIVE file the single artifact at STRESS_MODEL_PATH is served
+STRESS_MODEL_REGISTRY = os.path.join(BASE_DIR, 'ml_models')
+STRESS_MODEL_PATH = os.path.join(BASE_DIR, 'ml_models', 'stress_model.keras')
+# Seconds between checks for a newly activated version, which running
+# workers then load in the background and swap in
+STRESS_MODEL_CHECK_INTERVAL = 5
+STRESS_MODEL_INPUT_SIZE = (48, 48)
+# Load the model when a worker process starts instead of on its first request
+STRESS_MODEL_PRELOAD = True
+# Micro-batching: concurrent predictions arriving within the wait window are
+# run as one forward pass (a max batch size of 1 disables batching)
+STRESS_BATCH_MAX_SIZE = 16
+STRESS_BATCH_MAX_WAIT_MS = 10
+# Cached predictions are keyed by image content hash and model version
+STRESS_PREDICTION_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# Batch uploads (/predict-batch/): images per request, including zip
+# members, the largest accepted image, and threads decoding them (None
+# uses every core)
+STRESS_BATCH_UPLOAD_MAX_FILES = 100
+STRESS_BATCH_UPLOAD_MAX_IMAGE_BYTES = 10 * 1024 * 1024
+STRESS_DECODE_WORKERS = None
+
+# Identical uploads are stored once (see stressdetector.uploads)
+STORAGES = {
+    'default': {
+        'BACKEND': 'stressdetector.uploads.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Caches
+# Per-process memory is fine for a single worker; multi-process deployments
+# should point this at a shared backend (e.g. memcached or Redis) so cache
+# invalidation reaches every worker
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stressdetector',
+    }
+}
+
+# Weekly dashboard chart, invalidated whenever a prediction or journal is saved
+STRESS_DASHBOARD_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Longest side in pixels of each thumbnail size; pages link to these WebP
+# derivatives instead of the full-resolution uploads
+STRESS_THUMBNAIL_SIZES = {
+    'small': 160,
+    'medium': 400,
+}
+STRESS_THUMBNAIL_QUALITY = 80
+
+# Face heatmaps are computed on first view by this many background threads
+# and stored as WebP overlays of this side length in pixels
+STRESS_HEATMAP_WORKERS = 1
+STRESS_HEATMAP_SIZE = 192
+STRESS_HEATMAP_QUALITY = 75
+
+# Webcam stream WebSocket (see stressdetector/streaming.py). The face detector
+# runs on every Nth frame; SMOOTHING is the weight of the newest frame in the
+# exponential moving average of class probabilities
+STRESS_STREAM_PATH = '/ws/stream/'
+STRESS_STREAM_DETECT_EVERY = 5
+STRESS_STREAM_SMOOTHING = 0.3
+STRESS_STREAM_MAX_FRAME_BYTES = 2 * 1024 * 1024
+
+# Background jobs (stressdetector/jobs.py), run by `python manage.py run_jobs`.
+# With BACKGROUND_PREDICTIONS the upload request returns a pending prediction
+# and a worker fills in the result, so at least one run_jobs process must be
+# running next to the web server. Running workers renew their lease; a job
+# whose worker stops for longer than the lease is run again, and failures
+# are retried after BACKOFF * 2**n seconds
+STRESS_BACKGROUND_PREDICTIONS = True
+STRESS_JOB_LEASE_SECONDS = 60
+STRESS_JOB_MAX_ATTEMPTS = 3
+STRESS_JOB_RETRY_BACKOFF = 2
+STRESS_JOB_POLL_INTERVAL = 1.0
+
+# Per-view request metrics (stressdetector/profiling.py), served in Prometheus
+# format at /metrics to these client addresses only; requests slower than
+# SLOW_REQUEST_SECONDS are logged with their slowest queries
+STRESS_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+STRESS_SLOW_REQUEST_SECONDS = 0.5
+
+# Weighted term,weight,stress vocabulary for journal sentiment and keywords
+STRESS_LEXICON_PATH = os.path.join(BASE_DIR, 'stressdetector', 'data', 'stress_lexicon.csv')
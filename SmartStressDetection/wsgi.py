@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
 
 application = get_wsgi_application()
+
+# Keep the stress model warm for the lifetime of this worker process
+from stressdetector.inference import preload_engine  # noqa: E402
+
+preload_engine()
@@ -0,0 +1,72 @@
+"""
+Throughput benchmark for micro-batched predictions.
+
+Usage:
+    python scripts/bench_batching.py [--model PATH] [--clients 32] [--requests 20]
+
+Runs the same concurrent load against an unbatched engine and against
+engines with different batching windows, then prints throughput and the
+batch-size and wait-time histograms for each.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+from stressdetector import batching  # noqa: E402
+from stressdetector.inference import InferenceEngine  # noqa: E402
+
+
+def run(engine, clients, requests_per_client, image):
+    def client(_):
+        for _ in range(requests_per_client):
+            engine.predict(image)
+
+    engine.load()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    return clients * requests_per_client / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=settings.STRESS_MODEL_PATH, help="Model artifact to benchmark")
+    parser.add_argument('--clients', type=int, default=32, help="Concurrent request threads")
+    parser.add_argument('--requests', type=int, default=20, help="Predictions per client")
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    size = settings.STRESS_MODEL_INPUT_SIZE
+    image = np.random.default_rng(0).integers(0, 256, size=size, dtype=np.uint8)
+
+    configs = [(1, 0), (args.max_batch_size, 5), (args.max_batch_size, 10), (args.max_batch_size, 20)]
+    for max_batch_size, max_wait_ms in configs:
+        batching.batch_size_histogram.reset()
+        batching.batch_wait_histogram.reset()
+        engine = InferenceEngine(args.model, size, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+        throughput = run(engine, args.clients, args.requests, image)
+
+        label = 'unbatched' if max_batch_size == 1 else f'batch<={max_batch_size}, wait {max_wait_ms}ms'
+        print(f"{label:<26} {throughput:8.1f} predictions/s")
+        if engine.batcher is not None:
+            stats = batching.stats()
+            print(f"    mean batch size {stats['batch_size']['mean']:.1f}, "
+                  f"mean wait {stats['wait_seconds']['mean'] * 1000:.2f}ms")
+            print(f"    batch size buckets: {stats['batch_size']['buckets']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Throughput and memory benchmark for the streaming history export.
+
+Usage:
+    python scripts/bench_export.py [--rows 100000] [--chunk-size 2000]
+
+Seeds a throwaway test database with one user's history (predictions plus
+proportionally fewer journal entries and comparisons), streams it through
+the export view in both formats, and prints rows/sec and the peak Python
+heap while streaming. For contrast it also reports the peak for building
+the same NDJSON document in memory, which grows with the history.
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from stressdetector import export  # noqa: E402
+from stressdetector.models import MoodJournal, StressComparison, StressPrediction  # noqa: E402
+
+
+def seed(user, rows):
+    """Bulk-insert rows predictions, rows/4 journal entries and rows/10 comparisons"""
+    levels = ['Low', 'Medium', 'High']
+    batch = 5000
+    for start in range(0, rows, batch):
+        StressPrediction.objects.bulk_create(
+            StressPrediction(
+                user=user, image='user_images/bench.png', stress_level=levels[i % 3],
+                mood_tag='Neutral', confidence=60 + i % 40,
+            )
+            for i in range(start, min(start + batch, rows))
+        )
+    MoodJournal.objects.bulk_create(
+        MoodJournal(
+            user=user, text='Long day, deadlines everywhere but a good walk helped.',
+            text_sentiment='Neutral', combined_stress_level=levels[i % 3], stress_keywords=['deadline'],
+        )
+        for i in range(rows // 4)
+    )
+    StressComparison.objects.bulk_create(
+        StressComparison(
+            user=user, before_image='a.png', after_image='b.png', before_stress_level='High',
+            after_stress_level='Low', before_confidence=70, after_confidence=70, improvement_score=66,
+        )
+        for _ in range(rows // 10)
+    )
+    return rows + rows // 4 + rows // 10
+
+
+def stream_export(client, export_format):
+    """Consume the export view's streamed body, returning (bytes, lines)"""
+    response = client.get(f'/export/{export_format}/')
+    size = lines = 0
+    for chunk in response.streaming_content:
+        size += len(chunk)
+        lines += chunk.count(b'\n')
+    return size, lines
+
+
+def build_in_memory(user_id):
+    # What a non-streaming view would do: materialise every row, then encode
+    records = list(export.ndjson_lines(user_id))
+    return ''.join(records).encode()
+
+
+def measure(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help="Predictions to seed")
+    parser.add_argument('--chunk-size', type=int, default=export.CHUNK_SIZE, help="Rows fetched per database round trip")
+    args = parser.parse_args()
+    export.CHUNK_SIZE = args.chunk_size
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user('bench-export', password='bench')
+        records = seed(user, args.rows)
+        client = Client()
+        client.force_login(user)
+        print(f"{records:,} records, chunk size {args.chunk_size}")
+
+        for export_format in ('ndjson', 'csv'):
+            (size, lines), elapsed, peak = measure(stream_export, client, export_format)
+            print(
+                f"{export_format:>6} streamed: {lines:,} lines, {size / 2**20:.1f} MiB, "
+                f"{records / elapsed:,.0f} rows/sec, peak heap {peak / 2**20:.1f} MiB"
+            )
+
+        body, elapsed, peak = measure(build_in_memory, user.id)
+        print(
+            f"ndjson in memory: {len(body) / 2**20:.1f} MiB, "
+            f"{records / elapsed:,.0f} rows/sec, peak heap {peak / 2**20:.1f} MiB"
+        )
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
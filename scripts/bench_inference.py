@@ -0,0 +1,79 @@
+"""
+Cold-start vs warm latency benchmark for the stress inference engine.
+
+Usage:
+    python scripts/bench_inference.py [--model PATH] [--requests 50]
+
+"Cold" is what every request would pay if the model were loaded inside the
+view; "warm" is what requests pay once the process-wide engine has loaded it.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+from stressdetector.inference import InferenceEngine  # noqa: E402
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def report(name, timings):
+    timings_ms = [t * 1000 for t in timings]
+    print(f"{name:<28} n={len(timings_ms):<4} "
+          f"mean={statistics.mean(timings_ms):9.2f}ms "
+          f"p50={percentile(timings_ms, 50):9.2f}ms "
+          f"p95={percentile(timings_ms, 95):9.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=settings.STRESS_MODEL_PATH, help="Model artifact to benchmark")
+    parser.add_argument('--requests', type=int, default=50, help="Number of warm predictions")
+    parser.add_argument('--cold-runs', type=int, default=3, help="Number of cold loads")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    size = settings.STRESS_MODEL_INPUT_SIZE
+    image = rng.integers(0, 256, size=size, dtype=np.uint8)
+
+    # Cold: a fresh engine per request, i.e. loading the model in the view
+    cold = []
+    for _ in range(args.cold_runs):
+        engine = InferenceEngine(args.model, input_size=size)
+        started = time.perf_counter()
+        engine.predict(image)
+        cold.append(time.perf_counter() - started)
+
+    # Warm: one engine reused for every request
+    engine = InferenceEngine(args.model, input_size=size)
+    engine.load()
+    warm = []
+    for _ in range(args.requests):
+        started = time.perf_counter()
+        engine.predict(image)
+        warm.append(time.perf_counter() - started)
+
+    print(f"Model: {args.model}")
+    report("cold (load per request)", cold)
+    report("warm (process-wide engine)", warm)
+    print(f"Speed-up: {statistics.mean(cold) / statistics.mean(warm):.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark the compiled stress lexicon against per-term substring scans.
+
+Usage:
+    python scripts/bench_lexicon.py [--terms 150 2000 20000] [--words 2000] [--entries 50]
+
+For each vocabulary size, pads the shipped lexicon with synthetic terms and
+times both the old approach (``any(word in text_lower ...)`` generalised to
+one ``in`` test per term, which also matches inside longer words) and
+Lexicon.analyze_many over the same long journal entries.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+from stressdetector.lexicon import Lexicon  # noqa: E402
+
+
+def synthetic_words(count, rng):
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10))))
+    return sorted(words)
+
+
+def substring_scan(terms, texts):
+    """The journal view's old approach, applied to every term of the vocabulary"""
+    results = []
+    for text in texts:
+        text_lower = text.lower()
+        score = 0.0
+        keywords = []
+        for term, entry in terms.items():
+            if term in text_lower:
+                score += entry.weight
+                if entry.stress:
+                    keywords.append(term)
+        results.append((score, keywords))
+    return results
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--terms', type=int, nargs='+', default=[150, 2000, 20000], help="Vocabulary sizes")
+    parser.add_argument('--words', type=int, default=2000, help="Words per journal entry")
+    parser.add_argument('--entries', type=int, default=50, help="Journal entries per run")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    base = Lexicon.from_csv(settings.STRESS_LEXICON_PATH)
+    filler = synthetic_words(max(args.terms) + args.words, rng)
+
+    for size in args.terms:
+        terms = {term: (entry.weight, entry.stress) for term, entry in base.terms.items()}
+        for word in filler[:max(0, size - len(terms))]:
+            terms[word] = (rng.choice([-2, -1, 1, 2]), rng.random() < 0.2)
+
+        started = time.perf_counter()
+        lexicon = Lexicon(terms)
+        compile_seconds = time.perf_counter() - started
+
+        # Entries mix lexicon terms with words that are not in it
+        pool = list(terms) + filler[-args.words:]
+        texts = [' '.join(rng.choices(pool, k=args.words)) for _ in range(args.entries)]
+        total_words = args.words * args.entries
+
+        scan = timed(substring_scan, lexicon.terms, texts)
+        compiled = timed(lexicon.analyze_many, texts)
+        print(
+            f"{len(lexicon.terms):>6} terms: compile {compile_seconds * 1000:7.1f} ms | "
+            f"substring scan {total_words / scan:>12,.0f} words/sec | "
+            f"compiled {total_words / compiled:>12,.0f} words/sec | {scan / compiled:5.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Overhead of the per-request metrics middleware and timed template backend.
+
+Usage:
+    python scripts/bench_metrics.py [--requests 300] [--rounds 5] [--predictions 500]
+
+Seeds a throwaway test database with one user's history, then requests
+home, history and trends_api through the test client with the metrics
+middleware and template timing switched on and off. The modes alternate in
+rounds so drift affects both equally, and the median time per request of
+each view is compared. Differences of a few percent are within the noise of
+such runs, so the fixed cost of the middleware and the cost it adds to each
+query are also measured in isolation.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.test import Client, RequestFactory  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from stressdetector.models import DailyStressRollup, MoodJournal, StressPrediction  # noqa: E402
+from stressdetector.profiling import RequestMetricsMiddleware, RequestProfile  # noqa: E402
+
+VIEWS = {'home': '/', 'history': '/history/', 'trends_api': '/trends-api/'}
+MIDDLEWARE = 'stressdetector.profiling.RequestMetricsMiddleware'
+
+
+def seed(user, predictions):
+    levels = ['Low', 'Medium', 'High']
+    StressPrediction.objects.bulk_create(
+        StressPrediction(
+            user=user, image='user_images/bench.png', stress_level=levels[i % 3],
+            mood_tag='Neutral', confidence=60 + i % 40,
+        )
+        for i in range(predictions)
+    )
+    MoodJournal.objects.bulk_create(
+        MoodJournal(user=user, text='Deadlines again.', text_sentiment='Negative', combined_stress_level='High')
+        for _ in range(predictions // 4)
+    )
+    DailyStressRollup.rebuild([user.id])
+
+
+def uninstrumented_settings():
+    templates = [dict(settings.TEMPLATES[0], BACKEND='django.template.backends.django.DjangoTemplates')]
+    middleware = [name for name in settings.MIDDLEWARE if name != MIDDLEWARE]
+    return override_settings(MIDDLEWARE=middleware, TEMPLATES=templates)
+
+
+def time_requests(user, url, count):
+    # A new client per mode, so it builds its handler from the current MIDDLEWARE
+    client = Client()
+    client.force_login(user)
+    client.get(url)
+    started = time.perf_counter()
+    for _ in range(count):
+        client.get(url)
+    return (time.perf_counter() - started) / count
+
+
+def isolated_costs(count=20000):
+    """Microseconds the middleware adds per request and per query"""
+    request = RequestFactory().get('/trends-api/')
+    view = lambda request: HttpResponse()  # noqa: E731
+    middleware = RequestMetricsMiddleware(view)
+
+    def per_call(fn, *args):
+        started = time.perf_counter()
+        for _ in range(count):
+            fn(*args)
+        return (time.perf_counter() - started) / count * 1e6
+
+    # Alternate the two sides and keep the best of three runs of each, which
+    # discards warm-up and scheduler noise
+    cursor = connection.cursor()
+    bare_request, wrapped_request, bare_query, wrapped_query = [], [], [], []
+    for _ in range(3):
+        bare_request.append(per_call(view, request))
+        wrapped_request.append(per_call(middleware, request))
+        bare_query.append(per_call(cursor.execute, 'SELECT 1'))
+        with connection.execute_wrapper(RequestProfile().record_query):
+            wrapped_query.append(per_call(cursor.execute, 'SELECT 1'))
+    return min(wrapped_request) - min(bare_request), min(wrapped_query) - min(bare_query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=300, help="Requests per view, mode and round")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--predictions', type=int, default=500, help="Predictions to seed")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user('bench-metrics', password='bench')
+        seed(user, args.predictions)
+        per_request, per_query = isolated_costs()
+        timings = {view: {'off': [], 'on': []} for view in VIEWS}
+        for _ in range(args.rounds):
+            for view, url in VIEWS.items():
+                with uninstrumented_settings():
+                    timings[view]['off'].append(time_requests(user, url, args.requests))
+                timings[view]['on'].append(time_requests(user, url, args.requests))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    print(f"isolated: {per_request:.1f} us per request, {per_query:.1f} us per query")
+    print(f"{args.requests} requests x {args.rounds} rounds per view, median per request")
+    for view, modes in timings.items():
+        off, on = statistics.median(modes['off']), statistics.median(modes['on'])
+        print(f"{view:>11}: {off * 1000:6.2f} ms -> {on * 1000:6.2f} ms ({(on - off) / off:+.1%})")
+
+
+if __name__ == '__main__':
+    main()
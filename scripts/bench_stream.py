@@ -0,0 +1,129 @@
+"""
+Per-frame latency and sustained frame rate of the webcam stream endpoint.
+
+Usage:
+    python scripts/bench_stream.py [--model PATH] [--fps 30] [--seconds 10] [--streams 1] [--image face.jpg]
+
+Drives stressdetector.streaming.stream in-process, the way an ASGI server
+would, with one simulated webcam per --streams sending frames at --fps.
+Reports the server-side latency of scored frames, how many frames were
+scored versus skipped, and scored frames per CPU-second of this process
+(frames per second per fully used core).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from stressdetector import inference, streaming  # noqa: E402
+
+
+def webcam_frames(path, width, height, count=8):
+    """A few JPEG frames: a real photo if given, else noisy gradients"""
+    rng = np.random.default_rng(0)
+    frames = []
+    for _ in range(count):
+        if path:
+            image = Image.open(path).convert('RGB').resize((width, height))
+            pixels = np.clip(np.asarray(image, dtype=np.int16) + rng.integers(-4, 5, (height, width, 3)), 0, 255)
+        else:
+            y, x = np.mgrid[0:height, 0:width]
+            pixels = np.clip((x + y)[..., None] * 255 / (width + height) + rng.normal(0, 8, (height, width, 3)), 0, 255)
+        buffer = BytesIO()
+        Image.fromarray(pixels.astype(np.uint8)).save(buffer, 'JPEG', quality=80)
+        frames.append(buffer.getvalue())
+    return frames
+
+
+async def run_stream(frames, fps, seconds):
+    inbox, outbox = asyncio.Queue(), asyncio.Queue()
+    scope = {'type': 'websocket', 'path': settings.STRESS_STREAM_PATH, 'user': SimpleNamespace(is_authenticated=True)}
+    app = asyncio.create_task(streaming.stream(scope, inbox.get, outbox.put))
+    await inbox.put({'type': 'websocket.connect'})
+    accepted = await outbox.get()
+    if accepted['type'] != 'websocket.accept':
+        raise SystemExit(f"Stream refused: {accepted}")
+
+    results = []
+
+    async def collect():
+        while True:
+            message = await outbox.get()
+            results.append(json.loads(message['text']))
+
+    collector = asyncio.create_task(collect())
+    sent = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        await inbox.put({'type': 'websocket.receive', 'bytes': frames[sent % len(frames)]})
+        sent += 1
+        next_frame = started + sent / fps
+        await asyncio.sleep(max(0.0, next_frame - time.perf_counter()))
+    # Let the frame in flight finish before hanging up
+    await asyncio.sleep(0.25)
+    await inbox.put({'type': 'websocket.disconnect', 'code': 1000})
+    await app
+    collector.cancel()
+    return sent, results
+
+
+async def run(args, frames):
+    return await asyncio.gather(*(run_stream(frames, args.fps, args.seconds) for _ in range(args.streams)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', help="Model artifact to serve instead of the registry's active one")
+    parser.add_argument('--fps', type=float, default=30, help="Frames per second each webcam sends")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--streams', type=int, default=1, help="Concurrent webcams")
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--image', help="Photo to send (with some noise) instead of synthetic frames")
+    args = parser.parse_args()
+
+    if args.model:
+        inference._engine = inference.InferenceEngine(
+            args.model,
+            input_size=settings.STRESS_MODEL_INPUT_SIZE,
+            max_batch_size=settings.STRESS_BATCH_MAX_SIZE,
+            max_wait_ms=settings.STRESS_BATCH_MAX_WAIT_MS,
+        )
+    inference.get_engine().load()
+    frames = webcam_frames(args.image, args.width, args.height)
+
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    outcomes = asyncio.run(run(args, frames))
+    cpu_seconds, wall_seconds = time.process_time() - cpu_started, time.perf_counter() - wall_started
+
+    sent = sum(count for count, _ in outcomes)
+    results = [result for _, stream_results in outcomes for result in stream_results if 'error' not in result]
+    latencies = np.array([result['latency_ms'] for result in results])
+    print(f"{args.streams} stream(s) of {args.width}x{args.height} at {args.fps:g} fps for {args.seconds:g}s, {os.cpu_count()} CPU(s)")
+    print(f"scored {len(results)} of {sent} frames ({sent - len(results)} skipped), {len(results) / wall_seconds:.1f} fps sustained")
+    if len(latencies):
+        print(
+            f"latency: p50 {np.percentile(latencies, 50):.1f} ms, p95 {np.percentile(latencies, 95):.1f} ms, "
+            f"max {latencies.max():.1f} ms"
+        )
+    print(f"throughput: {len(results) / cpu_seconds:.1f} scored frames per CPU-second")
+
+
+if __name__ == '__main__':
+    main()
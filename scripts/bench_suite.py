@@ -0,0 +1,420 @@
+"""
+Reproducible load test of the main stressdetector pages.
+
+Usage:
+    python scripts/bench_suite.py [--users 10] [--predictions 200] [--journals 50] [--comparisons 20]
+                                  [--requests 200] [--concurrency 4] [--transport client|http]
+                                  [--scenarios home,history,...] [--model PATH] [--inline-predictions]
+                                  [--seed 0] [--output results.json] [--baseline old.json]
+
+Seeds a throwaway test database with --users users, each with the given
+number of predictions, journal entries and comparisons, then sends
+--requests requests to each scenario from --concurrency client threads.
+Requests go through the Django test client, or with --transport http
+through a local threaded HTTP server, so the WSGI and socket layers are
+included too. Uploads are random images generated from --seed, so two runs
+with the same arguments send the same requests.
+
+The results are printed (or written to --output) as JSON: latency
+percentiles, throughput, error count and queries per request for each
+scenario, plus the commit and settings they were measured with. Given a
+--baseline from an earlier run, the change in each scenario's p50, p95 and
+throughput is printed as well.
+
+By default /predict/ only stores the photo and queues it (see
+STRESS_BACKGROUND_PREDICTIONS); --inline-predictions scores it in the
+request. Scenarios that need the model report errors if none is available.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from io import BytesIO
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+from django.utils.crypto import get_random_string  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from stressdetector import inference, metrics  # noqa: E402
+from stressdetector.models import (  # noqa: E402
+    DailyStressRollup, MoodJournal, StressComparison, StressPrediction, UserProfile
+)
+
+LEVELS = ['Low', 'Medium', 'High']
+JOURNAL_TEXTS = [
+    "Deadlines everywhere and I could not sleep, feeling anxious.",
+    "Calm morning, a long walk and coffee with friends. Grateful.",
+    "Okay day. Some meetings, some focus time, nothing special.",
+]
+
+
+def random_png(rng, size):
+    """A grayscale noise image; every request uploads a distinct file"""
+    buffer = BytesIO()
+    Image.fromarray(rng.integers(0, 256, (size, size), dtype=np.uint8)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+# Each scenario returns (method, path, form fields, files) for one request
+def home_request(rng, args):
+    return 'GET', '/', {}, {}
+
+
+def history_request(rng, args):
+    return 'GET', '/history/', {}, {}
+
+
+def trends_request(rng, args):
+    return 'GET', '/trends-api/?days=30', {}, {}
+
+
+def predict_request(rng, args):
+    return 'POST', '/predict/', {}, {'face_image': ('face.png', random_png(rng, args.image_size))}
+
+
+def journal_request(rng, args):
+    text = JOURNAL_TEXTS[int(rng.integers(len(JOURNAL_TEXTS)))]
+    return 'POST', '/journal/', {'text': text}, {}
+
+
+def compare_request(rng, args):
+    return 'POST', '/compare/', {}, {
+        'before_image': ('before.png', random_png(rng, args.image_size)),
+        'after_image': ('after.png', random_png(rng, args.image_size)),
+    }
+
+
+# Scenario name -> (URL name the metrics middleware records it under, request builder)
+SCENARIOS = {
+    'home': ('home', home_request),
+    'history': ('history', history_request),
+    'trends_api': ('trends_api', trends_request),
+    'predict': ('predict', predict_request),
+    'journal': ('journal', journal_request),
+    'compare': ('compare', compare_request),
+}
+
+
+def seed_database(args):
+    """Bulk-insert the configured history for every user; return the users"""
+    rng = np.random.default_rng(args.seed)
+    users = []
+    for index in range(args.users):
+        user = User.objects.create_user(f'bench-{index}', password='bench')
+        users.append(user)
+        StressPrediction.objects.bulk_create(
+            StressPrediction(
+                user=user, image=f'user_images/bench/{index}-{i}.png', stress_level=LEVELS[i % 3],
+                mood_tag='Neutral', confidence=int(rng.integers(40, 100)),
+            )
+            for i in range(args.predictions)
+        )
+        MoodJournal.objects.bulk_create(
+            MoodJournal(
+                user=user, text=JOURNAL_TEXTS[i % 3], text_sentiment='Neutral',
+                combined_stress_level=LEVELS[i % 3], stress_keywords=['deadline'],
+            )
+            for i in range(args.journals)
+        )
+        StressComparison.objects.bulk_create(
+            StressComparison(
+                user=user, before_image='a.png', after_image='b.png', before_stress_level='High',
+                after_stress_level='Low', before_confidence=70, after_confidence=70, improvement_score=66,
+            )
+            for _ in range(args.comparisons)
+        )
+        UserProfile.objects.create(
+            user=user, total_predictions=args.predictions, total_journal_entries=args.journals,
+            total_comparisons=args.comparisons,
+        )
+    DailyStressRollup.rebuild()
+    return users
+
+
+class ClientTransport:
+    """Requests through the Django test client, logged in as one user"""
+
+    def __init__(self, user, base_url=None):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def send(self, method, path, fields, files):
+        if method == 'GET':
+            return self.client.get(path).status_code
+        data = dict(fields)
+        for name, (filename, content) in files.items():
+            data[name] = SimpleUploadedFile(filename, content)
+        return self.client.post(path, data).status_code
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpTransport:
+    """Requests over a real socket, with a session cookie and CSRF token"""
+
+    def __init__(self, user, base_url):
+        self.base_url = base_url
+        client = Client()
+        client.force_login(user)
+        csrf_secret = get_random_string(32)
+        self.headers = {
+            'Cookie': f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; "
+                      f"{settings.CSRF_COOKIE_NAME}={csrf_secret}",
+            'X-CSRFToken': csrf_secret,
+        }
+        self.opener = urllib.request.build_opener(_NoRedirects)
+
+    def send(self, method, path, fields, files):
+        headers = dict(self.headers)
+        body = None
+        if method == 'POST':
+            boundary = uuid.uuid4().hex
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+            body = self.multipart(boundary, fields, files)
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+    @staticmethod
+    def multipart(boundary, fields, files):
+        parts = []
+        for name, value in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        for name, (filename, content) in files.items():
+            header = (
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n'
+            )
+            parts.append(header.encode() + content + b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode())
+        return b''.join(parts)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def start_server():
+    """Serve the project on a free local port from a background thread"""
+    server = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler, allow_reuse_address=False)
+    server.set_app(get_wsgi_application())
+    thread = threading.Thread(target=server.serve_forever, name='bench-http', daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def query_histogram(view):
+    return metrics.histogram('stress_request_db_queries', '', (), {'view': view})
+
+
+def run_scenario(name, args, users, transport_class, base_url):
+    """Send args.requests requests to one scenario from args.concurrency threads"""
+    view, build_request = SCENARIOS[name]
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    remaining = [args.requests]
+
+    def worker(index):
+        rng = np.random.default_rng([args.seed, index, list(SCENARIOS).index(name)])
+        transport = transport_class(users[index % len(users)], base_url)
+        for _ in range(args.warmup):
+            transport.send(*build_request(rng, args))
+        barrier.wait()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            request = build_request(rng, args)
+            started = time.perf_counter()
+            status = transport.send(*request)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(status)
+        connections.close_all()
+
+    barrier = threading.Barrier(args.concurrency + 1)
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    queries_before = query_histogram(view).snapshot()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    queries_after = query_histogram(view).snapshot()
+
+    measured = queries_after['count'] - queries_before['count']
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': sum(1 for status in statuses if status >= 400),
+        'p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies_ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies_ms, 99)), 3),
+        'mean_ms': round(float(latencies_ms.mean()), 3),
+        'max_ms': round(float(latencies_ms.max()), 3),
+        'throughput_rps': round(len(latencies) / wall, 2),
+        'queries_per_request': (
+            round((queries_after['sum'] - queries_before['sum']) / measured, 2) if measured else None
+        ),
+    }
+
+
+def git_revision():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root, capture_output=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"Compared with {baseline['meta'].get('commit') or baseline_path}:", file=sys.stderr)
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous is None:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'throughput_rps'):
+            if previous[key]:
+                changes.append(f"{key} {previous[key]:g} -> {current[key]:g} ({(current[key] - previous[key]) / previous[key]:+.1%})")
+        print(f"  {name:>10}: " + ', '.join(changes), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--predictions', type=int, default=200, help="Predictions seeded per user")
+    parser.add_argument('--journals', type=int, default=50, help="Journal entries seeded per user")
+    parser.add_argument('--comparisons', type=int, default=20, help="Comparisons seeded per user")
+    parser.add_argument('--requests', type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument('--warmup', type=int, default=3, help="Unmeasured requests per client thread first")
+    parser.add_argument('--concurrency', type=int, default=4, help="Client threads")
+    parser.add_argument('--transport', choices=['client', 'http'], default='client')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="Comma-separated subset of scenarios")
+    parser.add_argument('--image-size', type=int, default=256, help="Side of uploaded images in pixels")
+    parser.add_argument('--model', help="Model artifact to serve instead of the registry's active one")
+    parser.add_argument('--inline-predictions', action='store_true', help="Score /predict/ uploads in the request")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the JSON results here instead of stdout")
+    parser.add_argument('--baseline', help="Earlier results to compare against")
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.model:
+        inference._engine = inference.InferenceEngine(
+            args.model,
+            input_size=settings.STRESS_MODEL_INPUT_SIZE,
+            max_batch_size=settings.STRESS_BATCH_MAX_SIZE,
+            max_wait_ms=settings.STRESS_BATCH_MAX_WAIT_MS,
+        )
+    try:
+        inference.get_engine().load()
+        model_version = inference.get_engine().model_version
+    except inference.ModelNotAvailable as e:
+        print(f"warning: {e}; scenarios that need the model will report errors", file=sys.stderr)
+        model_version = None
+
+    # The load itself makes requests slow; the per-request warnings would drown the report
+    logging.getLogger('stressdetector.slow_requests').setLevel(logging.ERROR)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    server = None
+    try:
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, ALLOWED_HOSTS=['*'], STRESS_BACKGROUND_PREDICTIONS=not args.inline_predictions,
+        ):
+            users = seed_database(args)
+            transport_class, base_url = ClientTransport, None
+            if args.transport == 'http':
+                server, base_url = start_server()
+                transport_class = HttpTransport
+            results = {}
+            for name in scenarios:
+                results[name] = run_scenario(name, args, users, transport_class, base_url)
+                print(f"{name}: p50 {results[name]['p50_ms']} ms, {results[name]['throughput_rps']} req/s", file=sys.stderr)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    commit, dirty = git_revision()
+    report = {
+        'meta': {
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'model_version': model_version,
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        },
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        print_comparison(report, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Page weight and decode time of thumbnails versus full-resolution uploads.
+
+Usage:
+    python scripts/bench_thumbnails.py [--images 20] [--width 3024] [--height 4032] [--size small]
+
+Writes synthetic phone-sized JPEG photos to a temporary media root, builds
+their thumbnails, and compares the bytes a history page would download and
+the time to decode every image on it, before and after.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'SmartStressDetection.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.files.storage import default_storage  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from stressdetector import thumbnails  # noqa: E402
+
+
+def synthetic_photo(width, height, rng):
+    """A smooth gradient with sensor-like noise, which compresses like a photo"""
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    noise = rng.normal(0, 6, size=(height, width, 3))
+    buffer = BytesIO()
+    Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def decode_all(paths):
+    started = time.perf_counter()
+    for path in paths:
+        with Image.open(path) as image:
+            image.load()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=20, help="Images on the page")
+    parser.add_argument('--width', type=int, default=3024)
+    parser.add_argument('--height', type=int, default=4032)
+    parser.add_argument('--size', default='small', help="Thumbnail size name")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+        photo = synthetic_photo(args.width, args.height, rng)
+        names = []
+        for i in range(args.images):
+            name = f'user_images/bench/{i:032x}.jpg'
+            path = default_storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(photo)
+            names.append(name)
+
+        started = time.perf_counter()
+        targets = [thumbnails.generate(name, args.size) for name in names]
+        generate_seconds = time.perf_counter() - started
+
+        originals = [default_storage.path(name) for name in names]
+        derived = [default_storage.path(target) for target in targets]
+        original_bytes = sum(os.path.getsize(path) for path in originals)
+        thumbnail_bytes = sum(os.path.getsize(path) for path in derived)
+        original_decode = decode_all(originals)
+        thumbnail_decode = decode_all(derived)
+
+    print(f"{args.images} images of {args.width}x{args.height}, thumbnail size {args.size!r}")
+    print(f"generate: {generate_seconds / args.images * 1000:.1f} ms per thumbnail (first request only)")
+    print(
+        f"page weight: {original_bytes / 2**20:.1f} MiB -> {thumbnail_bytes / 2**10:.1f} KiB "
+        f"({original_bytes / thumbnail_bytes:,.0f}x smaller)"
+    )
+    print(
+        f"decode: {original_decode * 1000:.0f} ms -> {thumbnail_decode * 1000:.1f} ms "
+        f"({original_decode / thumbnail_decode:,.0f}x faster)"
+    )
+
+
+if __name__ == '__main__':
+    main()
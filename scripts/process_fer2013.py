@@ -0,0 +1,193 @@
+"""
+Stream the FER2013 CSV into fixed-shape, memory-mappable NumPy arrays.
+
+Usage:
+    python scripts/process_fer2013.py data/fer2013.csv data/fer2013 [--chunk-rows 2048] [--workers N]
+
+The CSV (emotion,pixels,Usage with 48x48 space-separated pixel strings) is
+read in chunks of raw lines and each chunk is parsed in a worker process with
+vectorised NumPy, so memory stays bounded by the chunks in flight rather than
+the size of the dataset. Written to the output directory:
+
+    images.npy     uint8 (N, 48, 48) grayscale faces
+    labels.npy     uint8 (N,) stress class: 0 Low, 1 Medium, 2 High
+    emotions.npy   uint8 (N,) original FER2013 emotion ids
+    usage.npy      uint8 (N,) 0 Training, 1 PublicTest, 2 PrivateTest
+    metadata.json  class names and row counts
+
+Training opens the .npy files with np.load(..., mmap_mode='r').
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+IMAGE_SIZE = 48
+PIXELS_PER_ROW = IMAGE_SIZE * IMAGE_SIZE
+
+EMOTIONS = ['Angry', 'Disgust', 'Fear', 'Happy', 'Sad', 'Surprise', 'Neutral']
+
+# Same class order as stressdetector.inference.STRESS_LEVELS
+STRESS_CLASSES = ['Low', 'Medium', 'High']
+EMOTION_TO_STRESS = np.array([
+    2,  # Angry -> High
+    2,  # Disgust -> High
+    2,  # Fear -> High
+    0,  # Happy -> Low
+    2,  # Sad -> High
+    1,  # Surprise -> Medium
+    1,  # Neutral -> Medium
+], dtype=np.uint8)
+
+USAGES = {b'Training': 0, b'PublicTest': 1, b'PrivateTest': 2}
+
+
+def count_rows(path):
+    """Count data rows the way read_chunks reads them: non-blank lines after the header"""
+    with open(path, 'rb') as f:
+        f.readline()
+        return sum(1 for line in f if line.strip())
+
+
+def read_chunks(path, chunk_rows, max_rows=None):
+    """Yield lists of raw CSV lines, skipping the header"""
+    remaining = max_rows
+    with open(path, 'rb') as f:
+        f.readline()
+        chunk = []
+        for line in f:
+            if not line.strip():
+                continue
+            chunk.append(line)
+            if remaining is not None:
+                remaining -= 1
+                if remaining == 0:
+                    break
+            if len(chunk) == chunk_rows:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def parse_pixels(fields):
+    """Parse space-separated 0-255 integers without splitting them in Python
+
+    Every number ends at a separator, so its last three digits can be
+    gathered by offsetting the separator positions.
+    """
+    buffer = np.frombuffer(b' '.join(fields) + b' ', dtype=np.uint8)
+    ends = np.flatnonzero(buffer == ord(' '))
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts
+
+    zero = ord('0')
+    values = buffer[ends - 1].astype(np.int16) - zero
+    values += np.where(lengths >= 2, buffer[ends - 2].astype(np.int16) - zero, 0) * 10
+    values += np.where(lengths >= 3, buffer[ends - 3].astype(np.int16) - zero, 0) * 100
+    if lengths.min(initial=1) < 1 or lengths.max(initial=1) > 3 or values.max(initial=0) > 255:
+        raise ValueError("Pixel field is not a list of 0-255 integers")
+    return values.astype(np.uint8)
+
+
+def parse_chunk(lines):
+    """Parse raw CSV lines into (images, emotions, usage) arrays"""
+    emotions = np.empty(len(lines), dtype=np.uint8)
+    usage = np.empty(len(lines), dtype=np.uint8)
+    pixel_fields = []
+    for i, line in enumerate(lines):
+        emotion, pixels, use = line.rstrip(b'\r\n').split(b',')
+        emotions[i] = int(emotion)
+        usage[i] = USAGES.get(use.strip(), 0)
+        pixel_fields.append(pixels.strip(b'"'))
+
+    pixels = parse_pixels(pixel_fields)
+    if pixels.size != len(lines) * PIXELS_PER_ROW:
+        raise ValueError(f"Expected {PIXELS_PER_ROW} pixels per row")
+    return pixels.reshape(len(lines), IMAGE_SIZE, IMAGE_SIZE), emotions, usage
+
+
+def process(csv_path, output_dir, chunk_rows=2048, workers=None, max_rows=None):
+    """Convert the CSV and return (rows, seconds)"""
+    started = time.perf_counter()
+    rows = count_rows(csv_path)
+    if max_rows is not None:
+        rows = min(rows, max_rows)
+
+    os.makedirs(output_dir, exist_ok=True)
+    images = np.lib.format.open_memmap(
+        os.path.join(output_dir, 'images.npy'), mode='w+', dtype=np.uint8,
+        shape=(rows, IMAGE_SIZE, IMAGE_SIZE),
+    )
+    emotions = np.lib.format.open_memmap(os.path.join(output_dir, 'emotions.npy'), mode='w+', dtype=np.uint8, shape=(rows,))
+    usage = np.lib.format.open_memmap(os.path.join(output_dir, 'usage.npy'), mode='w+', dtype=np.uint8, shape=(rows,))
+
+    workers = workers or os.cpu_count() or 1
+    written = 0
+
+    def store(offset, result):
+        chunk_images, chunk_emotions, chunk_usage = result
+        end = offset + len(chunk_images)
+        images[offset:end] = chunk_images
+        emotions[offset:end] = chunk_emotions
+        usage[offset:end] = chunk_usage
+        return end
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Bound the chunks in flight so memory does not grow with the file
+        in_flight = deque()
+        offset = 0
+        for chunk in read_chunks(csv_path, chunk_rows, max_rows):
+            in_flight.append((offset, pool.submit(parse_chunk, chunk)))
+            offset += len(chunk)
+            if len(in_flight) >= workers * 2:
+                chunk_offset, future = in_flight.popleft()
+                written = max(written, store(chunk_offset, future.result()))
+        while in_flight:
+            chunk_offset, future = in_flight.popleft()
+            written = max(written, store(chunk_offset, future.result()))
+
+    labels = EMOTION_TO_STRESS[emotions]
+    np.save(os.path.join(output_dir, 'labels.npy'), labels)
+    for array in (images, emotions, usage):
+        array.flush()
+
+    with open(os.path.join(output_dir, 'metadata.json'), 'w') as f:
+        json.dump({
+            'rows': int(written),
+            'image_shape': [IMAGE_SIZE, IMAGE_SIZE],
+            'stress_classes': STRESS_CLASSES,
+            'emotions': EMOTIONS,
+            'emotion_to_stress': EMOTION_TO_STRESS.tolist(),
+            'class_counts': np.bincount(labels, minlength=len(STRESS_CLASSES)).tolist(),
+            'usage_counts': {name.decode(): int((usage == value).sum()) for name, value in USAGES.items()},
+        }, f, indent=2)
+
+    return written, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv_path', help="Path to fer2013.csv")
+    parser.add_argument('output_dir', help="Directory for the .npy files")
+    parser.add_argument('--chunk-rows', type=int, default=2048, help="CSV rows parsed per task")
+    parser.add_argument('--workers', type=int, default=None, help="Parser processes (default: all cores)")
+    parser.add_argument('--max-rows', type=int, default=None, help="Only convert the first N rows")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.csv_path):
+        sys.exit(f"CSV not found: {args.csv_path}")
+
+    rows, seconds = process(args.csv_path, args.output_dir, args.chunk_rows, args.workers, args.max_rows)
+    print(f"Wrote {rows} rows to {args.output_dir} in {seconds:.2f}s ({rows / seconds:,.0f} rows/sec)")
+
+
+if __name__ == '__main__':
+    main()
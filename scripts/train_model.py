@@ -0,0 +1,243 @@
+"""
+Train the stress classifier out of core on a CPU-only machine.
+
+Usage:
+    python scripts/train_model.py data/fer2013 [--epochs 30] [--batch-size 128] [--workers N]
+    python scripts/train_model.py data/fer2013 --max-rows 512 --epochs 1    # smoke run
+
+Reads the arrays written by scripts/process_fer2013.py through memory maps,
+so only the current mini-batches are ever in RAM. Batches are drawn in a new
+shuffled order every epoch and augmented in parallel worker processes. The
+trained model is written to a versioned directory:
+
+    ml_models/<version>/model.keras
+    ml_models/<version>/metadata.json   (metrics, history, throughput)
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+STRESS_CLASSES = ['Low', 'Medium', 'High']
+TRAINING_USAGE = 0
+VALIDATION_USAGE = 1
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def augment(batch, rng):
+    """Random flips, shifts and brightness/contrast jitter for a (n, h, w) batch"""
+    n = len(batch)
+    flip = rng.random(n) < 0.5
+    batch[flip] = batch[flip, :, ::-1]
+
+    # Shift each image by up to 4 pixels, filling the edge with its mean
+    for i, (dy, dx) in enumerate(rng.integers(-4, 5, size=(n, 2))):
+        if dy or dx:
+            shifted = np.full_like(batch[i], batch[i].mean())
+            src = batch[i][max(0, -dy):batch.shape[1] - max(0, dy), max(0, -dx):batch.shape[2] - max(0, dx)]
+            shifted[max(0, dy):max(0, dy) + src.shape[0], max(0, dx):max(0, dx) + src.shape[1]] = src
+            batch[i] = shifted
+
+    contrast = rng.uniform(0.8, 1.2, size=(n, 1, 1)).astype(np.float32)
+    brightness = rng.uniform(-0.1, 0.1, size=(n, 1, 1)).astype(np.float32)
+    means = batch.mean(axis=(1, 2), keepdims=True)
+    np.clip((batch - means) * contrast + means + brightness, 0.0, 1.0, out=batch)
+    return batch
+
+
+def build_dataset_class(keras):
+    class MemmapBatches(keras.utils.PyDataset):
+        """Shuffled mini-batches read lazily from the memory-mapped arrays"""
+
+        def __init__(self, data_dir, indices, batch_size, augment_images, seed=0, **kwargs):
+            super().__init__(**kwargs)
+            self.data_dir = data_dir
+            self.indices = np.asarray(indices)
+            self.batch_size = batch_size
+            self.augment_images = augment_images
+            self.seed = seed
+            self.epoch = 0
+            self._arrays = None
+            self._order = self._shuffled()
+
+        def __getstate__(self):
+            # Worker processes open their own memory maps instead of
+            # receiving a pickled copy of the data
+            state = self.__dict__.copy()
+            state['_arrays'] = None
+            return state
+
+        def _shuffled(self):
+            if not self.augment_images:
+                return self.indices
+            return np.random.default_rng((self.seed, self.epoch)).permutation(self.indices)
+
+        @property
+        def arrays(self):
+            if self._arrays is None:
+                self._arrays = (
+                    np.load(os.path.join(self.data_dir, 'images.npy'), mmap_mode='r'),
+                    np.load(os.path.join(self.data_dir, 'labels.npy'), mmap_mode='r'),
+                )
+            return self._arrays
+
+        def __len__(self):
+            return math.ceil(len(self.indices) / self.batch_size)
+
+        def __getitem__(self, index):
+            images, labels = self.arrays
+            # Sorted indices turn the gather into mostly sequential reads
+            rows = np.sort(self._order[index * self.batch_size:(index + 1) * self.batch_size])
+            batch = images[rows].astype(np.float32) / 255.0
+            if self.augment_images:
+                augment(batch, np.random.default_rng((self.seed, self.epoch, index)))
+            return batch[..., np.newaxis], labels[rows].astype(np.int32)
+
+        def on_epoch_end(self):
+            self.epoch += 1
+            self._order = self._shuffled()
+
+    return MemmapBatches
+
+
+def build_model(keras, input_shape, num_classes):
+    """Small CNN sized for 48x48 grayscale faces on CPU"""
+    layers = keras.layers
+    inputs = keras.Input(shape=input_shape)
+    x = inputs
+    for filters in (32, 64, 128):
+        x = layers.Conv2D(filters, 3, padding='same', use_bias=False)(x)
+        x = layers.BatchNormalization()(x)
+        x = layers.Activation('relu')(x)
+        x = layers.Conv2D(filters, 3, padding='same', use_bias=False)(x)
+        x = layers.BatchNormalization()(x)
+        x = layers.Activation('relu')(x)
+        x = layers.MaxPooling2D()(x)
+        x = layers.Dropout(0.25)(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    x = layers.Dense(128, activation='relu')(x)
+    x = layers.Dropout(0.5)(x)
+    outputs = layers.Dense(num_classes, activation='softmax')(x)
+
+    model = keras.Model(inputs, outputs)
+    model.compile(
+        optimizer=keras.optimizers.Adam(1e-3),
+        loss='sparse_categorical_crossentropy',
+        metrics=['accuracy'],
+    )
+    return model
+
+
+def split_indices(data_dir, max_rows=None, seed=0):
+    """Training and validation row indices, using FER2013's Usage column"""
+    usage = np.load(os.path.join(data_dir, 'usage.npy'), mmap_mode='r')
+    rows = len(usage) if max_rows is None else min(len(usage), max_rows)
+    usage = np.asarray(usage[:rows])
+
+    train = np.flatnonzero(usage == TRAINING_USAGE)
+    validation = np.flatnonzero(usage == VALIDATION_USAGE)
+    if len(validation) == 0 or len(train) == 0:
+        # Small smoke runs may not contain both splits; hold out 10%
+        order = np.random.default_rng(seed).permutation(rows)
+        cut = max(1, rows // 10)
+        validation, train = np.sort(order[:cut]), np.sort(order[cut:])
+    return train, validation
+
+
+def class_weights(data_dir, indices):
+    """Inverse-frequency weights so the dominant High class does not swamp training"""
+    labels = np.load(os.path.join(data_dir, 'labels.npy'), mmap_mode='r')
+    counts = np.bincount(np.asarray(labels[indices]), minlength=len(STRESS_CLASSES))
+    total = counts.sum()
+    return {i: float(total / (len(counts) * count)) for i, count in enumerate(counts) if count}
+
+
+def train(data_dir, output_dir, epochs=30, batch_size=128, workers=None, max_rows=None, seed=0):
+    """Train, evaluate and save a versioned model; return its directory"""
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import keras
+
+    keras.utils.set_random_seed(seed)
+    workers = workers or os.cpu_count() or 1
+
+    train_indices, validation_indices = split_indices(data_dir, max_rows, seed)
+    MemmapBatches = build_dataset_class(keras)
+    loader_options = {'workers': workers, 'use_multiprocessing': workers > 1, 'max_queue_size': workers * 2}
+    train_batches = MemmapBatches(data_dir, train_indices, batch_size, True, seed, **loader_options)
+    validation_batches = MemmapBatches(data_dir, validation_indices, batch_size, False, seed, **loader_options)
+
+    images = np.load(os.path.join(data_dir, 'images.npy'), mmap_mode='r')
+    model = build_model(keras, (*images.shape[1:], 1), len(STRESS_CLASSES))
+
+    throughput = []
+
+    class ThroughputLogger(keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.started = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            samples_per_sec = len(train_indices) / (time.perf_counter() - self.started)
+            throughput.append(samples_per_sec)
+            print(f"epoch {epoch + 1}: {samples_per_sec:,.0f} samples/sec")
+
+    history = model.fit(
+        train_batches,
+        validation_data=validation_batches,
+        epochs=epochs,
+        class_weight=class_weights(data_dir, train_indices),
+        callbacks=[ThroughputLogger()],
+        verbose=2,
+    )
+    validation_loss, validation_accuracy = model.evaluate(validation_batches, verbose=0)
+
+    version = time.strftime('%Y%m%d-%H%M%S')
+    model_dir = os.path.join(output_dir, version)
+    os.makedirs(model_dir, exist_ok=True)
+    model.save(os.path.join(model_dir, 'model.keras'))
+    with open(os.path.join(model_dir, 'metadata.json'), 'w') as f:
+        json.dump({
+            'version': version,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'data_dir': os.path.abspath(data_dir),
+            'input_shape': list(model.input_shape[1:]),
+            'classes': STRESS_CLASSES,
+            'train_rows': int(len(train_indices)),
+            'validation_rows': int(len(validation_indices)),
+            'epochs': epochs,
+            'batch_size': batch_size,
+            'metrics': {
+                'validation_loss': float(validation_loss),
+                'validation_accuracy': float(validation_accuracy),
+            },
+            'history': {key: [float(v) for v in values] for key, values in history.history.items()},
+            'samples_per_sec': throughput,
+        }, f, indent=2)
+    return model_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('data_dir', help="Directory written by scripts/process_fer2013.py")
+    parser.add_argument('--output', default=os.path.join(BASE_DIR, 'ml_models'), help="Directory for versioned models")
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--workers', type=int, default=None, help="Batch loading processes (default: all cores)")
+    parser.add_argument('--max-rows', type=int, default=None, help="Only train on the first N rows")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.data_dir, 'images.npy')):
+        sys.exit(f"No preprocessed arrays in {args.data_dir}; run scripts/process_fer2013.py first")
+
+    model_dir = train(args.data_dir, args.output, args.epochs, args.batch_size, args.workers, args.max_rows, args.seed)
+    print(f"Saved model to {model_dir}")
+    print(f"Serve it with: python manage.py activate_model {os.path.basename(model_dir)}")
+
+
+if __name__ == '__main__':
+    main()
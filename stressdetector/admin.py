@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     UserProfile, StressPrediction, MoodJournal, StressComparison,
-    DailyStreak, StressTip, BreathingExercise, MotivationalQuote, UserSession
+    DailyStressRollup, DailyStreak, StressTip, BreathingExercise, MotivationalQuote, UserSession, Job
 )
 
 @admin.register(UserProfile)
@@ -12,11 +12,18 @@ class UserProfileAdmin(admin.ModelAdmin):
 
 @admin.register(StressPrediction)
 class StressPredictionAdmin(admin.ModelAdmin):
-    list_display = ['user', 'stress_level', 'mood_tag', 'stress_type', 'confidence', 'created_at']
-    list_filter = ['stress_level', 'mood_tag', 'stress_type', 'created_at']
+    list_display = ['user', 'stress_level', 'mood_tag', 'stress_type', 'confidence', 'model_version', 'status', 'created_at']
+    list_filter = ['status', 'stress_level', 'mood_tag', 'stress_type', 'model_version', 'created_at']
     search_fields = ['user__username']
     readonly_fields = ['created_at']
 
+@admin.register(DailyStressRollup)
+class DailyStressRollupAdmin(admin.ModelAdmin):
+    list_display = ['user', 'day', 'stress_level', 'count']
+    list_filter = ['stress_level', 'day']
+    search_fields = ['user__username']
+    readonly_fields = ['user', 'day', 'stress_level', 'count']
+
 @admin.register(MoodJournal)
 class MoodJournalAdmin(admin.ModelAdmin):
     list_display = ['user', 'get_title', 'text_sentiment', 'combined_stress_level', 'created_at']
@@ -63,3 +70,10 @@ class UserSessionAdmin(admin.ModelAdmin):
     list_filter = ['login_time']
     search_fields = ['user__username']
     readonly_fields = ['login_time', 'duration']
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'status', 'attempts', 'max_attempts', 'user', 'worker', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    search_fields = ['user__username', 'error']
+    readonly_fields = ['created_at', 'started_at', 'finished_at', 'leased_until', 'worker']
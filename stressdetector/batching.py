@@ -0,0 +1,138 @@
+"""
+Dynamic micro-batching for concurrent predictions.
+
+Request threads hand their preprocessed image to a MicroBatcher and block on
+a future. A single background thread collects requests until either the
+batch is full or the oldest request has waited ``max_wait_ms``, stacks them
+into one tensor, runs one forward pass and hands each caller its own row.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from . import metrics
+
+batch_size_histogram = metrics.histogram(
+    'stress_inference_batch_size',
+    'Number of images per forward pass',
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+batch_wait_histogram = metrics.histogram(
+    'stress_inference_batch_wait_seconds',
+    'Time a request waited in the queue before its batch ran',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25),
+)
+
+
+class MicroBatcher:
+    """Groups concurrent single-image requests into batched forward passes"""
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, array):
+        """Queue one model input and return a future for its output row
+
+        Returns None once the batcher is closed.
+        """
+        if self._closed:
+            return None
+        self._ensure_worker()
+        future = Future()
+        with self._start_lock:
+            if self._closed:
+                return None
+            self._queue.put((array, future, time.perf_counter()))
+        return future
+
+    def __call__(self, array):
+        """Run one model input through the batcher and wait for its output row"""
+        future = self.submit(array)
+        if future is None:
+            # Closed: run unbatched so late callers still get an answer
+            return self.predict_fn(array[np.newaxis])[0]
+        return future.result()
+
+    def close(self):
+        """Stop the worker thread once everything already queued has run"""
+        with self._start_lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so a pre-forked worker starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            # close() may have run since submit() checked; never restart then
+            if self._closed:
+                return
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='stress-micro-batcher', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        """Block for the first request, then gather more until full or timed out
+
+        Returns (batch, stop), where stop means close() was called.
+        """
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                break
+            started = time.perf_counter()
+            batch_size_histogram.observe(len(batch))
+            for _, _, enqueued in batch:
+                batch_wait_histogram.observe(started - enqueued)
+
+            try:
+                outputs = self.predict_fn(np.stack([array for array, _, _ in batch]))
+            except Exception as exc:
+                for _, future, _ in batch:
+                    future.set_exception(exc)
+                continue
+
+            for (_, future, _), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+def stats():
+    """Snapshot of the batch-size and wait-time histograms"""
+    return {
+        'batch_size': batch_size_histogram.snapshot(),
+        'wait_seconds': batch_wait_histogram.snapshot(),
+    }
@@ -0,0 +1,83 @@
+"""
+In-process pools of tips, breathing exercises and quotes for the home page.
+
+Active content is loaded once per process and tips are grouped by stress
+level up front, so a warm home page picks its content without touching the
+database. Admin edits fire signals that bump a generation number in the
+cache; every process compares it on access and reloads when it has moved.
+"""
+import random
+import threading
+
+from django.core.cache import cache
+
+from .models import BreathingExercise, MotivationalQuote, StressPrediction, StressTip
+
+GENERATION_KEY = 'stressdetector:content_generation'
+
+STRESS_LEVELS = [level for level, _ in StressPrediction.STRESS_LEVELS]
+
+
+def _sample(items, k):
+    # Sampling indices from a range keeps the cost at O(k) for large pools
+    return [items[i] for i in random.sample(range(len(items)), min(k, len(items)))]
+
+
+class ContentPool:
+    """Active content, with tips pre-grouped by the stress level they suit"""
+
+    def __init__(self, tips, exercises, quotes):
+        self.tips = tips
+        self.tips_by_level = {
+            level: [tip for tip in tips if tip.stress_level in (level, 'All')]
+            for level in STRESS_LEVELS
+        }
+        self.exercises = exercises
+        self.quotes = quotes
+
+    @classmethod
+    def load(cls):
+        return cls(
+            list(StressTip.objects.filter(is_active=True)),
+            list(BreathingExercise.objects.filter(is_active=True)),
+            list(MotivationalQuote.objects.filter(is_active=True)),
+        )
+
+    def sample_tips(self, stress_level=None, k=3):
+        """Up to k distinct tips for a stress level (any level if None)"""
+        return _sample(self.tips_by_level.get(stress_level, self.tips), k)
+
+    def random_exercise(self):
+        return random.choice(self.exercises) if self.exercises else None
+
+    def random_quote(self):
+        return random.choice(self.quotes) if self.quotes else None
+
+
+_pool = None
+_pool_generation = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return this process's content pool, reloading it if content changed"""
+    global _pool, _pool_generation
+    generation = cache.get(GENERATION_KEY, 0)
+    if _pool is None or _pool_generation != generation:
+        with _pool_lock:
+            if _pool is None or _pool_generation != generation:
+                _pool = ContentPool.load()
+                _pool_generation = generation
+    return _pool
+
+
+def invalidate():
+    """Make every process reload its content pool on next access"""
+    global _pool
+    cache.add(GENERATION_KEY, 0, None)
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # The key was evicted between add() and incr()
+        cache.set(GENERATION_KEY, 1, None)
+    _pool = None
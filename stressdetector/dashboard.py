@@ -0,0 +1,61 @@
+"""
+Cached aggregates for the home dashboard.
+
+The weekly chart is built from the user's prediction rollup, cached per user
+and day, and dropped from the cache by signals whenever a StressPrediction is
+saved or deleted. Journal entries are left out until they carry a real
+score: their combined_stress_level is still a fixed placeholder.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import DailyStressRollup
+
+# Chart score for each stress level, on the chart's 0-100 scale
+STRESS_SCORES = {'Low': 33, 'Medium': 67, 'High': 100}
+
+CHART_DAYS = 7
+
+
+def weekly_chart_key(user_id, day=None):
+    day = day or timezone.localdate()
+    return f'stressdetector:weekly_chart:{user_id}:{day.isoformat()}'
+
+
+def invalidate_weekly_chart(user_id):
+    cache.delete(weekly_chart_key(user_id))
+
+
+def build_weekly_chart(user_id):
+    """Average stress score per day for the last seven days (None for no data)"""
+    end_date = timezone.localdate()
+    start_date = end_date - timedelta(days=CHART_DAYS - 1)
+
+    totals = {}
+    for day, level, count in DailyStressRollup.objects.filter(
+        user_id=user_id,
+        day__range=[start_date, end_date]
+    ).values_list('day', 'stress_level', 'count'):
+        score, entries = totals.get(day, (0, 0))
+        totals[day] = (score + STRESS_SCORES.get(level, 0) * count, entries + count)
+
+    labels, data = [], []
+    for i in range(CHART_DAYS):
+        day = start_date + timedelta(days=i)
+        labels.append(day.strftime('%a'))
+        score, entries = totals.get(day, (0, 0))
+        data.append(round(score / entries) if entries else None)
+    return {'labels': labels, 'data': data}
+
+
+def weekly_chart(user_id):
+    """Cached weekly chart data for the home page"""
+    key = weekly_chart_key(user_id)
+    chart = cache.get(key)
+    if chart is None:
+        chart = build_weekly_chart(user_id)
+        cache.set(key, chart, settings.STRESS_DASHBOARD_CACHE_TIMEOUT)
+    return chart
@@ -0,0 +1,107 @@
+"""
+Streaming export of a user's full stress history as NDJSON or CSV.
+
+Rows are read with values_list(...).iterator(), so the database driver hands
+them over in chunks and no model instances or whole result sets are kept.
+Encoded lines are gathered into buffers of roughly BUFFER_SIZE bytes before
+being yielded, which keeps the per-chunk overhead of StreamingHttpResponse
+low while memory stays bounded by the chunk and buffer sizes, not by how
+long the history is.
+"""
+import csv
+import json
+
+from .models import MoodJournal, StressComparison, StressPrediction
+
+CHUNK_SIZE = 2000
+BUFFER_SIZE = 64 * 1024
+
+# Record type -> (model, exported fields), in export order
+RECORD_TYPES = {
+    'prediction': (StressPrediction, [
+        'id', 'created_at', 'stress_level', 'mood_tag', 'stress_type', 'confidence', 'model_version', 'image',
+    ]),
+    'journal': (MoodJournal, [
+        'id', 'created_at', 'title', 'text', 'text_sentiment', 'image_stress_level',
+        'combined_stress_level', 'stress_keywords', 'image',
+    ]),
+    'comparison': (StressComparison, [
+        'id', 'created_at', 'before_stress_level', 'after_stress_level', 'before_confidence',
+        'after_confidence', 'improvement_score', 'comparison_notes', 'before_image', 'after_image',
+    ]),
+}
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def csv_columns():
+    """CSV header: the record type, then every exported field once"""
+    columns = ['record_type']
+    for _, fields in RECORD_TYPES.values():
+        columns.extend(field for field in fields if field not in columns)
+    return columns
+
+
+def iter_records(user_id, chunk_size=CHUNK_SIZE):
+    """Yield (record_type, fields, values) for every row the user owns, oldest first"""
+    for record_type, (model, fields) in RECORD_TYPES.items():
+        rows = model.objects.filter(user_id=user_id).order_by('created_at', 'id').values_list(*fields)
+        for values in rows.iterator(chunk_size=chunk_size):
+            yield record_type, fields, values
+
+
+def _buffered(lines, buffer_size=BUFFER_SIZE):
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def _json_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def ndjson_lines(user_id, chunk_size=CHUNK_SIZE):
+    """One JSON object per line, tagged with its record type"""
+    for record_type, fields, values in iter_records(user_id, chunk_size):
+        record = {'record_type': record_type}
+        record.update((field, _json_value(value)) for field, value in zip(fields, values))
+        yield json.dumps(record) + '\n'
+
+
+class _LineBuffer:
+    """File-like target that hands back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(user_id, chunk_size=CHUNK_SIZE):
+    """A header row, then one row per record with blanks for other types' columns"""
+    columns = csv_columns()
+    positions = {column: i for i, column in enumerate(columns)}
+    writer = csv.writer(_LineBuffer())
+
+    yield writer.writerow(columns)
+    for record_type, fields, values in iter_records(user_id, chunk_size):
+        row = [''] * len(columns)
+        row[0] = record_type
+        for field, value in zip(fields, values):
+            if isinstance(value, list):
+                value = json.dumps(value)
+            row[positions[field]] = _json_value(value)
+        yield writer.writerow(row)
+
+
+def stream(user_id, export_format, chunk_size=None, buffer_size=None):
+    """Buffered text chunks of the user's history in 'ndjson' or 'csv' format"""
+    lines = ndjson_lines if export_format == 'ndjson' else csv_lines
+    return _buffered(lines(user_id, chunk_size or CHUNK_SIZE), buffer_size or BUFFER_SIZE)
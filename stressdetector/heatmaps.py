@@ -0,0 +1,191 @@
+"""
+Face heatmaps showing which regions drove a stress prediction.
+
+A saliency map costs several forward (and backward) passes, so it is never
+computed on the prediction request. The first time a heatmap is viewed it
+is queued on a background thread, and the viewer gets a "pending" answer
+until it is ready. The result is a small WebP overlay of the face crop,
+stored at MEDIA_ROOT/heatmaps/<model_version>/<prediction id>.webp and
+served from there on every later view.
+
+If generating a heatmap fails (an unreadable image, say), the failure is
+remembered per prediction and model version and reported on later views,
+rather than queueing the same doomed job on every poll.
+
+Keras models on the TensorFlow backend get a gradient saliency map; any
+other model falls back to occlusion, which only needs forward passes.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from . import inference, metrics
+
+logger = logging.getLogger(__name__)
+
+HEATMAP_DIR = 'heatmaps'
+OCCLUSION_PATCH = 8
+OCCLUSION_STRIDE = 4
+# Failed (prediction, version) pairs remembered per process, oldest dropped first
+MAX_FAILURES_KEPT = 1000
+
+heatmap_seconds = metrics.histogram(
+    'stress_heatmap_seconds',
+    'Time to compute and store one face heatmap',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+_executor = None
+_pending = {}
+_failed = {}
+_lock = threading.Lock()
+
+
+class HeatmapFailed(Exception):
+    """Raised for a heatmap whose generation already failed"""
+
+
+def heatmap_name(prediction_id, model_version):
+    return f'{HEATMAP_DIR}/{model_version}/{prediction_id}.webp'
+
+
+def _normalize(saliency):
+    saliency = saliency - saliency.min()
+    peak = saliency.max()
+    return saliency / peak if peak > 0 else saliency
+
+
+def gradient_saliency(model, model_input, class_index):
+    """|d p(class) / d pixel| through a TensorFlow-backed Keras model"""
+    import tensorflow as tf
+
+    batch = tf.convert_to_tensor(model_input[np.newaxis])
+    with tf.GradientTape() as tape:
+        tape.watch(batch)
+        score = model(batch, training=False)[:, class_index]
+    gradients = np.abs(tape.gradient(score, batch).numpy()[0, ..., 0])
+    # Raw gradients are speckled; blur them into regions
+    return cv2.GaussianBlur(gradients, (5, 5), 0)
+
+
+def occlusion_saliency(engine, model_input, class_index):
+    """Drop in p(class) when each patch of the face is greyed out, from one batched pass"""
+    height, width = model_input.shape[:2]
+    positions = [
+        (y, x)
+        for y in range(0, height - OCCLUSION_PATCH + 1, OCCLUSION_STRIDE)
+        for x in range(0, width - OCCLUSION_PATCH + 1, OCCLUSION_STRIDE)
+    ]
+    batch = np.repeat(model_input[np.newaxis], len(positions) + 1, axis=0)
+    fill = model_input.mean()
+    for row, (y, x) in enumerate(positions, start=1):
+        batch[row, y:y + OCCLUSION_PATCH, x:x + OCCLUSION_PATCH] = fill
+
+    scores = engine.predict_proba(batch)[:, class_index]
+    drops = np.maximum(scores[0] - scores[1:], 0)
+    saliency = np.zeros((height, width), dtype=np.float32)
+    coverage = np.zeros((height, width), dtype=np.float32)
+    for drop, (y, x) in zip(drops, positions):
+        saliency[y:y + OCCLUSION_PATCH, x:x + OCCLUSION_PATCH] += drop
+        coverage[y:y + OCCLUSION_PATCH, x:x + OCCLUSION_PATCH] += 1
+    return saliency / np.maximum(coverage, 1)
+
+
+def saliency_map(engine, model_input, class_index):
+    """Saliency in [0, 1] at the model's input size"""
+    model = engine.load()
+    if not hasattr(model, 'predict_proba'):
+        try:
+            import keras
+            if keras.backend.backend() == 'tensorflow':
+                return _normalize(gradient_saliency(model, model_input, class_index))
+        except ImportError:
+            pass
+    return _normalize(occlusion_saliency(engine, model_input, class_index))
+
+
+def render_overlay(model_input, saliency, size, quality):
+    """Blend a colour-mapped saliency map over the face crop and encode it as WebP"""
+    face = cv2.resize((model_input[..., 0] * 255).astype(np.uint8), (size, size), interpolation=cv2.INTER_CUBIC)
+    heat = cv2.resize((saliency * 255).astype(np.uint8), (size, size), interpolation=cv2.INTER_CUBIC)
+    overlay = cv2.addWeighted(cv2.cvtColor(face, cv2.COLOR_GRAY2BGR), 0.55, cv2.applyColorMap(heat, cv2.COLORMAP_JET), 0.45, 0)
+    ok, encoded = cv2.imencode('.webp', overlay, [cv2.IMWRITE_WEBP_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode heatmap")
+    return encoded.tobytes()
+
+
+def generate(prediction, engine=None):
+    """Compute and store the heatmap of a prediction; return its storage name"""
+    engine = engine or inference.get_engine()
+    engine.load()
+    name = heatmap_name(prediction.pk, engine.model_version)
+    path = default_storage.path(name)
+    if os.path.exists(path):
+        return name
+
+    started = time.perf_counter()
+    model_input = engine.prepare(default_storage.path(prediction.image.name), out=np.empty((*engine.input_size, 1), np.float32))
+    # Explain the level that was recorded for this prediction
+    class_index = inference.STRESS_LEVELS.index(prediction.stress_level)
+    saliency = saliency_map(engine, model_input, class_index)
+    data = render_overlay(model_input, saliency, settings.STRESS_HEATMAP_SIZE, settings.STRESS_HEATMAP_QUALITY)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    heatmap_seconds.observe(time.perf_counter() - started)
+    return name
+
+
+def _run(key, prediction, engine):
+    try:
+        generate(prediction, engine)
+    except Exception as e:
+        logger.exception("Could not generate heatmap for prediction %s", prediction.pk)
+        with _lock:
+            _failed[key] = f"Could not generate heatmap: {e}"
+            while len(_failed) > MAX_FAILURES_KEPT:
+                del _failed[next(iter(_failed))]
+    finally:
+        with _lock:
+            _pending.pop(key, None)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.STRESS_HEATMAP_WORKERS, thread_name_prefix='stress-heatmap')
+    return _executor
+
+
+def get_or_schedule(prediction):
+    """Storage name of the prediction's heatmap, or None after queueing it
+
+    Raises HeatmapFailed if generating this heatmap has already failed.
+    """
+    engine = inference.get_engine()
+    engine.load()
+    name = heatmap_name(prediction.pk, engine.model_version)
+    if default_storage.exists(name):
+        return name
+
+    key = (prediction.pk, engine.model_version)
+    executor = _get_executor()
+    with _lock:
+        if key in _failed:
+            raise HeatmapFailed(_failed[key])
+        if key not in _pending:
+            _pending[key] = executor.submit(_run, key, prediction, engine)
+    return None
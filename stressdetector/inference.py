@@ -0,0 +1,396 @@
+"""
+Process-wide stress inference engine.
+
+The trained model is loaded once per worker process and kept warm, so only
+the first prediction in a process pays the cost of loading the artifact.
+When a different registry version is activated, the new model is loaded
+and warmed up on a background thread and then swapped in with a single
+reference assignment; requests already holding the old engine finish on it.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from . import preprocessing, profiling, registry, uploads
+from .batching import MicroBatcher
+
+logger = logging.getLogger(__name__)
+
+# Output order of the classifier, matching the labels written by
+# scripts/process_fer2013.py
+STRESS_LEVELS = ['Low', 'Medium', 'High']
+
+MOOD_TAGS = {
+    'Low': 'Happy',
+    'Medium': 'Neutral',
+    'High': 'Sad',
+}
+
+Prediction = namedtuple('Prediction', ['stress_level', 'mood_tag', 'confidence', 'model_version'])
+
+
+class ModelNotAvailable(Exception):
+    """Raised when the trained model artifact cannot be loaded"""
+
+
+def load_model(path):
+    """Load a model artifact from disk (.keras/.h5 with Keras, .pkl with pickle)"""
+    if not os.path.exists(path):
+        raise ModelNotAvailable(f"No trained model found at {path}")
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.keras', '.h5'):
+        try:
+            import keras
+        except ImportError as exc:
+            raise ModelNotAvailable("Keras is required to load this model") from exc
+        return keras.models.load_model(path, compile=False)
+    if extension in ('.pkl', '.pickle'):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    raise ModelNotAvailable(f"Unsupported model format: {extension}")
+
+
+def artifact_version(path):
+    """Version of a model artifact: from metadata.json beside it, else its hash"""
+    metadata_path = os.path.join(os.path.dirname(path), 'metadata.json')
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            version = json.load(f).get('version')
+        if version:
+            return str(version)
+
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()[:12]
+
+
+def _rss_bytes():
+    """Resident memory of this process, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def _weights_bytes(model):
+    weights = getattr(model, 'weights', None)
+    if not weights:
+        return None
+    return sum(int(np.prod(weight.shape)) * np.dtype(weight.dtype).itemsize for weight in weights)
+
+
+class InferenceEngine:
+    """Keeps one loaded model in memory and runs predictions against it"""
+
+    def __init__(self, model_path, input_size=(48, 48), max_batch_size=1, max_wait_ms=0, crop_face=True, version=None):
+        self.model_path = model_path
+        self.input_size = tuple(input_size)
+        self.crop_face = crop_face
+        # Registry version this engine was built for (None outside the registry)
+        self.registry_version = version
+        self.load_seconds = None
+        self.loaded_at = None
+        self.memory_bytes = None
+        self.weights_bytes = None
+        self.model_version = None
+        self._model = None
+        self._lock = threading.Lock()
+        # Concurrent single-image predictions share forward passes
+        self.batcher = None
+        if max_batch_size > 1:
+            self.batcher = MicroBatcher(self.predict_proba, max_batch_size, max_wait_ms)
+
+    @property
+    def is_loaded(self):
+        return self._model is not None
+
+    def load(self):
+        """Load and warm up the model on first use, then return the cached one"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    started = time.perf_counter()
+                    rss_before = _rss_bytes()
+                    model = load_model(self.model_path)
+                    # Run one dummy batch so graph tracing happens here and
+                    # not on the first real request
+                    self._forward(model, np.zeros((1, *self.input_size, 1), dtype=np.float32))
+                    self.load_seconds = time.perf_counter() - started
+                    if rss_before is not None:
+                        self.memory_bytes = _rss_bytes() - rss_before
+                    self.weights_bytes = _weights_bytes(model)
+                    self.model_version = self.registry_version or artifact_version(self.model_path)
+                    self.loaded_at = time.time()
+                    self._model = model
+                    logger.info("Loaded stress model %s from %s in %.2fs", self.model_version, self.model_path, self.load_seconds)
+        return self._model
+
+    def close(self):
+        """Stop the micro-batcher; callers still holding the engine run unbatched"""
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def stats(self):
+        """Load time and memory of this engine's model"""
+        return {
+            'version': self.model_version,
+            'path': self.model_path,
+            'load_seconds': self.load_seconds,
+            'loaded_at': self.loaded_at,
+            'memory_bytes': self.memory_bytes,
+            'weights_bytes': self.weights_bytes,
+        }
+
+    def prepare(self, image, out=None):
+        """Convert an upload, file path, PIL image or uint8 array into a model input"""
+        return preprocessing.preprocess(image, self.input_size, out=out, crop_face=self.crop_face)
+
+    def predict_proba(self, batch):
+        """Return class probabilities for a batch shaped (n, height, width, 1)"""
+        return self._forward(self.load(), batch)
+
+    def predict_batch(self, images):
+        """Predict a list of images with one forward pass"""
+        batch = np.empty((len(images), *self.input_size, 1), dtype=np.float32)
+        for row, image in zip(batch, images):
+            self.prepare(image, out=row)
+        return [self.decode(row) for row in self.predict_proba(batch)]
+
+    def predict(self, image):
+        """Return (stress_level, mood_tag, confidence) for a single image"""
+        if self.batcher is None:
+            return self.predict_batch([image])[0]
+        return self.decode(self.batcher(self.prepare(image)))
+
+    @staticmethod
+    def decode(probabilities):
+        """Turn one row of class probabilities into a prediction tuple"""
+        index = int(np.argmax(probabilities))
+        stress_level = STRESS_LEVELS[index]
+        confidence = int(round(float(probabilities[index]) * 100))
+        return stress_level, MOOD_TAGS[stress_level], confidence
+
+    @staticmethod
+    def _forward(model, batch):
+        if hasattr(model, 'predict_proba'):
+            # scikit-learn style estimators work on flat feature vectors
+            return np.asarray(model.predict_proba(batch.reshape(len(batch), -1)))
+        return np.asarray(model(batch, training=False))
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+_last_version_check = 0.0
+_swapping_to = None
+# (version, activation stamp) whose load failed; retried once it is activated again
+_failed_activation = None
+# Stats of engines this process has swapped out, oldest first
+_retired = []
+
+
+def _build_engine():
+    version, path = registry.active_artifact()
+    return InferenceEngine(
+        path,
+        input_size=settings.STRESS_MODEL_INPUT_SIZE,
+        max_batch_size=settings.STRESS_BATCH_MAX_SIZE,
+        max_wait_ms=settings.STRESS_BATCH_MAX_WAIT_MS,
+        version=version,
+    )
+
+
+def get_engine():
+    """Return the inference engine shared by this worker process
+
+    At most every STRESS_MODEL_CHECK_INTERVAL seconds this also checks the
+    registry and starts a background swap if another version was activated.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = _build_engine()
+    else:
+        _check_active_version()
+    return _engine
+
+
+def _check_active_version():
+    global _last_version_check, _swapping_to
+    now = time.monotonic()
+    if now - _last_version_check < settings.STRESS_MODEL_CHECK_INTERVAL:
+        return
+    _last_version_check = now
+
+    version = registry.active_version()
+    if version is None or version in (_engine.registry_version, _swapping_to):
+        return
+    if _failed_activation == (version, registry.activation_stamp()):
+        return
+    with _engine_lock:
+        if _swapping_to is not None:
+            return
+        _swapping_to = version
+    threading.Thread(target=swap_engine, name='stress-model-swap', daemon=True).start()
+
+
+def swap_engine():
+    """Load the registry's active model, warm it up, then swap it in
+
+    The current engine keeps serving until the new one is ready. Returns the
+    engine now in use.
+    """
+    global _engine, _swapping_to, _failed_activation
+    activation = (registry.active_version(), registry.activation_stamp())
+    try:
+        engine = _build_engine()
+        engine.load()
+    except Exception:
+        _failed_activation = activation
+        logger.exception("Could not load stress model version %s; still serving the old one", activation[0])
+        with _engine_lock:
+            _swapping_to = None
+        return _engine
+
+    with _engine_lock:
+        previous, _engine = _engine, engine
+        _swapping_to = None
+        _failed_activation = None
+    if previous is not None and previous is not engine:
+        if previous.is_loaded:
+            _retired.append(previous.stats())
+        previous.close()
+    logger.info("Now serving stress model %s", engine.model_version)
+    return engine
+
+
+def model_stats():
+    """The active registry version, the model being served and swapped-out ones"""
+    serving = _engine.stats() if _engine is not None and _engine.is_loaded else None
+    return {
+        'active_version': registry.active_version(),
+        'serving': serving,
+        'swapping_to': _swapping_to,
+        'retired': list(_retired),
+    }
+
+
+@profiling.timed('inference')
+def predict(image, content_hash=None):
+    """Predict the stress level of an image with the shared engine
+
+    Uploads that went through uploads.ingest(), or images whose content_hash
+    is passed in, are looked up by content hash and model version first, so
+    re-uploads of the same photo skip the model.
+    """
+    # Hold one engine for the whole request, even if a swap happens meanwhile
+    engine = get_engine()
+    engine.load()
+    digest = content_hash or getattr(image, 'content_hash', None)
+    if digest is None:
+        return Prediction(*engine.predict(image), engine.model_version)
+
+    key = _cache_key(engine, digest)
+    result = cache.get(key)
+    if result is not None:
+        uploads.cache_hits.inc()
+        return Prediction(*result, engine.model_version)
+
+    uploads.cache_misses.inc()
+    result = engine.predict(image)
+    cache.set(key, result, settings.STRESS_PREDICTION_CACHE_TIMEOUT)
+    return Prediction(*result, engine.model_version)
+
+
+_decode_pool = None
+
+
+def decode_pool():
+    """Threads that decode batch uploads; OpenCV releases the GIL while decoding"""
+    global _decode_pool
+    if _decode_pool is None:
+        with _engine_lock:
+            if _decode_pool is None:
+                workers = settings.STRESS_DECODE_WORKERS or os.cpu_count() or 1
+                _decode_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stress-decode')
+    return _decode_pool
+
+
+def _cache_key(engine, digest):
+    return f'stressdetector:prediction:{engine.model_version}:{digest}'
+
+
+@profiling.timed('inference')
+def predict_many(images):
+    """Predict several uploads at once, returning one result per image
+
+    Each result is a Prediction, or the ImageDecodeError raised for an
+    image that could not be decoded. Cached
+    images skip the model, the rest are decoded in parallel into one batch
+    and run through a single forward pass.
+    """
+    engine = get_engine()
+    engine.load()
+    results = [None] * len(images)
+
+    keys = {}
+    for i, image in enumerate(images):
+        digest = getattr(image, 'content_hash', None)
+        if digest is not None:
+            keys[i] = _cache_key(engine, digest)
+    cached = cache.get_many(set(keys.values()))
+    for i, key in keys.items():
+        if key in cached:
+            results[i] = Prediction(*cached[key], engine.model_version)
+    uploads.cache_hits.inc(sum(1 for result in results if result is not None))
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    uploads.cache_misses.inc(sum(1 for i in pending if i in keys))
+    batch = np.empty((len(pending), *engine.input_size, 1), dtype=np.float32)
+
+    def prepare(row):
+        try:
+            engine.prepare(images[pending[row]], out=batch[row])
+            return True
+        except preprocessing.ImageDecodeError as exc:
+            results[pending[row]] = exc
+            return False
+
+    decoded = [row for row, ok in enumerate(decode_pool().map(prepare, range(len(pending)))) if ok]
+    if decoded:
+        probabilities = engine.predict_proba(batch if len(decoded) == len(pending) else batch[decoded])
+        new_results = {}
+        for row, row_probabilities in zip(decoded, probabilities):
+            i = pending[row]
+            results[i] = Prediction(*engine.decode(row_probabilities), engine.model_version)
+            if i in keys:
+                new_results[keys[i]] = results[i][:3]
+        cache.set_many(new_results, settings.STRESS_PREDICTION_CACHE_TIMEOUT)
+    return results
+
+
+def preload_engine():
+    """Load the model at worker start so the first request is already warm"""
+    if not getattr(settings, 'STRESS_MODEL_PRELOAD', False):
+        return
+    try:
+        get_engine().load()
+    except (ModelNotAvailable, registry.UnknownModelVersion) as exc:
+        # A bad ACTIVE file must not stop the server from starting
+        logger.warning("Stress model not preloaded: %s", exc)
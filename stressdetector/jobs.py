@@ -0,0 +1,252 @@
+"""
+A background job queue that lives in the application database.
+
+Work that should not hold up a request is stored as a Job row and run by
+``python manage.py run_jobs``, so no broker or other outside service is
+needed. A worker claims a job with a conditional UPDATE, which is atomic on
+SQLite and PostgreSQL alike, and holds it under a lease that a heartbeat
+thread renews while the handler runs, so a job may take longer than the
+lease. If the worker dies mid-job the lease runs out and another worker runs
+the job again: delivery is at-least-once, so handlers must be idempotent. A job whose handler
+raises is retried with exponential backoff until max_attempts is reached.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connection
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from . import dashboard, inference, metrics, preprocessing, uploads
+from .models import Job, StressPrediction
+
+logger = logging.getLogger(__name__)
+
+Handler = namedtuple('Handler', ['run', 'on_failure'])
+
+HANDLERS = {}
+
+# Jobs looked at per claim attempt; losing a race moves on to the next one
+CLAIM_CANDIDATES = 10
+
+jobs_enqueued = metrics.counter('stress_jobs_enqueued_total', 'Background jobs added to the queue')
+jobs_failed = metrics.counter('stress_jobs_failed_total', 'Background jobs that used up their attempts')
+job_wait_histogram = metrics.histogram(
+    'stress_job_wait_seconds',
+    'Time from enqueueing a job to a worker starting it',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 30, 120),
+)
+job_latency_histogram = metrics.histogram(
+    'stress_job_latency_seconds',
+    'Time from enqueueing a job to its successful completion',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 30, 120),
+)
+
+
+class UnknownJobKind(LookupError):
+    """Raised for a job kind no handler is registered for"""
+
+
+def register(kind, on_failure=None):
+    """Register the decorated function as the handler of one kind of job
+
+    The handler is called with the job's payload. on_failure, if given, is
+    called with the payload and the last error once the job has used up
+    its attempts.
+    """
+    def decorator(run):
+        HANDLERS[kind] = Handler(run, on_failure)
+        return run
+    return decorator
+
+
+def enqueue(kind, payload, user=None, max_attempts=None):
+    """Add a job to the queue and return it"""
+    if kind not in HANDLERS:
+        raise UnknownJobKind(kind)
+    job = Job.objects.create(
+        kind=kind,
+        payload=payload,
+        user=user,
+        max_attempts=max_attempts or settings.STRESS_JOB_MAX_ATTEMPTS,
+    )
+    jobs_enqueued.inc()
+    return job
+
+
+def _claimable(now):
+    # Queued jobs that are due, and running jobs whose worker stopped renewing the lease
+    return Q(status=Job.QUEUED, run_after__lte=now) | Q(status=Job.RUNNING, leased_until__lt=now)
+
+
+def claim(worker, lease_seconds=None):
+    """Lease the next due job to a worker, or return None if there is none"""
+    lease = timedelta(seconds=lease_seconds or settings.STRESS_JOB_LEASE_SECONDS)
+    while True:
+        now = timezone.now()
+        candidates = list(
+            Job.objects.filter(_claimable(now)).order_by('run_after', 'pk').values_list('pk', flat=True)[:CLAIM_CANDIDATES]
+        )
+        if not candidates:
+            return None
+        for pk in candidates:
+            # Only one worker's UPDATE can match while the job is still claimable
+            claimed = Job.objects.filter(_claimable(now), pk=pk).update(
+                status=Job.RUNNING,
+                leased_until=now + lease,
+                worker=worker,
+                attempts=F('attempts') + 1,
+                started_at=now,
+            )
+            if not claimed:
+                continue
+            job = Job.objects.get(pk=pk)
+            if job.attempts > job.max_attempts:
+                # Its last attempt's worker died; give up instead of running it again
+                _give_up(job, worker, "Lease expired on the last attempt")
+                continue
+            return job
+
+
+def _update_if_held(job, worker, **changes):
+    """Apply changes only if the worker still holds the job's lease"""
+    held = Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=worker).update(**changes)
+    if not held:
+        logger.warning("Job %s was taken over by another worker after its lease ran out", job.pk)
+    return held
+
+
+def _give_up(job, worker, error):
+    if _update_if_held(job, worker, status=Job.FAILED, error=error, finished_at=timezone.now(), leased_until=None):
+        jobs_failed.inc()
+        handler = HANDLERS.get(job.kind)
+        if handler is not None and handler.on_failure is not None:
+            handler.on_failure(job.payload, error)
+
+
+@contextmanager
+def _lease_heartbeat(job, worker, lease):
+    """Renew the worker's lease on a job every third of the lease while the block runs"""
+    stop = threading.Event()
+
+    def renew():
+        try:
+            while not stop.wait(lease.total_seconds() / 3):
+                if not Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=worker).update(
+                    leased_until=timezone.now() + lease
+                ):
+                    return  # Taken over; _update_if_held discards this run's outcome
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=renew, name=f'stress-job-{job.pk}-lease', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_next(worker, lease_seconds=None):
+    """Claim and run one job; return it, or None if the queue had nothing due"""
+    job = claim(worker, lease_seconds)
+    if job is None:
+        return None
+    job_wait_histogram.observe((job.started_at - job.created_at).total_seconds())
+
+    handler = HANDLERS.get(job.kind)
+    lease = timedelta(seconds=lease_seconds or settings.STRESS_JOB_LEASE_SECONDS)
+    try:
+        if handler is None:
+            raise UnknownJobKind(job.kind)
+        with _lease_heartbeat(job, worker, lease):
+            handler.run(job.payload)
+    except Exception as e:
+        logger.exception("Job %s (%s) failed on attempt %s", job.pk, job.kind, job.attempts)
+        error = f"{type(e).__name__}: {e}"
+        if handler is None or job.attempts >= job.max_attempts:
+            _give_up(job, worker, error)
+        else:
+            backoff = settings.STRESS_JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+            _update_if_held(
+                job, worker, status=Job.QUEUED, error=error, leased_until=None,
+                run_after=timezone.now() + timedelta(seconds=backoff),
+            )
+        job.refresh_from_db()
+        return job
+
+    finished = timezone.now()
+    if _update_if_held(job, worker, status=Job.DONE, error='', finished_at=finished, leased_until=None):
+        job_latency_histogram.observe((finished - job.created_at).total_seconds())
+    job.refresh_from_db()
+    return job
+
+
+def work(worker, once=False, poll_interval=None, lease_seconds=None, max_jobs=None, on_job=None):
+    """Run jobs until stopped, or until the queue is empty if once is set
+
+    Returns the number of jobs run.
+    """
+    poll_interval = settings.STRESS_JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        # Like a request, each job starts on a healthy connection (unless the
+        # caller holds a transaction open, as tests do)
+        if not connection.in_atomic_block:
+            close_old_connections()
+        job = run_next(worker, lease_seconds)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        processed += 1
+        if on_job is not None:
+            on_job(job)
+    return processed
+
+
+def queue_stats():
+    """Queue depth by status, the age of the oldest due job and job latencies"""
+    now = timezone.now()
+    depth = dict(Job.objects.values_list('status').annotate(count=Count('pk')).order_by())
+    oldest = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).aggregate(oldest=Min('created_at'))['oldest']
+    return {
+        'depth': {status: depth.get(status, 0) for status, _ in Job.STATUSES},
+        'oldest_queued_seconds': (now - oldest).total_seconds() if oldest else None,
+        'wait_seconds': job_wait_histogram.snapshot(),
+        'latency_seconds': job_latency_histogram.snapshot(),
+    }
+
+
+def _fail_prediction(payload, error):
+    StressPrediction.objects.filter(pk=payload['prediction_id'], status=StressPrediction.PENDING).update(
+        status=StressPrediction.FAILED
+    )
+
+
+@register('predict', on_failure=_fail_prediction)
+def score_prediction(payload):
+    """Run the model on a pending prediction's stored image and fill in the result"""
+    prediction = StressPrediction.objects.filter(pk=payload['prediction_id'], status=StressPrediction.PENDING).first()
+    if prediction is None:
+        return  # Deleted, or already scored by an earlier delivery of this job
+
+    name = prediction.image.name
+    try:
+        # The sharded name is the upload's content hash, which keys the
+        # prediction cache just as it does for inline predictions
+        result = inference.predict(default_storage.path(name), content_hash=uploads.stored_content_hash(name))
+    except preprocessing.ImageDecodeError:
+        # Retrying will not make the file readable
+        prediction.fail()
+        return
+    if prediction.complete(result):
+        dashboard.invalidate_weekly_chart(prediction.user_id)
@@ -0,0 +1,137 @@
+"""
+Weighted stress lexicon compiled into a single word-boundary regex.
+
+Every term (single words and phrases) is folded into a character trie and
+emitted as one alternation, so a text is scanned once, left to right, no
+matter how large the vocabulary is. Matches are whole words only ("bad"
+does not match inside "badminton"), the longest term wins at each position,
+and a negator up to NEGATION_WINDOW words before a term flips its weight
+and keeps it out of the stress keywords.
+
+The vocabulary is a CSV of ``term,weight,stress`` rows: weight is the
+term's sentiment (negative for negative words) and stress marks terms that
+are reported as MoodJournal.stress_keywords.
+"""
+import csv
+import re
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+NEGATORS = ('not', 'no', 'never', "don't", "didn't", "isn't", "wasn't", "doesn't", "haven't", 'hardly')
+NEGATION_WINDOW = 2
+
+Term = namedtuple('Term', ['weight', 'stress'])
+Analysis = namedtuple('Analysis', ['sentiment', 'score', 'keywords'])
+
+_NEGATOR = Term(None, False)
+
+
+def normalize(term):
+    """Lowercase a term and collapse its whitespace"""
+    return ' '.join(term.lower().split())
+
+
+def _trie_pattern(terms):
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        is_end = '' in node
+        branches = [
+            (r'\s+' if char == ' ' else re.escape(char)) + build(child)
+            for char, child in sorted(node.items()) if char
+        ]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if is_end:
+            # Greedy optional: try the longer term first, fall back to this one
+            return ('(?:' + pattern + ')?') if len(branches) == 1 else pattern + '?'
+        return pattern
+
+    return build(trie)
+
+
+class Lexicon:
+    """A compiled weighted vocabulary"""
+
+    def __init__(self, terms, negators=NEGATORS):
+        self.terms = {normalize(term): Term(float(weight), bool(stress)) for term, (weight, stress) in terms.items()}
+        vocabulary = dict(self.terms)
+        for negator in negators:
+            vocabulary.setdefault(normalize(negator), _NEGATOR)
+        self.vocabulary = vocabulary
+        self.pattern = re.compile(r'\b' + _trie_pattern(vocabulary) + r'\b', re.IGNORECASE)
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            return cls({
+                row['term']: (row['weight'], row.get('stress', '0') in ('1', 'true', 'True'))
+                for row in csv.DictReader(f)
+            })
+
+    def analyze(self, text):
+        """Sentiment, total weight and stress keywords of a text, in one pass"""
+        score = 0.0
+        keywords = []
+        negated_until = -1
+        words_seen = 0
+        last_end = 0
+        for match in self.pattern.finditer(text):
+            words_seen += len(text[last_end:match.start()].split())
+            last_end = match.end()
+            term = normalize(match.group())
+            entry = self.vocabulary[term]
+            if entry is _NEGATOR:
+                words_seen += 1
+                negated_until = words_seen + NEGATION_WINDOW
+                continue
+
+            negated = words_seen < negated_until
+            weight = -entry.weight if negated else entry.weight
+            words_seen += term.count(' ') + 1
+            score += weight
+            # "not stressed" flips the weight and is no stress keyword
+            if entry.stress and not negated and term not in keywords:
+                keywords.append(term)
+
+        if score > 0:
+            sentiment = 'Positive'
+        elif score < 0:
+            sentiment = 'Negative'
+        else:
+            sentiment = 'Neutral'
+        return Analysis(sentiment, score, keywords)
+
+    def analyze_many(self, texts):
+        """Analyze many texts with the same compiled matcher"""
+        return [self.analyze(text) for text in texts]
+
+
+_lexicon = None
+_lexicon_lock = threading.Lock()
+
+
+def get_lexicon():
+    """Return the process-wide lexicon, compiling it on first use"""
+    global _lexicon
+    if _lexicon is None:
+        with _lexicon_lock:
+            if _lexicon is None:
+                _lexicon = Lexicon.from_csv(settings.STRESS_LEXICON_PATH)
+    return _lexicon
+
+
+def analyze(text):
+    return get_lexicon().analyze(text)
+
+
+def analyze_many(texts):
+    return get_lexicon().analyze_many(texts)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stressdetector import registry
+
+
+class Command(BaseCommand):
+    help = (
+        "Activate a model version from the registry. Running workers load it in "
+        "the background and swap it in without a restart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('version', nargs='?', help="Version directory under STRESS_MODEL_REGISTRY")
+        parser.add_argument('--list', action='store_true', help="List the registered versions instead")
+
+    def handle(self, *args, **options):
+        if options['list'] or not options['version']:
+            active = registry.active_version()
+            for version in registry.versions():
+                accuracy = registry.metadata(version).get('metrics', {}).get('validation_accuracy')
+                marker = '*' if version == active else ' '
+                details = f"  validation accuracy {accuracy:.3f}" if accuracy is not None else ''
+                self.stdout.write(f"{marker} {version}{details}")
+            return
+
+        try:
+            registry.activate(options['version'])
+        except registry.UnknownModelVersion as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(f"Activated model {options['version']}"))
@@ -0,0 +1,201 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from stressdetector import heatmaps, thumbnails, uploads
+from stressdetector.models import StressPrediction
+
+LOOKUP_BATCH = 500
+
+
+def file_fields():
+    """(model, field name) for every FileField of every installed model"""
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.FileField):
+                yield model, field.name
+
+
+def heatmap_versions():
+    """Model versions that have a heatmap directory in media storage"""
+    if not default_storage.exists(heatmaps.HEATMAP_DIR):
+        return []
+    return default_storage.listdir(heatmaps.HEATMAP_DIR)[0]
+
+
+def referenced_names():
+    """Stream every stored file name the database points at, with its thumbnails and heatmaps"""
+    sizes = list(settings.STRESS_THUMBNAIL_SIZES)
+    for model, field in file_fields():
+        names = model._default_manager.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+        for name in names.values_list(field, flat=True).iterator(chunk_size=2000):
+            yield name
+            for size in sizes:
+                yield thumbnails.thumbnail_name(name, size)
+
+    # No row names a heatmap; each done prediction may have one per model version
+    versions = heatmap_versions()
+    if versions:
+        done = StressPrediction.objects.filter(status=StressPrediction.DONE)
+        for pk in done.values_list('pk', flat=True).iterator(chunk_size=2000):
+            for version in versions:
+                yield heatmaps.heatmap_name(pk, version)
+
+
+def _link_or_copy(source, target):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _file_hash(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()[:uploads.CONTENT_HASH_LENGTH]
+
+
+class Command(BaseCommand):
+    help = (
+        "Find media files no database row references and delete them (--delete), "
+        "optionally first moving referenced uploads into the sharded content-addressed "
+        "layout (--migrate-layout). Without --delete this only reports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help="Delete unreferenced files instead of only listing them")
+        parser.add_argument('--migrate-layout', action='store_true', help="Move referenced uploads into the sharded layout first")
+        parser.add_argument('--min-age', type=float, default=3600, help="Skip files younger than this many seconds (uploads in flight)")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Rows updated per transaction while migrating")
+        parser.add_argument('--verbose-files', action='store_true', help="Print every unreferenced file")
+
+    def handle(self, *args, **options):
+        self.options = options
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
+        if options['migrate_layout']:
+            self.migrate_layout()
+        if not os.path.isdir(media_root):
+            self.stdout.write("MEDIA_ROOT does not exist; nothing to collect")
+            return
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index = self.build_index(os.path.join(tmp, 'referenced.sqlite3'))
+            try:
+                found, size = self.collect(index, media_root)
+            finally:
+                index.close()
+
+        action = "Deleted" if options['delete'] else "Would delete"
+        self.stdout.write(self.style.SUCCESS(f"{action} {found} unreferenced files ({size / 2**20:.1f} MiB)"))
+
+    def build_index(self, path):
+        """Referenced names in an indexed on-disk table, so memory stays flat"""
+        index = sqlite3.connect(path)
+        index.execute('CREATE TABLE referenced (name TEXT PRIMARY KEY) WITHOUT ROWID')
+        names = referenced_names()
+        while True:
+            batch = [(name,) for _, name in zip(range(10000), names)]
+            if not batch:
+                break
+            index.executemany('INSERT OR IGNORE INTO referenced VALUES (?)', batch)
+        index.commit()
+        return index
+
+    def collect(self, index, media_root):
+        found = size = 0
+        cutoff = time.time() - self.options['min_age']
+        for directory, _, filenames in os.walk(media_root, topdown=False):
+            # Check one directory's files against the index in a few queries
+            candidates = {}
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, media_root).replace(os.sep, '/')
+                candidates[name] = path
+            names = list(candidates)
+            for start in range(0, len(names), LOOKUP_BATCH):
+                batch = names[start:start + LOOKUP_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                referenced = {
+                    row[0] for row in
+                    index.execute(f'SELECT name FROM referenced WHERE name IN ({placeholders})', batch)
+                }
+                for name in batch:
+                    if name in referenced:
+                        continue
+                    path = candidates[name]
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if stat.st_mtime > cutoff:
+                        continue
+                    found += 1
+                    size += stat.st_size
+                    if self.options['verbose_files']:
+                        self.stdout.write(name)
+                    if self.options['delete']:
+                        os.remove(path)
+
+            if self.options['delete'] and directory != media_root:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass  # Not empty
+        return found, size
+
+    def migrate_layout(self):
+        """Copy referenced uploads to their sharded names and repoint the rows
+
+        Files are hard-linked (or copied) rather than moved, because several
+        rows may share one file; the old names are collected afterwards.
+        """
+        moved = missing = 0
+        for model, field in file_fields():
+            last_pk = 0
+            while True:
+                rows = list(
+                    model._default_manager.filter(pk__gt=last_pk).exclude(**{field: ''})
+                    .exclude(**{f'{field}__isnull': True}).order_by('pk')
+                    .values_list('pk', field)[:self.options['chunk_size']]
+                )
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+
+                updates = {}
+                for pk, name in rows:
+                    if uploads.is_sharded(name):
+                        continue
+                    source = default_storage.path(name)
+                    if not os.path.exists(source):
+                        missing += 1
+                        continue
+                    # Legacy names are client-chosen, so hash the bytes even
+                    # when the name already looks like a hash
+                    extension = os.path.splitext(name)[1].lower() or '.jpg'
+                    basename = _file_hash(source) + extension
+                    prefix = name.split('/', 1)[0] if '/' in name else 'uploads'
+                    target = uploads.sharded_name(prefix, basename)
+                    _link_or_copy(source, default_storage.path(target))
+                    updates[pk] = target
+
+                model._default_manager.bulk_update(
+                    [model(pk=pk, **{field: target}) for pk, target in updates.items()], [field]
+                )
+                moved += len(updates)
+
+        self.stdout.write(f"Migrated {moved} file references to the sharded layout ({missing} files missing)")
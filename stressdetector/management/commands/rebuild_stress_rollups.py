@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from stressdetector.models import DailyStressRollup
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user, per-day stress rollups from StressPrediction rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help="Only rebuild this user id (repeatable)")
+
+    def handle(self, *args, **options):
+        rows = DailyStressRollup.rebuild(options['user_ids'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} rollup rows"))
@@ -0,0 +1,161 @@
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from stressdetector import dashboard, inference, preprocessing
+from stressdetector.models import DailyStressRollup, MoodJournal, StressPrediction
+
+DEFAULT_CHECKPOINT = os.path.join(settings.BASE_DIR, 'rescore_checkpoint.json')
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-score every StressPrediction and journal image with the current model. "
+        "Walks each table in primary-key chunks and checkpoints after every chunk, "
+        "so an interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=256, help="Rows read, scored and written per chunk")
+        parser.add_argument('--workers', type=int, default=None, help="Image decoding processes (default: all cores, 0 decodes in this process)")
+        parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="Progress file used to resume interrupted runs")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start from the first row")
+        parser.add_argument('--sleep', type=float, default=0.0, help="Seconds to pause after every chunk")
+        parser.add_argument('--max-rate', type=float, default=None, help="Upper bound on images re-scored per second")
+        parser.add_argument('--skip-journals', action='store_true', help="Only re-score StressPrediction rows")
+
+    def handle(self, *args, **options):
+        engine = inference.get_engine()
+        try:
+            engine.load()
+        except inference.ModelNotAvailable as exc:
+            raise CommandError(str(exc))
+
+        self.engine = engine
+        self.options = options
+        self.checkpoint_path = options['checkpoint']
+        self.checkpoint = self.load_checkpoint(options['restart'])
+        self.started = time.monotonic()
+        self.scored = 0
+
+        workers = os.cpu_count() if options['workers'] is None else options['workers']
+        pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+        try:
+            # Pending predictions are scored by their job with the active model anyway
+            predictions = StressPrediction.objects.filter(status=StressPrediction.DONE)
+            self.rescore_table('predictions', predictions, 'image', self.apply_predictions, pool)
+            if not options['skip_journals']:
+                journals = MoodJournal.objects.exclude(image__isnull=True).exclude(image='')
+                self.rescore_table('journals', journals, 'image', self.apply_journals, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Re-scored {self.scored} images with model {engine.model_version}"
+        ))
+
+    def load_checkpoint(self, restart):
+        """Progress for the current model version; a new model starts over"""
+        if not restart and os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('model_version') == self.engine.model_version:
+                return checkpoint
+        return {'model_version': self.engine.model_version, 'last_pk': {}}
+
+    def save_checkpoint(self):
+        # Write-then-rename so a kill mid-write never leaves a torn file
+        temp_path = f'{self.checkpoint_path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def rescore_table(self, name, queryset, image_field, apply, pool):
+        chunk_size = self.options['chunk_size']
+        last_pk = self.checkpoint['last_pk'].get(name, 0)
+        if last_pk:
+            self.stdout.write(f"Resuming {name} after id {last_pk}")
+
+        prepare = partial(preprocessing.load_model_input, input_size=self.engine.input_size, crop_face=self.engine.crop_face)
+        while True:
+            rows = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+            if not rows:
+                break
+
+            paths = [getattr(row, image_field).path for row in rows]
+            inputs = list(pool.map(prepare, paths, chunksize=16) if pool else map(prepare, paths))
+            readable = [i for i, model_input in enumerate(inputs) if model_input is not None]
+
+            results = {}
+            if readable:
+                batch = np.stack([inputs[i] for i in readable])
+                for i, probabilities in zip(readable, self.engine.predict_proba(batch)):
+                    results[rows[i].pk] = self.engine.decode(probabilities)
+
+            with transaction.atomic():
+                changed = apply(rows, results)
+            last_pk = rows[-1].pk
+            self.checkpoint['last_pk'][name] = last_pk
+            self.save_checkpoint()
+
+            self.scored += len(results)
+            self.stdout.write(
+                f"{name}: up to id {last_pk}, {len(results)}/{len(rows)} scored, {changed} changed"
+            )
+            self.throttle()
+
+    def apply_predictions(self, rows, results):
+        """Write changed predictions and move their rollup counts"""
+        changed = []
+        rollup_deltas = Counter()
+        model_version = self.engine.model_version
+        for prediction in rows:
+            if prediction.pk not in results:
+                continue
+            stress_level, mood_tag, confidence = results[prediction.pk]
+            current = (prediction.stress_level, prediction.mood_tag, prediction.confidence, prediction.model_version)
+            if current == (stress_level, mood_tag, confidence, model_version):
+                continue
+            if stress_level != prediction.stress_level:
+                day = timezone.localdate(prediction.created_at)
+                rollup_deltas[(prediction.user_id, day, prediction.stress_level)] -= 1
+                rollup_deltas[(prediction.user_id, day, stress_level)] += 1
+            prediction.stress_level, prediction.mood_tag, prediction.confidence = stress_level, mood_tag, confidence
+            prediction.model_version = model_version
+            changed.append(prediction)
+
+        StressPrediction.objects.bulk_update(changed, ['stress_level', 'mood_tag', 'confidence', 'model_version'])
+        for (user_id, day, stress_level), amount in rollup_deltas.items():
+            if amount:
+                DailyStressRollup.record(user_id, day, stress_level, amount)
+        for user_id in {user_id for user_id, _, _ in rollup_deltas}:
+            transaction.on_commit(partial(dashboard.invalidate_weekly_chart, user_id))
+        return len(changed)
+
+    def apply_journals(self, rows, results):
+        changed = []
+        for entry in rows:
+            if entry.pk in results and entry.image_stress_level != results[entry.pk][0]:
+                entry.image_stress_level = results[entry.pk][0]
+                changed.append(entry)
+        MoodJournal.objects.bulk_update(changed, ['image_stress_level'])
+        return len(changed)
+
+    def throttle(self):
+        """Pause so a long run leaves the SQLite write lock to live requests"""
+        pause = self.options['sleep']
+        if self.options['max_rate']:
+            ahead = self.scored / self.options['max_rate'] - (time.monotonic() - self.started)
+            pause = max(pause, ahead)
+        if pause > 0:
+            time.sleep(pause)
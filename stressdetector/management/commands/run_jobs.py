@@ -0,0 +1,44 @@
+import os
+import socket
+
+from django.core.management.base import BaseCommand
+
+from stressdetector import jobs
+from stressdetector.inference import preload_engine
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs (such as scoring uploaded photos) from the database "
+        "queue. Start one or more of these next to the web server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once no job is due instead of polling")
+        parser.add_argument('--max-jobs', type=int, help="Exit after running this many jobs")
+        parser.add_argument('--poll-interval', type=float, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--lease', type=float, help="Seconds a claimed job is held before another worker may retry it")
+        parser.add_argument('--worker-id', help="Name recorded on claimed jobs (default host:pid)")
+
+    def handle(self, *args, **options):
+        worker = options['worker_id'] or f'{socket.gethostname()}:{os.getpid()}'
+        preload_engine()
+
+        def report(job):
+            if options['verbosity'] >= 2:
+                self.stdout.write(f"{job.kind} #{job.pk}: {job.status} (attempt {job.attempts})")
+
+        try:
+            processed = jobs.work(
+                worker,
+                once=options['once'],
+                poll_interval=options['poll_interval'],
+                lease_seconds=options['lease'],
+                max_jobs=options['max_jobs'],
+                on_job=report,
+            )
+        except KeyboardInterrupt:
+            # A job interrupted mid-run is retried once its lease runs out
+            self.stdout.write("Stopped")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Ran {processed} jobs"))
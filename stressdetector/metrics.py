@@ -0,0 +1,145 @@
+"""
+Low-overhead, in-process metrics.
+
+Counters and histograms take a lock per metric, and histograms use fixed
+buckets, so recording a value is a bisect and a couple of additions. Every
+metric is kept in a module-level registry so views and scripts can read
+them back, and render_prometheus() formats the whole registry for a
+Prometheus scrape. A metric may carry labels (such as the view it times);
+each distinct set of labels is a separate metric under the same name.
+"""
+import bisect
+import threading
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Counter:
+    """Monotonically increasing counter"""
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=None):
+        self.name = name
+        self.description = description
+        self.labels = dict(labels or {})
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def reset(self):
+        with self._lock:
+            self._value = 0
+
+    @property
+    def value(self):
+        return self._value
+
+
+class Histogram:
+    """Fixed-bucket histogram in the style of a Prometheus histogram"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets, labels=None):
+        self.name = name
+        self.description = description
+        self.labels = dict(labels or {})
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self.buckets) + 1)
+            self._sum = 0.0
+            self._count = 0
+
+    def snapshot(self):
+        """Return cumulative bucket counts, sum and count"""
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            running += bucket_count
+            cumulative.append(('+Inf' if bound == float('inf') else bound, running))
+        return {
+            'buckets': cumulative,
+            'sum': total,
+            'count': count,
+            'mean': total / count if count else 0.0,
+        }
+
+
+def _register(name, labels, factory):
+    key = (name, tuple(sorted(labels.items()))) if labels else name
+    with _registry_lock:
+        metric = _registry.get(key)
+        if metric is None:
+            metric = _registry[key] = factory()
+        return metric
+
+
+def counter(name, description, labels=None):
+    """Return the counter registered under name and labels, creating it if needed"""
+    return _register(name, labels, lambda: Counter(name, description, labels))
+
+
+def histogram(name, description, buckets, labels=None):
+    """Return the histogram registered under name and labels, creating it if needed"""
+    return _register(name, labels, lambda: Histogram(name, description, buckets, labels))
+
+
+def all_metrics():
+    """Return every registered metric, keyed by name (or name and labels)"""
+    with _registry_lock:
+        return dict(_registry)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def render_prometheus():
+    """Every registered metric in the Prometheus text exposition format"""
+    by_name = {}
+    for metric in all_metrics().values():
+        by_name.setdefault(metric.name, []).append(metric)
+
+    lines = []
+    for name in sorted(by_name):
+        family = by_name[name]
+        lines.append(f'# HELP {name} {family[0].description}')
+        lines.append(f'# TYPE {name} {family[0].kind}')
+        for metric in sorted(family, key=lambda metric: sorted(metric.labels.items())):
+            if metric.kind == 'counter':
+                lines.append(f'{name}{_format_labels(metric.labels)} {metric.value}')
+                continue
+            snapshot = metric.snapshot()
+            for bound, count in snapshot['buckets']:
+                lines.append(f'{name}_bucket{_format_labels(metric.labels, le=bound)} {count}')
+            lines.append(f'{name}_sum{_format_labels(metric.labels)} {snapshot["sum"]}')
+            lines.append(f'{name}_count{_format_labels(metric.labels)} {snapshot["count"]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def backfill_rollups(apps, schema_editor):
+    StressPrediction = apps.get_model('stressdetector', 'StressPrediction')
+    DailyStressRollup = apps.get_model('stressdetector', 'DailyStressRollup')
+    rows = (
+        StressPrediction.objects.annotate(day=TruncDate('created_at'))
+        .values('user_id', 'day', 'stress_level')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    DailyStressRollup.objects.bulk_create(
+        (DailyStressRollup(**row) for row in rows.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stressdetector', '0002_breathingexercise_motivationalquote_stresstip_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStressRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('stress_level', models.CharField(choices=[('Low', 'Low'), ('Medium', 'Medium'), ('High', 'High')], max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Daily Stress Rollup',
+                'verbose_name_plural': 'Daily Stress Rollups',
+                'unique_together': {('user', 'day', 'stress_level')},
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stressdetector', '0003_dailystressrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='moodjournal',
+            index=models.Index(fields=['user', 'created_at'], name='moodjournal_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='stresscomparison',
+            index=models.Index(fields=['user', 'created_at'], name='comparison_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='stressprediction',
+            index=models.Index(fields=['user', 'created_at'], name='stressprediction_user_created'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stressdetector', '0004_user_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stressprediction',
+            name='model_version',
+            field=models.CharField(blank=True, default='', help_text='Model version that produced this prediction', max_length=64),
+        ),
+    ]
@@ -1,19 +1,32 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
 from django.contrib.auth.models import User
 from django.utils import timezone
+from collections import Counter
 import os
 
+from .uploads import is_content_addressed, sharded_name
+
+def _upload_path(prefix, instance, filename):
+    # Content-addressed uploads go to a shared sharded tree, where the
+    # storage renames any whose name does not match their bytes; anything
+    # else keeps the per-user directory
+    if is_content_addressed(filename):
+        return sharded_name(prefix, filename)
+    return os.path.join(prefix, f'user_{instance.user.id}', filename)
+
 def get_image_upload_path(instance, filename):
     """Generate upload path for user images"""
-    return os.path.join('user_images', f'user_{instance.user.id}', filename)
+    return _upload_path('user_images', instance, filename)
 
 def get_journal_image_path(instance, filename):
     """Generate upload path for journal images"""
-    return os.path.join('journal_images', f'user_{instance.user.id}', filename)
+    return _upload_path('journal_images', instance, filename)
 
 def get_comparison_image_path(instance, filename):
     """Generate upload path for comparison images"""
-    return os.path.join('comparison_images', f'user_{instance.user.id}', filename)
+    return _upload_path('comparison_images', instance, filename)
 
 class UserProfile(models.Model):
     """Extended user profile with stress tracking information"""
@@ -38,15 +51,38 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username}'s Profile"
     
-    def update_avatar_state(self, stress_level):
-        """Update avatar based on stress level"""
+    @staticmethod
+    def avatar_state_for(stress_level):
+        """Avatar state matching a stress level"""
         if stress_level == 'Low':
-            self.avatar_state = 'happy'
+            return 'happy'
         elif stress_level == 'Medium':
-            self.avatar_state = 'neutral'
-        else:
-            self.avatar_state = 'stressed'
-        self.save()
+            return 'neutral'
+        return 'stressed'
+    
+    @classmethod
+    def record_activity(cls, user_id, counter, amount=1, stress_level=None):
+        """Add to one activity counter with a single atomic UPDATE
+        
+        Also moves last_activity and, given a stress level, the avatar state.
+        The profile is created on the user's first activity.
+        """
+        changes = {counter: F(counter) + amount, 'last_activity': timezone.now()}
+        if stress_level:
+            changes['avatar_state'] = cls.avatar_state_for(stress_level)
+        
+        profiles = cls.objects.filter(user_id=user_id)
+        if profiles.update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                initial = {counter: amount}
+                if stress_level:
+                    initial['avatar_state'] = changes['avatar_state']
+                cls.objects.create(user_id=user_id, **initial)
+        except IntegrityError:
+            # Another request created the profile first
+            profiles.update(**changes)
 
 class StressPrediction(models.Model):
     """Model for storing stress prediction results"""
@@ -71,16 +107,31 @@ class StressPrediction(models.Model):
         ('Other', 'Other')
     ]
     
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed')
+    ]
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     image = models.ImageField(upload_to=get_image_upload_path)
-    stress_level = models.CharField(max_length=10, choices=STRESS_LEVELS)
-    mood_tag = models.CharField(max_length=10, choices=MOOD_TAGS)
+    stress_level = models.CharField(max_length=10, choices=STRESS_LEVELS, blank=True)
+    mood_tag = models.CharField(max_length=10, choices=MOOD_TAGS, blank=True)
     stress_type = models.CharField(max_length=20, choices=STRESS_TYPES, default='Other')
-    confidence = models.IntegerField(help_text="Confidence percentage (0-100)")
+    confidence = models.IntegerField(default=0, help_text="Confidence percentage (0-100)")
+    model_version = models.CharField(max_length=64, blank=True, default='', help_text="Model version that produced this prediction")
+    status = models.CharField(max_length=10, choices=STATUSES, default=DONE, help_text="Pending until a background job has scored the image")
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves filter(user=...).order_by('-created_at') without a sort
+            models.Index(fields=['user', 'created_at'], name='stressprediction_user_created'),
+        ]
         verbose_name = "Stress Prediction"
         verbose_name_plural = "Stress Predictions"
     
@@ -88,15 +139,111 @@ class StressPrediction(models.Model):
         return f"{self.user.username} - {self.stress_level} stress on {self.created_at.strftime('%Y-%m-%d %H:%M')}"
     
     def save(self, *args, **kwargs):
-        # Update user profile when saving a prediction
+        adding = self._state.adding
         super().save(*args, **kwargs)
         
-        # Update user profile
-        profile, created = UserProfile.objects.get_or_create(user=self.user)
-        profile.total_predictions += 1
-        profile.last_activity = timezone.now()
-        profile.update_avatar_state(self.stress_level)
-        profile.save()
+        # Update user profile once per new prediction; pending ones are
+        # counted when their result arrives
+        if adding and self.status == self.DONE:
+            UserProfile.record_activity(self.user_id, 'total_predictions', stress_level=self.stress_level)
+    
+    def complete(self, result):
+        """Store the result of a pending prediction and count it
+        
+        Returns False, changing nothing, if the prediction is no longer
+        pending, so a job that runs twice only counts it once.
+        """
+        changes = {
+            'status': self.DONE,
+            'stress_level': result.stress_level,
+            'mood_tag': result.mood_tag,
+            'confidence': result.confidence,
+            'model_version': result.model_version,
+        }
+        with transaction.atomic():
+            if not StressPrediction.objects.filter(pk=self.pk, status=self.PENDING).update(**changes):
+                return False
+            for field, value in changes.items():
+                setattr(self, field, value)
+            DailyStressRollup.record(self.user_id, timezone.localdate(self.created_at), self.stress_level)
+            UserProfile.record_activity(self.user_id, 'total_predictions', stress_level=self.stress_level)
+        return True
+    
+    def fail(self):
+        """Mark a pending prediction as failed"""
+        if StressPrediction.objects.filter(pk=self.pk, status=self.PENDING).update(status=self.FAILED):
+            self.status = self.FAILED
+    
+    @classmethod
+    def bulk_record(cls, user_id, predictions):
+        """Insert a user's new predictions in one statement and count them once
+        
+        bulk_create skips save() and post_save, so the daily rollup and the
+        profile counters are updated here, once per batch.
+        """
+        with transaction.atomic():
+            created = cls.objects.bulk_create(predictions)
+            per_day = Counter((timezone.localdate(p.created_at), p.stress_level) for p in created)
+            for (day, stress_level), amount in per_day.items():
+                DailyStressRollup.record(user_id, day, stress_level, amount)
+            if created:
+                UserProfile.record_activity(
+                    user_id, 'total_predictions', amount=len(created), stress_level=created[-1].stress_level
+                )
+        return created
+
+class DailyStressRollup(models.Model):
+    """Per-user, per-day count of predictions at each stress level"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    day = models.DateField()
+    stress_level = models.CharField(max_length=10, choices=StressPrediction.STRESS_LEVELS)
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['user', 'day', 'stress_level']
+        verbose_name = "Daily Stress Rollup"
+        verbose_name_plural = "Daily Stress Rollups"
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.day} - {self.stress_level}: {self.count}"
+    
+    @classmethod
+    def record(cls, user_id, day, stress_level, amount=1):
+        """Atomically add amount to a user's count for one day and level
+        
+        A negative amount only updates an existing row: with no row there is
+        nothing to take from, as when the user is being deleted and the
+        cascade has already removed their rollups.
+        """
+        rows = cls.objects.filter(user_id=user_id, day=day, stress_level=stress_level)
+        if rows.update(count=F('count') + amount) or amount < 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id, day=day, stress_level=stress_level, count=amount)
+        except IntegrityError:
+            # Another request created the row first
+            rows.update(count=F('count') + amount)
+    
+    @classmethod
+    def rebuild(cls, user_ids=None):
+        """Recompute rollup rows from the predictions table, for some or all users"""
+        predictions = StressPrediction.objects.filter(status=StressPrediction.DONE)
+        rollups = cls.objects.all()
+        if user_ids is not None:
+            predictions = predictions.filter(user_id__in=user_ids)
+            rollups = rollups.filter(user_id__in=user_ids)
+        
+        rows = (
+            predictions.annotate(day=TruncDate('created_at'))
+            .values('user_id', 'day', 'stress_level')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        with transaction.atomic():
+            rollups.delete()
+            created = cls.objects.bulk_create((cls(**row) for row in rows.iterator()), batch_size=1000)
+        return len(created)
 
 class MoodJournal(models.Model):
     """Model for mood journal entries with text and image fusion"""
@@ -123,6 +270,10 @@ class MoodJournal(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves filter(user=...).order_by('-created_at') without a sort
+            models.Index(fields=['user', 'created_at'], name='moodjournal_user_created'),
+        ]
         verbose_name = "Mood Journal"
         verbose_name_plural = "Mood Journals"
     
@@ -139,15 +290,12 @@ class MoodJournal(models.Model):
         return ' '.join(words) + ('...' if len(self.text.split()) > 5 else '')
     
     def save(self, *args, **kwargs):
-        # Update user profile when saving a journal entry
+        adding = self._state.adding
         super().save(*args, **kwargs)
         
-        # Update user profile
-        profile, created = UserProfile.objects.get_or_create(user=self.user)
-        profile.total_journal_entries += 1
-        profile.last_activity = timezone.now()
-        profile.update_avatar_state(self.combined_stress_level)
-        profile.save()
+        # Update user profile once per new journal entry
+        if adding:
+            UserProfile.record_activity(self.user_id, 'total_journal_entries', stress_level=self.combined_stress_level)
 
 class StressComparison(models.Model):
     """Model for before/after stress comparison"""
@@ -164,6 +312,10 @@ class StressComparison(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves filter(user=...).order_by('-created_at') without a sort
+            models.Index(fields=['user', 'created_at'], name='comparison_user_created'),
+        ]
         verbose_name = "Stress Comparison"
         verbose_name_plural = "Stress Comparisons"
     
@@ -171,7 +323,7 @@ class StressComparison(models.Model):
         return f"{self.user.username}'s Comparison - {self.created_at.strftime('%Y-%m-%d')}"
     
     def calculate_improvement(self):
-        """Calculate improvement score based on stress levels"""
+        """Set and return the improvement score for the two stress levels (not saved)"""
         stress_values = {'Low': 1, 'Medium': 2, 'High': 3}
         before_value = stress_values[self.before_stress_level]
         after_value = stress_values[self.after_stress_level]
@@ -186,17 +338,17 @@ class StressComparison(models.Model):
             # Stress increased
             self.improvement_score = -((after_value - before_value) / after_value) * 100
         
-        self.save()
+        # Truncate like the IntegerField column does
+        self.improvement_score = int(self.improvement_score)
+        return self.improvement_score
     
     def save(self, *args, **kwargs):
-        # Update user profile when saving a comparison
+        adding = self._state.adding
         super().save(*args, **kwargs)
         
-        # Update user profile
-        profile, created = UserProfile.objects.get_or_create(user=self.user)
-        profile.total_comparisons += 1
-        profile.last_activity = timezone.now()
-        profile.save()
+        # Update user profile once per new comparison, not on re-saves
+        if adding:
+            UserProfile.record_activity(self.user_id, 'total_comparisons')
 
 class DailyStreak(models.Model):
     """Model for tracking user's daily check-in streaks"""
@@ -293,4 +445,43 @@ class UserSession(models.Model):
         """Calculate session duration"""
         if self.logout_time:
             self.duration = self.logout_time - self.login_time
-            self.save()
\ No newline at end of file
+            self.save()
+
+class Job(models.Model):
+    """A unit of work in the database-backed background queue (see jobs.py)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed')
+    ]
+    
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Not claimed before this time (retry backoff)")
+    leased_until = models.DateTimeField(null=True, blank=True, help_text="Another worker may re-run a running job after this")
+    worker = models.CharField(max_length=100, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # Serves the worker's claim query
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after'),
+        ]
+        verbose_name = "Job"
+        verbose_name_plural = "Jobs"
+    
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
@@ -0,0 +1,146 @@
+"""
+Image ingest pipeline shared by every prediction path.
+
+An upload is decoded exactly once, straight from its in-memory buffer or
+temporary file, then converted to grayscale, cropped to the largest face,
+resized to the model's input size and normalised into a reusable float32
+buffer. The upload itself is left untouched so the model's ImageField can
+persist the original afterwards.
+"""
+import os
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Faces are searched for on a copy no larger than this, which keeps the
+# cascade cheap on full-resolution phone photos
+FACE_SEARCH_SIZE = 320
+FACE_MARGIN = 0.1
+
+_local = threading.local()
+
+
+class ImageDecodeError(ValueError):
+    """Raised when an upload cannot be decoded as an image"""
+
+
+def _buffer_of(upload):
+    """Return the raw bytes of an upload without copying them when possible"""
+    file = getattr(upload, 'file', upload)
+    if hasattr(file, 'getbuffer'):
+        return file.getbuffer()
+    position = file.tell()
+    file.seek(0)
+    data = file.read()
+    file.seek(position)
+    return data
+
+
+def decode_grayscale(source):
+    """Decode an upload, path, PIL image or array into a grayscale uint8 array"""
+    if isinstance(source, np.ndarray):
+        if source.ndim == 3 and source.shape[2] == 4:
+            return cv2.cvtColor(source, cv2.COLOR_BGRA2GRAY)
+        if source.ndim == 3 and source.shape[2] == 3:
+            return cv2.cvtColor(source, cv2.COLOR_BGR2GRAY)
+        return source.reshape(source.shape[:2])
+    if isinstance(source, Image.Image):
+        return np.asarray(source.convert('L'))
+
+    if isinstance(source, (str, os.PathLike)):
+        gray = cv2.imread(os.fspath(source), cv2.IMREAD_GRAYSCALE)
+    elif hasattr(source, 'temporary_file_path'):
+        # Large uploads are already on disk; decode from there
+        gray = cv2.imread(source.temporary_file_path(), cv2.IMREAD_GRAYSCALE)
+    else:
+        data = np.frombuffer(_buffer_of(source), np.uint8)
+        # imdecode raises instead of returning None for an empty buffer
+        gray = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE) if data.size else None
+
+    if gray is None:
+        raise ImageDecodeError("Uploaded file is not a readable image")
+    return gray
+
+
+def _face_detector():
+    # CascadeClassifier is not safe to share between threads
+    if not hasattr(_local, 'face_detector'):
+        detector = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        _local.face_detector = None if detector.empty() else detector
+    return _local.face_detector
+
+
+def find_face(gray):
+    """Return the (x, y, w, h) box of the largest face, or None"""
+    detector = _face_detector()
+    if detector is None:
+        return None
+
+    scale = max(gray.shape) / FACE_SEARCH_SIZE
+    search = gray
+    if scale > 1:
+        search = cv2.resize(gray, (int(gray.shape[1] / scale), int(gray.shape[0] / scale)), interpolation=cv2.INTER_AREA)
+    else:
+        scale = 1.0
+
+    faces = detector.detectMultiScale(search, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24))
+    if len(faces) == 0:
+        return None
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+    return int(x * scale), int(y * scale), int(w * scale), int(h * scale)
+
+
+def crop(gray, box, margin=FACE_MARGIN):
+    """Crop a face box, widened by a margin and clipped to the image"""
+    x, y, w, h = box
+    pad_x, pad_y = int(w * margin), int(h * margin)
+    top, left = max(0, y - pad_y), max(0, x - pad_x)
+    return gray[top:y + h + pad_y, left:x + w + pad_x]
+
+
+def _buffer(input_size):
+    buffers = getattr(_local, 'buffers', None)
+    if buffers is None:
+        buffers = _local.buffers = {}
+    if input_size not in buffers:
+        buffers[input_size] = np.empty((*input_size, 1), dtype=np.float32)
+    return buffers[input_size]
+
+
+def to_model_input(gray, input_size, out=None):
+    """Resize and normalise a grayscale face into out (or a per-thread buffer)
+
+    The per-thread buffer is overwritten by the next call on the same thread,
+    so callers that keep several inputs must pass their own ``out``.
+    """
+    height, width = input_size
+    resized = cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+    if out is None:
+        out = _buffer(tuple(input_size))
+    np.multiply(resized, 1 / 255.0, out=out.reshape(height, width), casting='unsafe')
+    return out
+
+
+def preprocess(source, input_size, out=None, crop_face=True):
+    """Decode once and produce the model input for one image"""
+    gray = decode_grayscale(source)
+    if crop_face:
+        box = find_face(gray)
+        if box is not None:
+            gray = crop(gray, box)
+    return to_model_input(gray, input_size, out=out)
+
+
+def load_model_input(path, input_size, crop_face=True):
+    """Model input for an image file in a new array, or None if it is unreadable
+
+    Meant for worker processes: the result owns its memory and a missing or
+    corrupt file does not raise.
+    """
+    out = np.empty((*input_size, 1), dtype=np.float32)
+    try:
+        return preprocess(path, input_size, out=out, crop_face=crop_face)
+    except ImageDecodeError:
+        return None
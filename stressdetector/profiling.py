@@ -0,0 +1,163 @@
+"""
+Per-request timing of views, database queries, templates and inference.
+
+RequestMetricsMiddleware opens a RequestProfile for every request. Queries
+are timed by a database execute wrapper, template rendering by the
+TimedDjangoTemplates backend, and model calls by inference wrapping them in
+timed('inference'). When the response is ready the totals go into one set
+of histograms per view, which the /metrics view exposes in Prometheus
+format. Requests slower than STRESS_SLOW_REQUEST_SECONDS are logged to the
+``stressdetector.slow_requests`` logger with their slowest queries.
+
+Querysets evaluated while a streaming response is being sent (the history
+export) run after the middleware has finished and are not counted.
+"""
+import contextvars
+import heapq
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.template.backends.django import DjangoTemplates, Template
+
+from . import metrics
+
+slow_request_logger = logging.getLogger('stressdetector.slow_requests')
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+# Queries kept per request for the slow-request log
+WORST_QUERIES = 5
+
+_current = contextvars.ContextVar('stressdetector_request_profile', default=None)
+
+
+class RequestProfile:
+    """Time spent in each phase of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.phases = {'template': 0.0, 'inference': 0.0}
+        self._worst_queries = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def record_query(self, execute, sql, params, many, context):
+        """Database execute wrapper timing every query of the request"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_seconds += elapsed
+            # A bounded min-heap: the WORST_QUERIES slowest queries so far
+            if len(self._worst_queries) < WORST_QUERIES:
+                heapq.heappush(self._worst_queries, (elapsed, self.queries, sql))
+            elif elapsed > self._worst_queries[0][0]:
+                heapq.heapreplace(self._worst_queries, (elapsed, self.queries, sql))
+
+    def worst_queries(self):
+        """(seconds, sql) of the slowest queries, slowest first"""
+        return [(elapsed, sql) for elapsed, _, sql in sorted(self._worst_queries, reverse=True)]
+
+
+@contextmanager
+def timed(phase):
+    """Add the time spent in the block to the current request's profile"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(phase, time.perf_counter() - started)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing each render for RequestProfile"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+class _ViewMetrics:
+    """The histograms of one view"""
+
+    def __init__(self, view):
+        labels = {'view': view}
+        self.seconds = metrics.histogram(
+            'stress_request_seconds', 'Wall time of a request', SECONDS_BUCKETS, labels
+        )
+        self.queries = metrics.histogram(
+            'stress_request_db_queries', 'Database queries run by a request', QUERY_COUNT_BUCKETS, labels
+        )
+        self.db_seconds = metrics.histogram(
+            'stress_request_db_seconds', 'Time a request spent in database queries', SECONDS_BUCKETS, labels
+        )
+        self.template_seconds = metrics.histogram(
+            'stress_request_template_seconds', 'Time a request spent rendering templates', SECONDS_BUCKETS, labels
+        )
+        self.inference_seconds = metrics.histogram(
+            'stress_request_inference_seconds', 'Time a request spent waiting on the stress model', SECONDS_BUCKETS, labels
+        )
+
+
+class RequestMetricsMiddleware:
+    """Record each request's wall, database, template and inference time per view"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._views = {}
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            with connection.execute_wrapper(profile.record_query):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        elapsed = time.perf_counter() - profile.started
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        view_metrics = self._views.get(view)
+        if view_metrics is None:
+            view_metrics = self._views[view] = _ViewMetrics(view)
+        view_metrics.seconds.observe(elapsed)
+        view_metrics.queries.observe(profile.queries)
+        view_metrics.db_seconds.observe(profile.db_seconds)
+        view_metrics.template_seconds.observe(profile.phases['template'])
+        view_metrics.inference_seconds.observe(profile.phases['inference'])
+
+        if elapsed >= settings.STRESS_SLOW_REQUEST_SECONDS:
+            self.log_slow_request(request, view, elapsed, profile)
+        return response
+
+    def log_slow_request(self, request, view, elapsed, profile):
+        worst = ''.join(
+            f"\n  {seconds * 1000:8.1f} ms  {sql[:300]}" for seconds, sql in profile.worst_queries()
+        )
+        slow_request_logger.warning(
+            "Slow request %s %s (%s): %.0f ms total, %d queries in %.0f ms, templates %.0f ms, inference %.0f ms%s",
+            request.method, request.path, view, elapsed * 1000, profile.queries, profile.db_seconds * 1000,
+            profile.phases['template'] * 1000, profile.phases['inference'] * 1000, worst,
+        )
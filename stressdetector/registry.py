@@ -0,0 +1,103 @@
+"""
+Local registry of versioned model artifacts.
+
+Each trained model lives in its own directory under STRESS_MODEL_REGISTRY,
+as written by scripts/train_model.py:
+
+    ml_models/<version>/model.keras      (or model.h5 / model.pkl)
+    ml_models/<version>/metadata.json
+    ml_models/ACTIVE                     name of the version to serve
+
+Activating a version only rewrites ACTIVE. Running workers notice the
+change and hot-swap the model in the background (see inference.get_engine),
+so no restart is needed. Without an ACTIVE file the app serves the single
+artifact at STRESS_MODEL_PATH, as before.
+"""
+import json
+import os
+
+from django.conf import settings
+
+ACTIVE_FILE = 'ACTIVE'
+ARTIFACT_NAMES = ('model.keras', 'model.h5', 'model.pkl')
+
+
+class UnknownModelVersion(Exception):
+    """Raised for a version with no artifact in the registry"""
+
+
+def registry_dir():
+    return settings.STRESS_MODEL_REGISTRY
+
+
+def artifact_path(version):
+    """Path of a version's model artifact"""
+    directory = os.path.join(registry_dir(), version)
+    for name in ARTIFACT_NAMES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    raise UnknownModelVersion(f"No model artifact for version {version!r} in {registry_dir()}")
+
+
+def metadata(version):
+    """A version's metadata.json, or {} if it has none"""
+    path = os.path.join(registry_dir(), version, 'metadata.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def versions():
+    """Every version in the registry, oldest first"""
+    if not os.path.isdir(registry_dir()):
+        return []
+    found = []
+    for version in sorted(os.listdir(registry_dir())):
+        try:
+            artifact_path(version)
+        except UnknownModelVersion:
+            continue
+        found.append(version)
+    return found
+
+
+def active_version():
+    """The version named in ACTIVE, or None when the registry is not in use"""
+    try:
+        with open(os.path.join(registry_dir(), ACTIVE_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def activation_stamp():
+    """Identifies the latest activate() call, or None without an ACTIVE file
+
+    activate() replaces ACTIVE with a new file every time, so the stamp
+    changes even when the same version is activated again.
+    """
+    try:
+        stat = os.stat(os.path.join(registry_dir(), ACTIVE_FILE))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def activate(version):
+    """Make version the one every worker serves"""
+    artifact_path(version)
+    path = os.path.join(registry_dir(), ACTIVE_FILE)
+    # Write-then-rename so workers never read a half-written name
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(version + '\n')
+    os.replace(f'{path}.tmp', path)
+
+
+def active_artifact():
+    """(version, path) of the model to serve; version is None for STRESS_MODEL_PATH"""
+    version = active_version()
+    if version is None:
+        return None, settings.STRESS_MODEL_PATH
+    return version, artifact_path(version)
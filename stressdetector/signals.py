@@ -0,0 +1,44 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import content
+from .dashboard import invalidate_weekly_chart
+from .models import (
+    BreathingExercise, DailyStressRollup, MotivationalQuote, StressPrediction, StressTip
+)
+
+
+@receiver(post_save, sender=StressPrediction)
+def add_prediction_to_rollup(sender, instance, created, **kwargs):
+    """Count new predictions in the daily rollup used by the trends API"""
+    # Pending predictions are counted by StressPrediction.complete()
+    if created and instance.status == StressPrediction.DONE:
+        DailyStressRollup.record(instance.user_id, timezone.localdate(instance.created_at), instance.stress_level)
+
+
+@receiver(post_delete, sender=StressPrediction)
+def remove_prediction_from_rollup(sender, instance, **kwargs):
+    """Keep the daily rollup in step when a prediction is deleted"""
+    if instance.status == StressPrediction.DONE:
+        DailyStressRollup.record(instance.user_id, timezone.localdate(instance.created_at), instance.stress_level, -1)
+
+
+# Connected after the rollup receivers so the chart is only dropped once the
+# rollup already reflects the change
+@receiver(post_save, sender=StressPrediction)
+@receiver(post_delete, sender=StressPrediction)
+def invalidate_dashboard(sender, instance, **kwargs):
+    """Drop the cached weekly chart of the user whose data changed"""
+    invalidate_weekly_chart(instance.user_id)
+
+
+@receiver(post_save, sender=StressTip)
+@receiver(post_delete, sender=StressTip)
+@receiver(post_save, sender=BreathingExercise)
+@receiver(post_delete, sender=BreathingExercise)
+@receiver(post_save, sender=MotivationalQuote)
+@receiver(post_delete, sender=MotivationalQuote)
+def invalidate_content_pool(sender, instance, **kwargs):
+    """Reload the home page content pools after an admin edit"""
+    content.invalidate()
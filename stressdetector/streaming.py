@@ -0,0 +1,226 @@
+"""
+Real-time stress scoring of a webcam stream over WebSocket.
+
+A client opens a WebSocket at STRESS_STREAM_PATH and sends one encoded frame
+(JPEG or PNG) per binary message; every frame the server scores is answered
+with a JSON text message. A frame that arrives while the model is still busy
+replaces the one waiting, so a slow server skips frames instead of falling
+further and further behind. The face detector only runs on every
+STRESS_STREAM_DETECT_EVERY-th frame and the last box is reused in between,
+and class probabilities are exponentially smoothed so the reported level
+does not flicker from frame to frame.
+
+Django's ASGI handler does not speak WebSocket, so asgi.py sends this path
+here and everything else to Django.
+"""
+import asyncio
+import json
+import time
+from http.cookies import SimpleCookie
+from importlib import import_module
+from io import BytesIO
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
+
+from . import inference, metrics, preprocessing
+
+# Stress score of each class, for the single 0-1 score clients can plot
+STRESS_WEIGHTS = np.array([0.0, 0.5, 1.0])
+
+# WebSocket close codes
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+CLOSE_TRY_AGAIN_LATER = 1013
+
+frame_seconds = metrics.histogram(
+    'stress_stream_frame_seconds',
+    'Time from receiving a stream frame to sending its score',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+frames_dropped = metrics.counter(
+    'stress_stream_frames_dropped_total',
+    'Stream frames skipped because a newer one arrived before they were scored',
+)
+
+
+def stress_score(probabilities):
+    """Expected stress in [0, 1] under the class probabilities"""
+    return round(float(probabilities @ STRESS_WEIGHTS / probabilities.sum()), 4)
+
+
+class StreamSession:
+    """Per-stream scoring state: the last face box and the smoothed probabilities"""
+
+    def __init__(self, engine, detect_every=None, smoothing=None):
+        self.engine = engine
+        self.detect_every = detect_every or settings.STRESS_STREAM_DETECT_EVERY
+        self.smoothing = settings.STRESS_STREAM_SMOOTHING if smoothing is None else smoothing
+        self.box = None
+        self.frames = 0
+        self.smoothed = None
+        self._input = np.empty((*engine.input_size, 1), dtype=np.float32)
+
+    def face_box(self, gray):
+        """Detect the face on every detect_every-th frame, reuse the last box otherwise"""
+        if self.engine.crop_face and self.frames % self.detect_every == 0:
+            self.box = preprocessing.find_face(gray)
+        return self.box
+
+    def score(self, frame):
+        """Score one encoded frame and fold it into the smoothed probabilities"""
+        gray = preprocessing.decode_grayscale(BytesIO(frame))
+        box = self.face_box(gray)
+        self.frames += 1
+        if box is not None:
+            gray = preprocessing.crop(gray, box)
+        model_input = preprocessing.to_model_input(gray, self.engine.input_size, out=self._input)
+
+        if self.engine.batcher is not None:
+            # Concurrent streams share forward passes
+            probabilities = np.asarray(self.engine.batcher(model_input), dtype=np.float64)
+        else:
+            probabilities = np.asarray(self.engine.predict_proba(model_input[np.newaxis])[0], dtype=np.float64)
+        if self.smoothed is None:
+            self.smoothed = probabilities
+        else:
+            self.smoothed = self.smoothed + self.smoothing * (probabilities - self.smoothed)
+
+        stress_level, mood_tag, confidence = self.engine.decode(self.smoothed)
+        return {
+            'stress_level': stress_level,
+            'mood_tag': mood_tag,
+            'confidence': confidence,
+            'score': stress_score(self.smoothed),
+            'frame_score': stress_score(probabilities),
+            'face': list(box) if box is not None else None,
+            'model_version': self.engine.model_version,
+        }
+
+
+class LatestFrame:
+    """A one-frame mailbox: putting a frame replaces one not yet taken"""
+
+    def __init__(self):
+        self._frame = None
+        self._received_at = None
+        self._ready = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        if self._frame is not None:
+            self.dropped += 1
+            frames_dropped.inc()
+        self._frame, self._received_at = frame, time.perf_counter()
+        self._ready.set()
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def get(self):
+        """Wait for the newest frame; (None, None) once the stream has closed"""
+        await self._ready.wait()
+        self._ready.clear()
+        if self.closed:
+            return None, None
+        frame, received_at = self._frame, self._received_at
+        self._frame = None
+        return frame, received_at
+
+
+def _loaded_engine():
+    engine = inference.get_engine()
+    engine.load()
+    return engine
+
+
+async def stream(scope, receive, send):
+    """ASGI app for one WebSocket stream; expects scope['user'] to be set"""
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    if not getattr(scope.get('user'), 'is_authenticated', False):
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+    try:
+        engine = await asyncio.to_thread(_loaded_engine)
+    except inference.ModelNotAvailable:
+        await send({'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+        return
+    await send({'type': 'websocket.accept'})
+
+    session = StreamSession(engine)
+    mailbox = LatestFrame()
+    max_bytes = settings.STRESS_STREAM_MAX_FRAME_BYTES
+
+    async def receive_frames():
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                mailbox.close()
+                return
+            frame = message.get('bytes')
+            if frame is not None and len(frame) <= max_bytes:
+                mailbox.put(frame)
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            frame, received_at = await mailbox.get()
+            if frame is None:
+                break
+            try:
+                result = await asyncio.to_thread(session.score, frame)
+            except preprocessing.ImageDecodeError as e:
+                result = {'error': str(e)}
+            if mailbox.closed:
+                break
+            elapsed = time.perf_counter() - received_at
+            frame_seconds.observe(elapsed)
+            result.update(frame=session.frames, dropped=mailbox.dropped, latency_ms=round(elapsed * 1000, 2))
+            await send({'type': 'websocket.send', 'text': json.dumps(result)})
+    finally:
+        receiver.cancel()
+
+
+def _same_origin(scope):
+    """Browsers send Origin on WebSocket handshakes; refuse other sites' pages"""
+    headers = dict(scope.get('headers', []))
+    origin = headers.get(b'origin')
+    if origin is None:
+        return True
+    return urlsplit(origin.decode('latin-1')).netloc == headers.get(b'host', b'').decode('latin-1')
+
+
+@sync_to_async
+def session_user(scope):
+    """The user logged in with the handshake's session cookie"""
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None or not _same_origin(scope):
+        return AnonymousUser()
+    session_engine = import_module(settings.SESSION_ENGINE)
+    return auth.get_user(SimpleNamespace(session=session_engine.SessionStore(morsel.value)))
+
+
+def router(django_application):
+    """ASGI app sending the stream WebSocket to stream() and the rest to Django"""
+    async def application(scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await django_application(scope, receive, send)
+        if scope['path'] != settings.STRESS_STREAM_PATH:
+            await receive()
+            await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+            return
+        scope = dict(scope, user=await session_user(scope))
+        return await stream(scope, receive, send)
+    return application
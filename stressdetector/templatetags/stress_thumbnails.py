@@ -0,0 +1,11 @@
+from django import template
+
+from stressdetector import thumbnails
+
+register = template.Library()
+
+
+@register.filter
+def thumbnail_url(field_file, size='small'):
+    """URL of a WebP thumbnail of an ImageField file, e.g. {{ prediction.image|thumbnail_url:'small' }}"""
+    return thumbnails.url(field_file, size)
@@ -1,3 +1,1501 @@
-from django.test import TestCase
+import csv
+import importlib.util
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.template import Context, Template
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import content, dashboard, export, heatmaps, inference, jobs, lexicon, metrics, registry, streaming, thumbnails, uploads
+from .batching import MicroBatcher
+from .inference import InferenceEngine
+from .models import (
+    BreathingExercise, DailyStressRollup, Job, MoodJournal, MotivationalQuote, StressComparison, StressPrediction,
+    StressTip, UserProfile
+)
+
+SCRIPTS_DIR = os.path.join(settings.BASE_DIR, 'scripts')
+
+
+def run_script(name, *args):
+    """Run one of the scripts/ entry points and return its stdout"""
+    result = subprocess.run(
+        [sys.executable, os.path.join(SCRIPTS_DIR, name), *map(str, args)],
+        capture_output=True, text=True, check=True,
+    )
+    return result.stdout
+
+
+def write_fer2013_csv(path, rows, seed=0):
+    """Write a FER2013-shaped CSV of random faces and return its pixels and emotions"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(rows, 48 * 48))
+    emotions = rng.integers(0, 7, size=rows)
+    usages = ['Training', 'PublicTest', 'PrivateTest']
+    with open(path, 'w') as f:
+        f.write('emotion,pixels,Usage\n')
+        for i in range(rows):
+            f.write(f"{emotions[i]},{' '.join(map(str, pixels[i]))},{usages[i % 3]}\n")
+    return pixels, emotions
+
+
+class TrainingPipelineSmokeTests(SimpleTestCase):
+    """Smoke runs of the preprocessing and training scripts on a tiny dataset"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.csv_path = os.path.join(self.tmp.name, 'fer2013.csv')
+        self.data_dir = os.path.join(self.tmp.name, 'fer2013')
+        self.pixels, self.emotions = write_fer2013_csv(self.csv_path, rows=150)
+
+    def test_process_fer2013_writes_memory_mappable_arrays(self):
+        output = run_script('process_fer2013.py', self.csv_path, self.data_dir, '--chunk-rows', 32, '--workers', 2)
+        self.assertIn('rows/sec', output)
+
+        images = np.load(os.path.join(self.data_dir, 'images.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(self.data_dir, 'labels.npy'))
+        self.assertEqual(images.shape, (150, 48, 48))
+        self.assertEqual(images.dtype, np.uint8)
+        np.testing.assert_array_equal(images.reshape(150, -1), self.pixels)
+        # Happy -> Low, Neutral -> Medium, Angry -> High
+        expected = np.array([2, 2, 2, 0, 2, 1, 1])[self.emotions]
+        np.testing.assert_array_equal(labels, expected)
+
+    def test_blank_lines_are_not_counted_as_rows(self):
+        with open(self.csv_path, 'a') as f:
+            f.write('\n\n')
+        run_script('process_fer2013.py', self.csv_path, self.data_dir, '--workers', 1)
+
+        images = np.load(os.path.join(self.data_dir, 'images.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(self.data_dir, 'labels.npy'))
+        with open(os.path.join(self.data_dir, 'metadata.json')) as f:
+            metadata = json.load(f)
+        self.assertEqual((images.shape[0], len(labels), metadata['rows']), (150, 150, 150))
+        np.testing.assert_array_equal(images[-1].ravel(), self.pixels[-1])
+
+    @skipUnless(importlib.util.find_spec('keras'), "Keras is not installed")
+    def test_train_model_smoke_run_writes_versioned_artifact(self):
+        run_script('process_fer2013.py', self.csv_path, self.data_dir, '--workers', 1)
+        models_dir = os.path.join(self.tmp.name, 'models')
+        output = run_script(
+            'train_model.py', self.data_dir, '--output', models_dir,
+            '--max-rows', 120, '--epochs', 1, '--batch-size', 32, '--workers', 1,
+        )
+        self.assertIn('samples/sec', output)
+
+        (version,) = os.listdir(models_dir)
+        self.assertTrue(os.path.exists(os.path.join(models_dir, version, 'model.keras')))
+        with open(os.path.join(models_dir, version, 'metadata.json')) as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata['version'], version)
+        self.assertEqual(metadata['classes'], ['Low', 'Medium', 'High'])
+        self.assertIn('validation_accuracy', metadata['metrics'])
+
+
+def create_prediction(user, stress_level='High'):
+    return StressPrediction.objects.create(
+        user=user, image='user_images/test.png', stress_level=stress_level, mood_tag='Sad', confidence=90
+    )
+
+
+class ProfileCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('counter')
+
+    def test_insert_updates_profile_in_one_query(self):
+        create_prediction(self.user, 'Low')
+        # INSERT prediction, UPDATE rollup, UPDATE profile
+        with self.assertNumQueries(3):
+            create_prediction(self.user, 'Low')
+
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.total_predictions, 2)
+        self.assertEqual(profile.avatar_state, 'happy')
+
+    def test_resaves_are_not_counted(self):
+        comparison = StressComparison.objects.create(
+            user=self.user, before_image='a.png', after_image='b.png',
+            before_stress_level='High', after_stress_level='Low',
+            before_confidence=80, after_confidence=70, improvement_score=0,
+        )
+        comparison.save()
+        prediction = create_prediction(self.user)
+        prediction.save()
+
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.total_comparisons, 1)
+        self.assertEqual(profile.total_predictions, 1)
+
+    def test_home_only_writes_the_avatar_state(self):
+        create_prediction(self.user, 'Low')
+        UserProfile.objects.filter(user=self.user).update(avatar_state='stressed')
+        self.client.force_login(self.user)
+
+        # A prediction saved right after home read the profile must stay counted
+        get_or_create = UserProfile.objects.get_or_create
+
+        def record_meanwhile(**kwargs):
+            result = get_or_create(**kwargs)
+            UserProfile.record_activity(self.user.id, 'total_predictions')
+            return result
+
+        with mock.patch.object(UserProfile.objects, 'get_or_create', side_effect=record_meanwhile), \
+                CaptureQueriesContext(connection) as queries:
+            self.client.get('/')
+        updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "stressdetector_userprofile"')]
+        self.assertEqual(len(updates), 2)
+        self.assertRegex(updates[1], r'^UPDATE "stressdetector_userprofile" SET "avatar_state" = \S+ WHERE')
+
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.avatar_state, profile.total_predictions), ('happy', 2))
+
+    def test_home_shows_a_sleeping_avatar_after_three_idle_days(self):
+        create_prediction(self.user, 'Low')
+        UserProfile.objects.filter(user=self.user).update(last_activity=timezone.now() - timedelta(days=3))
+        self.client.force_login(self.user)
+        self.client.get('/')
+        self.assertEqual(UserProfile.objects.get(user=self.user).avatar_state, 'sleeping')
+
+
+class ProfileCounterConcurrencyTests(TransactionTestCase):
+    """Parallel writers must not lose profile increments"""
+
+    writers = 8
+    rows_per_writer = 10
+
+    def run_in_parallel(self, target):
+        barrier = threading.Barrier(self.writers)
+        errors = []
+
+        def writer():
+            try:
+                barrier.wait()
+                for _ in range(self.rows_per_writer):
+                    target()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_parallel_predictions_journals_and_home_views_keep_exact_counts(self):
+        user = User.objects.create_user('racer')
+        clients = threading.local()
+
+        def write():
+            if not hasattr(clients, 'client'):
+                clients.client = Client()
+                clients.client.force_login(user)
+            create_prediction(user)
+            self.assertEqual(clients.client.get('/').status_code, 200)
+            MoodJournal.objects.create(user=user, text='long day', text_sentiment='Negative', combined_stress_level='High')
+
+        self.run_in_parallel(write)
+
+        profile = UserProfile.objects.get(user=user)
+        expected = self.writers * self.rows_per_writer
+        self.assertEqual(profile.total_predictions, expected)
+        self.assertEqual(profile.total_journal_entries, expected)
+        self.assertEqual(StressPrediction.objects.filter(user=user).count(), expected)
+
+
+class StressRollupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('trender')
+        self.client.force_login(self.user)
+
+    def rollup_counts(self):
+        return sorted(DailyStressRollup.objects.filter(user=self.user).values_list('day', 'stress_level', 'count'))
+
+    def test_creating_and_deleting_predictions_updates_the_rollup(self):
+        today = timezone.localdate()
+        first = create_prediction(self.user, 'High')
+        create_prediction(self.user, 'High')
+        create_prediction(self.user, 'Low')
+        self.assertEqual(self.rollup_counts(), [(today, 'High', 2), (today, 'Low', 1)])
+
+        first.delete()
+        self.assertEqual(self.rollup_counts(), [(today, 'High', 1), (today, 'Low', 1)])
+
+    def test_deleting_a_user_with_predictions_removes_their_rollups(self):
+        create_prediction(self.user, 'High')
+        create_prediction(self.user, 'Low')
+        self.user.delete()
+        self.assertFalse(DailyStressRollup.objects.exists())
+        self.assertFalse(StressPrediction.objects.exists())
+
+    def test_rebuild_matches_the_incremental_counts(self):
+        for level in ['Low', 'Medium', 'High', 'High', 'Medium']:
+            create_prediction(self.user, level)
+        create_prediction(self.user, 'Low').delete()
+        incremental = [row for row in self.rollup_counts() if row[2]]
+
+        call_command('rebuild_stress_rollups', stdout=StringIO())
+        self.assertEqual(self.rollup_counts(), incremental)
+
+    def test_trends_api_counts_each_window(self):
+        for days_ago, level in [(0, 'High'), (0, 'Low'), (20, 'Medium'), (60, 'High'), (200, 'Low'), (400, 'High')]:
+            prediction = create_prediction(self.user, level)
+            StressPrediction.objects.filter(pk=prediction.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        DailyStressRollup.rebuild([self.user.id])
+
+        expected = {
+            30: {'Low': 1, 'Medium': 1, 'High': 1},
+            90: {'Low': 1, 'Medium': 1, 'High': 2},
+            365: {'Low': 2, 'Medium': 1, 'High': 2},
+        }
+        for days, totals in expected.items():
+            data = self.client.get(f'/trends-api/?days={days}').json()
+            self.assertEqual(len(data['dates']), days)
+            self.assertEqual(data['dates'][-1], timezone.localdate().isoformat())
+            self.assertEqual({level: sum(counts) for level, counts in data['stress_counts'].items()}, totals, days)
+            self.assertEqual(data['stress_counts']['High'][-1], 1)
+
+    def test_trends_api_rejects_other_windows(self):
+        for days in ('14', '0', 'week'):
+            self.assertEqual(self.client.get(f'/trends-api/?days={days}').status_code, 400)
+
+
+class WeeklyChartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('charted')
+
+    def test_chart_averages_each_days_prediction_scores(self):
+        for level in ['High', 'High', 'Low']:
+            create_prediction(self.user, level)
+        older = create_prediction(self.user, 'Medium')
+        StressPrediction.objects.filter(pk=older.pk).update(created_at=timezone.now() - timedelta(days=2))
+        DailyStressRollup.rebuild([self.user.id])
+
+        chart = dashboard.build_weekly_chart(self.user.id)
+        self.assertEqual(len(chart['labels']), 7)
+        self.assertEqual(chart['labels'][-1], timezone.localdate().strftime('%a'))
+        self.assertEqual(chart['data'], [None, None, None, None, 67, None, 78])
+
+    def test_journal_placeholder_levels_do_not_move_the_chart(self):
+        create_prediction(self.user, 'High')
+        MoodJournal.objects.create(user=self.user, text='fine', text_sentiment='Positive', combined_stress_level='Medium')
+        self.assertEqual(dashboard.weekly_chart(self.user.id)['data'][-1], 100)
+
+    def test_cached_chart_is_dropped_when_predictions_change(self):
+        prediction = create_prediction(self.user, 'Low')
+        self.assertEqual(dashboard.weekly_chart(self.user.id)['data'][-1], 33)
+        with self.assertNumQueries(0):
+            dashboard.weekly_chart(self.user.id)
+
+        create_prediction(self.user, 'High')
+        self.assertEqual(dashboard.weekly_chart(self.user.id)['data'][-1], 66)
+        prediction.delete()
+        self.assertEqual(dashboard.weekly_chart(self.user.id)['data'][-1], 100)
+
+
+class ContentPoolTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(content, '_pool', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for level in ['Low', 'High', 'All']:
+            StressTip.objects.create(title=f'{level} tip', content='Breathe.', stress_level=level)
+        StressTip.objects.create(title='Retired tip', content='Old.', stress_level='High', is_active=False)
+        BreathingExercise.objects.create(name='Box', description='4-4-4', inhale_time=4, hold_time=4, exhale_time=4)
+        MotivationalQuote.objects.create(quote='Keep going.', author='Someone')
+        self.user = User.objects.create_user('reader')
+        self.client.force_login(self.user)
+
+    def test_tips_are_filtered_by_stress_level(self):
+        pool = content.get_pool()
+        self.assertEqual(sorted(tip.title for tip in pool.sample_tips('High', k=10)), ['All tip', 'High tip'])
+        self.assertEqual(sorted(tip.title for tip in pool.sample_tips('Low', k=10)), ['All tip', 'Low tip'])
+        self.assertEqual(len(pool.sample_tips(None, k=10)), 3)
+        self.assertEqual(len(pool.sample_tips('High', k=1)), 1)
+
+        create_prediction(self.user, 'High')
+        response = self.client.get('/')
+        self.assertEqual(sorted(tip.title for tip in response.context['tips']), ['All tip', 'High tip'])
+
+    def test_warm_home_page_does_not_query_content_tables(self):
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/')
+        self.assertEqual(response.context['quote'].quote, 'Keep going.')
+        self.assertEqual(response.context['exercise'].name, 'Box')
+        content_tables = ('stressdetector_stresstip', 'stressdetector_breathingexercise', 'stressdetector_motivationalquote')
+        self.assertEqual([query['sql'] for query in queries if any(table in query['sql'] for table in content_tables)], [])
+        with self.assertNumQueries(0):
+            content.get_pool()
+
+    def test_pool_is_reloaded_after_content_is_saved_or_deleted(self):
+        pool = content.get_pool()
+        quote = MotivationalQuote.objects.create(quote='One step at a time.')
+        reloaded = content.get_pool()
+        self.assertIsNot(reloaded, pool)
+        self.assertEqual(len(reloaded.quotes), 2)
+
+        StressTip.objects.filter(title='Low tip').get().delete()
+        self.assertEqual(sorted(tip.title for tip in content.get_pool().sample_tips('Low', k=10)), ['All tip'])
+
+        # Another process's edit only bumps the shared generation
+        content.get_pool()
+        MotivationalQuote.objects.filter(pk=quote.pk).update(is_active=False)
+        cache.incr(content.GENERATION_KEY)
+        self.assertEqual(len(content.get_pool().quotes), 1)
+
+
+class QueryPlanTests(TestCase):
+    """EXPLAIN QUERY PLAN checks for the hot per-user queries in views.py
+
+    Every query on a stressdetector table must be an index search, and
+    ordering must come from the index: a full table scan or a temp B-tree
+    for ORDER BY means an index stopped being used.
+    """
+
+    users = 4
+    predictions_per_user = 1500
+    journals_per_user = 500
+    comparisons_per_user = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create_user(f'planner{i}') for i in range(cls.users)]
+        cls.user = users[0]
+        for user in users:
+            StressPrediction.objects.bulk_create(
+                StressPrediction(user=user, image='user_images/test.png', stress_level=level, mood_tag='Neutral', confidence=60)
+                for level in ['Low', 'Medium', 'High'] * (cls.predictions_per_user // 3)
+            )
+            MoodJournal.objects.bulk_create(
+                MoodJournal(user=user, text='entry', text_sentiment='Neutral', combined_stress_level='Medium')
+                for _ in range(cls.journals_per_user)
+            )
+            StressComparison.objects.bulk_create(
+                StressComparison(
+                    user=user, before_image='a.png', after_image='b.png', before_stress_level='High',
+                    after_stress_level='Low', before_confidence=70, after_confidence=70, improvement_score=66,
+                )
+                for _ in range(cls.comparisons_per_user)
+            )
+        DailyStressRollup.rebuild()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def query_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assert_indexed(self, sql):
+        plan = self.query_plan(sql)
+        for step in plan:
+            self.assertNotRegex(step, r'TEMP B-TREE FOR .*ORDER BY', f"{sql}\n{plan}")
+            self.assertFalse(step.startswith('SCAN stressdetector_'), f"{sql}\n{plan}")
+
+    def assert_view_queries_indexed(self, url):
+        # Content pools are small admin-managed tables loaded once per process
+        content.get_pool()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        checked = [query['sql'] for query in queries if 'stressdetector_' in query['sql'] and query['sql'].startswith('SELECT')]
+        self.assertTrue(checked)
+        for sql in checked:
+            self.assert_indexed(sql)
+
+    def test_home_queries_use_indexes(self):
+        self.assert_view_queries_indexed('/')
+
+    def test_history_queries_use_indexes(self):
+        self.assert_view_queries_indexed('/history/')
+
+    def test_deep_history_pages_use_indexes(self):
+        first_page = self.client.get('/history-api/?limit=100').json()
+        cursor = first_page['next_cursor']
+        self.assert_view_queries_indexed(f'/history/?cursor={cursor}')
+        self.assert_view_queries_indexed(f'/history-api/?cursor={cursor}')
+
+    def test_trends_api_queries_use_indexes(self):
+        for days in (7, 365):
+            self.assert_view_queries_indexed(f'/trends-api/?days={days}')
+
+    def test_journal_listing_uses_index(self):
+        entries = MoodJournal.objects.filter(user=self.user).order_by('-created_at')
+        self.assert_indexed(str(entries.query))
+
+    def test_comparison_listing_uses_index(self):
+        comparisons = StressComparison.objects.filter(user=self.user).order_by('-created_at')
+        self.assert_indexed(str(comparisons.query))
+
+
+class HistoryPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('pager')
+        self.client.force_login(self.user)
+        for _ in range(45):
+            create_prediction(self.user)
+        # Identical timestamps force the id tie-breaker to do its job
+        anchor = StressPrediction.objects.order_by('pk')[10]
+        StressPrediction.objects.filter(pk__gt=anchor.pk).update(created_at=anchor.created_at)
+
+    def test_cursor_walk_returns_every_prediction_once_newest_first(self):
+        seen, cursor = [], ''
+        while cursor is not None:
+            page = self.client.get('/history-api/', {'cursor': cursor, 'limit': 10}).json()
+            seen.extend(row['id'] for row in page['results'])
+            cursor = page['next_cursor']
+
+        expected = list(StressPrediction.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor_is_rejected(self):
+        self.assertEqual(self.client.get('/history-api/?cursor=not-a-cursor').status_code, 400)
+        self.assertRedirects(self.client.get('/history/?cursor=not-a-cursor'), '/history/')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('exporter')
+        self.client.force_login(self.user)
+        for level in ['Low', 'Medium', 'High']:
+            create_prediction(self.user, level)
+        MoodJournal.objects.create(
+            user=self.user, text='tired, but "fine"\nreally', text_sentiment='Negative',
+            combined_stress_level='High', stress_keywords=['tired'],
+        )
+        StressComparison.objects.create(
+            user=self.user, before_image='a.png', after_image='b.png', before_stress_level='High',
+            after_stress_level='Low', before_confidence=80, after_confidence=70, improvement_score=66,
+        )
+        create_prediction(User.objects.create_user('someone-else'))
+
+    def get_export(self, export_format):
+        response = self.client.get(f'/export/{export_format}/')
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export_streams_every_record_of_the_user(self):
+        records = [json.loads(line) for line in self.get_export('ndjson').splitlines()]
+
+        self.assertEqual([record['record_type'] for record in records], ['prediction'] * 3 + ['journal', 'comparison'])
+        self.assertEqual([record['stress_level'] for record in records[:3]], ['Low', 'Medium', 'High'])
+        self.assertEqual(records[3]['stress_keywords'], ['tired'])
+        self.assertEqual(records[3]['text'], 'tired, but "fine"\nreally')
+
+    def test_csv_export_has_one_row_per_record(self):
+        rows = list(csv.DictReader(self.get_export('csv').splitlines(keepends=True)))
+
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[3]['record_type'], 'journal')
+        self.assertEqual(rows[3]['text'], 'tired, but "fine"\nreally')
+        self.assertEqual(json.loads(rows[3]['stress_keywords']), ['tired'])
+        self.assertEqual(rows[4]['improvement_score'], '66')
+
+    def test_output_is_yielded_in_buffered_chunks(self):
+        chunks = list(export.stream(self.user.id, 'ndjson', chunk_size=2, buffer_size=1))
+        self.assertEqual(len(chunks), 5)
+
+    def test_unknown_format_is_404(self):
+        self.assertEqual(self.client.get('/export/xlsx/').status_code, 404)
+
+
+class BrightnessModel:
+    """Stand-in classifier: dark images are High stress, bright ones Low"""
+
+    def predict_proba(self, batch):
+        brightness = batch.mean(axis=1)
+        return np.stack([brightness, np.full_like(brightness, 0.5), 1 - brightness], axis=1)
+
+
+class InvertedBrightnessModel(BrightnessModel):
+    """Stand-in for a retrained model that disagrees with BrightnessModel"""
+
+    def predict_proba(self, batch):
+        return super().predict_proba(batch)[:, ::-1]
+
+
+def png_bytes(value):
+    buffer = BytesIO()
+    Image.fromarray(np.full((64, 64), value, dtype=np.uint8)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.calls = []
+
+    def doubled(self, batch):
+        self.calls.append(len(batch))
+        return batch * 2
+
+    def batcher(self, max_batch_size=4, max_wait_ms=5000, predict_fn=None):
+        batcher = MicroBatcher(predict_fn or self.doubled, max_batch_size, max_wait_ms)
+        self.addCleanup(batcher.close)
+        return batcher
+
+    def test_concurrent_callers_share_one_forward_pass_and_get_their_own_rows(self):
+        batcher = self.batcher(max_batch_size=4)
+        barrier = threading.Barrier(4)
+        results = {}
+
+        def caller(i):
+            barrier.wait()
+            results[i] = batcher(np.full((2, 2, 1), i, dtype=np.float32))
+
+        threads = [threading.Thread(target=caller, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, [4])
+        for i in range(4):
+            np.testing.assert_array_equal(results[i], np.full((2, 2, 1), i * 2))
+
+    def test_max_batch_size_cuts_a_batch_short(self):
+        batcher = self.batcher(max_batch_size=2)
+        futures = [batcher.submit(np.full(3, i, dtype=np.float32)) for i in range(4)]
+        self.assertEqual([future.result(timeout=5)[0] for future in futures], [0, 2, 4, 6])
+        self.assertEqual(self.calls, [2, 2])
+
+    def test_an_exception_reaches_every_caller_in_the_batch(self):
+        def crash(batch):
+            raise RuntimeError('model crashed')
+
+        batcher = self.batcher(max_batch_size=3, predict_fn=crash)
+        futures = [batcher.submit(np.zeros(3, dtype=np.float32)) for _ in range(3)]
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, 'model crashed'):
+                future.result(timeout=5)
+
+    def test_calls_after_close_run_unbatched_without_a_worker(self):
+        batcher = self.batcher()
+        batcher.close()
+        self.assertIsNone(batcher.submit(np.zeros(3, dtype=np.float32)))
+        np.testing.assert_array_equal(batcher(np.ones(3, dtype=np.float32)), [2, 2, 2])
+        self.assertEqual(self.calls, [1])
+        self.assertIsNone(batcher._thread)
+
+    def test_close_stops_the_worker_after_queued_work(self):
+        batcher = self.batcher(max_batch_size=8, max_wait_ms=50)
+        future = batcher.submit(np.ones(3, dtype=np.float32))
+        batcher.close()
+        np.testing.assert_array_equal(future.result(timeout=5), [2, 2, 2])
+        batcher._thread.join(timeout=5)
+        self.assertFalse(batcher._thread.is_alive())
+
+
+class BatchedPredictionViewTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        cache.clear()
+
+        engine = InferenceEngine('stress_model.pkl', crop_face=False)
+        engine._model, engine.model_version = BrightnessModel(), 'test'
+        patcher = mock.patch.object(inference, '_engine', engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user('clinic')
+        self.client.force_login(self.user)
+
+    def zip_of(self, members):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            for name, data in members.items():
+                archive.writestr(name, data)
+        return SimpleUploadedFile('photos.zip', buffer.getvalue(), content_type='application/zip')
+
+    def test_files_and_zip_members_are_predicted_and_saved_together(self):
+        archive = self.zip_of({
+            'week1/dark.png': png_bytes(10),
+            'week1/broken.png': b'not an image',
+            'notes.txt': b'skipped',
+        })
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/predict-batch/', {'images': [
+                SimpleUploadedFile('bright.png', png_bytes(250)), archive,
+            ]})
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "stressdetector_stressprediction"')]
+        self.assertEqual(len(inserts), 1)
+
+        results = response.json()['results']
+        self.assertEqual([result['filename'] for result in results], ['bright.png', 'dark.png', 'broken.png'])
+        self.assertEqual([result.get('stress_level') for result in results], ['Low', 'High', None])
+        self.assertIn('error', results[2])
+        self.assertEqual(response.json()['saved'], 2)
+
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.total_predictions, 2)
+        self.assertEqual(
+            sorted(DailyStressRollup.objects.filter(user=self.user).values_list('stress_level', 'count')),
+            [('High', 1), ('Low', 1)],
+        )
+
+    def test_repeated_images_are_answered_from_the_cache(self):
+        self.client.post('/predict-batch/', {'images': [SimpleUploadedFile('a.png', png_bytes(250))]})
+        with mock.patch.object(BrightnessModel, 'predict_proba') as model:
+            response = self.client.post('/predict-batch/', {'images': [SimpleUploadedFile('b.png', png_bytes(250))]})
+        model.assert_not_called()
+        self.assertEqual(response.json()['results'][0]['stress_level'], 'Low')
+
+    def test_compare_scores_both_images_in_one_forward_pass(self):
+        with mock.patch.object(BrightnessModel, 'predict_proba', autospec=True, side_effect=BrightnessModel.predict_proba) as model, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/compare/', {
+                'before_image': SimpleUploadedFile('before.png', png_bytes(10)),
+                'after_image': SimpleUploadedFile('after.png', png_bytes(250)),
+            })
+
+        self.assertEqual(model.call_count, 1)
+        self.assertEqual(len(model.call_args.args[1]), 2)
+        comparison = response.context['comparison']
+        self.assertEqual((comparison.before_stress_level, comparison.after_stress_level), ('High', 'Low'))
+        self.assertEqual(comparison.improvement_score, 66)
+        writes = [query for query in queries if 'stressdetector_stresscomparison' in query['sql']]
+        self.assertEqual(len(writes), 1)
+
+    def count_saves(self):
+        return mock.patch.object(
+            uploads.ContentAddressedStorage, 'save', autospec=True, side_effect=uploads.ContentAddressedStorage.save
+        )
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media.name) for name in names]
+
+    def test_predict_writes_the_upload_once(self):
+        for background in (False, True):
+            with self.subTest(background=background), override_settings(STRESS_BACKGROUND_PREDICTIONS=background), \
+                    self.count_saves() as save:
+                self.client.post('/predict/', {'face_image': SimpleUploadedFile('face.png', png_bytes(40 + background))})
+            self.assertEqual(save.call_count, 1)
+        self.assertEqual(StressPrediction.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    def test_compare_writes_each_upload_once(self):
+        with self.count_saves() as save:
+            self.client.post('/compare/', {
+                'before_image': SimpleUploadedFile('before.png', png_bytes(10)),
+                'after_image': SimpleUploadedFile('after.png', png_bytes(250)),
+            })
+        self.assertEqual(save.call_count, 2)
+        self.assertEqual(len(self.stored_files()), 2)
+
+    @override_settings(STRESS_BATCH_UPLOAD_MAX_FILES=2)
+    def test_too_many_images_are_rejected(self):
+        archive = self.zip_of({f'{i}.png': png_bytes(i) for i in range(3)})
+        response = self.client.post('/predict-batch/', {'images': [archive]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StressPrediction.objects.exists())
+
+
+class LexiconTests(TestCase):
+    def setUp(self):
+        self.lexicon = lexicon.Lexicon({
+            'happy': (3, False), 'bad': (-2, False), 'deadline': (-1, True),
+            'burned out': (-3, True), 'burn': (-1, False), "can't sleep": (-2, True),
+        })
+
+    def test_terms_only_match_whole_words(self):
+        analysis = self.lexicon.analyze('Badminton then a happy evening, unhappiness aside')
+        self.assertEqual(analysis, lexicon.Analysis('Positive', 3.0, []))
+
+    def test_phrases_prefer_the_longest_term_and_report_stress_keywords(self):
+        analysis = self.lexicon.analyze("DEADLINE after deadline, totally Burned\n out and I can't sleep")
+        self.assertEqual(analysis.score, -7.0)
+        self.assertEqual(analysis.keywords, ['deadline', 'burned out', "can't sleep"])
+
+    def test_negators_flip_the_next_terms(self):
+        self.assertEqual(self.lexicon.analyze('not very happy').sentiment, 'Negative')
+        self.assertEqual(self.lexicon.analyze('not bad at all').sentiment, 'Positive')
+        self.assertEqual(self.lexicon.analyze('not that it matters, but happy').sentiment, 'Positive')
+
+    def test_negated_stress_terms_are_not_keywords(self):
+        analysis = self.lexicon.analyze("Not burned out, never deadline stress, but I can't sleep")
+        self.assertEqual(analysis.keywords, ["can't sleep"])
+        self.assertEqual(analysis.score, 2.0)
+        self.assertEqual(self.lexicon.analyze('no deadline today, then a deadline').keywords, ['deadline'])
+
+    def test_analyze_many_matches_analyze(self):
+        texts = ['happy', 'bad deadline', '']
+        self.assertEqual(self.lexicon.analyze_many(texts), [self.lexicon.analyze(text) for text in texts])
+
+    def test_journal_entries_get_sentiment_and_stress_keywords(self):
+        user = User.objects.create_user('writer')
+        self.client.force_login(user)
+        self.client.post('/journal/', {'text': 'Exam tomorrow and I feel so anxious. Played badminton.'})
+
+        entry = MoodJournal.objects.get(user=user)
+        self.assertEqual(entry.text_sentiment, 'Negative')
+        self.assertEqual(entry.stress_keywords, ['exam', 'anxious'])
+
+
+class RescorePredictionsTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.tmp.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.checkpoint = os.path.join(self.tmp.name, 'checkpoint.json')
+
+        engine = InferenceEngine('stress_model.pkl', crop_face=False)
+        engine._model, engine.model_version = BrightnessModel(), 'v2'
+        patcher = mock.patch.object(inference, '_engine', engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Stored as Medium by an older model; dark images are High, bright ones Low
+        self.user = User.objects.create_user('history')
+        for i, value in enumerate([10, 250, 10, 250, 10]):
+            prediction = StressPrediction(user=self.user, stress_level='Medium', mood_tag='Neutral', confidence=50)
+            prediction.image.save(f'{i}.png', SimpleUploadedFile(f'{i}.png', png_bytes(value)), save=False)
+            prediction.save()
+        self.journal = MoodJournal(user=self.user, text='entry', text_sentiment='Neutral', combined_stress_level='Medium')
+        self.journal.image.save('journal.png', SimpleUploadedFile('journal.png', png_bytes(10)), save=False)
+        self.journal.save()
+
+    def rescore(self, *args):
+        call_command('rescore_predictions', '--checkpoint', self.checkpoint, '--chunk-size', 2, *args, stdout=StringIO())
+
+    def test_rescores_predictions_journals_and_rollups(self):
+        self.rescore('--workers', 2)
+
+        levels = list(StressPrediction.objects.order_by('pk').values_list('stress_level', flat=True))
+        self.assertEqual(levels, ['High', 'Low', 'High', 'Low', 'High'])
+        self.journal.refresh_from_db()
+        self.assertEqual(self.journal.image_stress_level, 'High')
+        self.assertEqual(
+            dict(DailyStressRollup.objects.filter(user=self.user, count__gt=0).values_list('stress_level', 'count')),
+            {'High': 3, 'Low': 2},
+        )
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['model_version'], 'v2')
+
+    def test_resumes_after_the_checkpointed_row(self):
+        resume_after = StressPrediction.objects.order_by('pk')[2].pk
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'model_version': 'v2', 'last_pk': {'predictions': resume_after}}, f)
+
+        self.rescore('--workers', 0, '--skip-journals')
+
+        levels = list(StressPrediction.objects.order_by('pk').values_list('stress_level', flat=True))
+        self.assertEqual(levels, ['Medium', 'Medium', 'Medium', 'Low', 'High'])
+
+    def test_checkpoint_of_another_model_version_starts_over(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'model_version': 'v1', 'last_pk': {'predictions': 10 ** 9}}, f)
+
+        self.rescore('--workers', 0)
+
+        self.assertFalse(StressPrediction.objects.filter(stress_level='Medium').exists())
+
+
+class WarmEngineTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        model_path = os.path.join(self.tmp.name, 'stress_model.pkl')
+        with open(model_path, 'wb') as f:
+            pickle.dump(BrightnessModel(), f)
+        test_settings = override_settings(
+            STRESS_MODEL_PATH=model_path, STRESS_MODEL_REGISTRY=os.path.join(self.tmp.name, 'ml_models'),
+        )
+        test_settings.enable()
+        self.addCleanup(test_settings.disable)
+        patcher = mock.patch.object(inference, '_engine', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: inference._engine and inference._engine.close())
+
+    def test_repeated_predictions_reuse_one_loaded_engine(self):
+        image = np.full((48, 48), 250, dtype=np.uint8)
+        with mock.patch.object(inference, 'load_model', wraps=inference.load_model) as load_model:
+            engine = inference.get_engine()
+            results = [inference.predict(image) for _ in range(5)]
+
+        self.assertEqual(load_model.call_count, 1)
+        self.assertIs(inference.get_engine(), engine)
+        self.assertTrue(engine.is_loaded)
+        self.assertEqual({result.stress_level for result in results}, {'Low'})
+
+
+class ModelRegistryTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.registry = os.path.join(self.tmp.name, 'ml_models')
+        test_settings = override_settings(
+            MEDIA_ROOT=os.path.join(self.tmp.name, 'media'), STRESS_MODEL_REGISTRY=self.registry,
+            STRESS_MODEL_CHECK_INTERVAL=0, STRESS_BATCH_MAX_SIZE=4,
+        )
+        test_settings.enable()
+        self.addCleanup(test_settings.disable)
+        for name, value in [('_engine', None), ('_swapping_to', None), ('_failed_activation', None), ('_retired', [])]:
+            patcher = mock.patch.object(inference, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: inference._engine and inference._engine.close())
+        cache.clear()
+
+        self.add_version('v1', pickle.dumps(BrightnessModel()))
+        self.add_version('v2', pickle.dumps(InvertedBrightnessModel()))
+        call_command('activate_model', 'v1', stdout=StringIO())
+
+    def add_version(self, version, artifact):
+        os.makedirs(os.path.join(self.registry, version))
+        with open(os.path.join(self.registry, version, 'model.pkl'), 'wb') as f:
+            f.write(artifact)
+
+    def wait_for_version(self, version):
+        deadline = time.monotonic() + 10
+        while inference._engine.registry_version != version or inference._swapping_to:
+            self.assertLess(time.monotonic(), deadline, f"model {version} was not swapped in")
+            time.sleep(0.01)
+
+    def test_predictions_record_the_model_version(self):
+        user = User.objects.create_user('versioned')
+        self.client.force_login(user)
+        self.client.post('/predict/', {'face_image': SimpleUploadedFile('face.png', png_bytes(250))})
+        call_command('run_jobs', '--once', stdout=StringIO())
+
+        prediction = StressPrediction.objects.get(user=user)
+        self.assertEqual((prediction.stress_level, prediction.model_version), ('Low', 'v1'))
+
+    def test_activated_version_is_swapped_in_while_old_engine_finishes(self):
+        image = np.full((48, 48), 250, dtype=np.uint8)
+        old_engine = inference.get_engine()
+        self.assertEqual(inference.predict(image), ('Low', 'Happy', 98, 'v1'))
+
+        registry.activate('v2')
+        inference.get_engine()
+        self.wait_for_version('v2')
+
+        # A request that grabbed the old engine before the swap still completes on it
+        self.assertEqual(old_engine.predict(image)[0], 'Low')
+        self.assertEqual(inference.predict(image), ('High', 'Sad', 98, 'v2'))
+
+        stats = inference.model_stats()
+        self.assertEqual(stats['serving']['version'], 'v2')
+        self.assertEqual([retired['version'] for retired in stats['retired']], ['v1'])
+        self.assertIsNotNone(stats['serving']['load_seconds'])
+
+    def test_broken_version_keeps_serving_the_old_model(self):
+        self.add_version('v3', b'not a pickle')
+        inference.get_engine().load()
+        registry.activate('v3')
+
+        with self.assertLogs('stressdetector.inference', 'ERROR'):
+            engine = inference.swap_engine()
+        self.assertEqual(engine.model_version, 'v1')
+        self.assertEqual(inference.model_stats()['serving']['version'], 'v1')
+
+    def test_failed_version_is_retried_once_activated_again(self):
+        self.add_version('v3', b'not a pickle')
+        inference.get_engine().load()
+        registry.activate('v3')
+        with self.assertLogs('stressdetector.inference', 'ERROR'):
+            inference.swap_engine()
+        inference.get_engine()
+        self.assertIsNone(inference._swapping_to)
+
+        with open(os.path.join(self.registry, 'v3', 'model.pkl'), 'wb') as f:
+            f.write(pickle.dumps(InvertedBrightnessModel()))
+        registry.activate('v3')
+        inference.get_engine()
+        self.wait_for_version('v3')
+        self.assertIsNone(inference._failed_activation)
+
+    def test_successful_swap_clears_an_earlier_failure(self):
+        self.add_version('v3', b'not a pickle')
+        inference.get_engine().load()
+        registry.activate('v3')
+        with self.assertLogs('stressdetector.inference', 'ERROR'):
+            inference.swap_engine()
+        self.assertIsNotNone(inference._failed_activation)
+
+        registry.activate('v2')
+        self.assertEqual(inference.swap_engine().model_version, 'v2')
+        self.assertIsNone(inference._failed_activation)
+
+    @override_settings(STRESS_MODEL_PRELOAD=True)
+    def test_preload_survives_an_active_file_naming_a_missing_version(self):
+        with open(os.path.join(self.registry, registry.ACTIVE_FILE), 'w') as f:
+            f.write('v9\n')
+        with self.assertLogs('stressdetector.inference', 'WARNING') as logs:
+            inference.preload_engine()
+        self.assertIn("'v9'", logs.output[0])
+
+    def test_unknown_version_cannot_be_activated(self):
+        with self.assertRaises(CommandError):
+            call_command('activate_model', 'v9', stdout=StringIO())
+        self.assertEqual(registry.active_version(), 'v1')
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = User.objects.create_user('viewer')
+        self.client.force_login(self.user)
+        photo = BytesIO()
+        Image.new('RGB', (1200, 900), 'teal').save(photo, 'JPEG')
+        upload = SimpleUploadedFile('photo.jpg', photo.getvalue())
+        uploads.ingest(upload)
+        self.prediction = StressPrediction.objects.create(
+            user=self.user, image=upload, stress_level='Low', mood_tag='Happy', confidence=90
+        )
+
+    def render_url(self):
+        template = Template("{% load stress_thumbnails %}{{ prediction.image|thumbnail_url:'small' }}")
+        return template.render(Context({'prediction': self.prediction}))
+
+    def test_first_request_generates_a_webp_thumbnail_then_links_to_media(self):
+        lazy_url = self.render_url()
+        self.assertEqual(lazy_url, f'/thumbnails/small/{self.prediction.image.name}')
+
+        response = self.client.get(lazy_url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (160, 120)))
+
+        name = thumbnails.thumbnail_name(self.prediction.image.name, 'small')
+        self.assertEqual(self.render_url(), default_storage.url(name))
+
+    def test_existing_thumbnail_is_not_regenerated(self):
+        thumbnails.generate(self.prediction.image.name, 'small')
+        with mock.patch.object(thumbnails, 'render') as render:
+            thumbnails.generate(self.prediction.image.name, 'small')
+        render.assert_not_called()
+
+    def test_history_page_links_thumbnails(self):
+        response = self.client.get('/history/')
+        self.assertContains(response, f'/thumbnails/small/{self.prediction.image.name}')
+
+    def test_other_users_uploads_are_404(self):
+        self.client.force_login(User.objects.create_user('snooper'))
+        self.assertEqual(self.client.get(f'/thumbnails/small/{self.prediction.image.name}').status_code, 404)
+        self.assertFalse(default_storage.exists(thumbnails.thumbnail_name(self.prediction.image.name, 'small')))
+
+    def test_comparison_images_are_served_to_their_owner(self):
+        comparison = StressComparison.objects.create(
+            user=self.user, before_image=self.prediction.image.name, after_image='comparison_images/none.png',
+            before_stress_level='High', after_stress_level='Low', before_confidence=70, after_confidence=70,
+            improvement_score=66,
+        )
+        StressPrediction.objects.filter(pk=self.prediction.pk).delete()
+        response = self.client.get(f'/thumbnails/medium/{comparison.before_image.name}')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+    def test_unknown_sizes_and_paths_are_404(self):
+        self.assertEqual(self.client.get(f'/thumbnails/huge/{self.prediction.image.name}').status_code, 404)
+        self.assertEqual(self.client.get('/thumbnails/small/user_images/../../settings.py').status_code, 404)
+        self.assertEqual(self.client.get('/thumbnails/small/user_images/missing.jpg').status_code, 404)
+
+
+class HeatmapTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.engine = InferenceEngine('stress_model.pkl', crop_face=False)
+        self.engine._model, self.engine.model_version = BrightnessModel(), 'v1'
+        patcher = mock.patch.object(inference, '_engine', self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        failures = mock.patch.dict(heatmaps._failed, clear=True)
+        failures.start()
+        self.addCleanup(failures.stop)
+
+        self.user = User.objects.create_user('explained')
+        self.client.force_login(self.user)
+        # Bright left half, dark right half
+        pixels = np.zeros((64, 64), dtype=np.uint8)
+        pixels[:, :32] = 230
+        buffer = BytesIO()
+        Image.fromarray(pixels).save(buffer, format='PNG')
+        self.prediction = StressPrediction.objects.create(
+            user=self.user, image=SimpleUploadedFile('face.png', buffer.getvalue()),
+            stress_level='Low', mood_tag='Happy', confidence=60, model_version='v1',
+        )
+
+    def wait_for_heatmap(self, url):
+        deadline = time.monotonic() + 10
+        while True:
+            response = self.client.get(url)
+            if response.status_code != 202 or time.monotonic() > deadline:
+                return response
+            time.sleep(0.05)
+
+    def test_first_view_queues_the_heatmap_and_later_views_serve_it(self):
+        url = f'/heatmap/{self.prediction.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'status': 'pending'})
+        self.assertEqual(response['Retry-After'], '1')
+
+        response = self.wait_for_heatmap(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('private', response['Cache-Control'])
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as overlay:
+            self.assertEqual((overlay.format, overlay.size), ('WEBP', (192, 192)))
+        self.assertTrue(default_storage.exists(heatmaps.heatmap_name(self.prediction.pk, 'v1')))
+
+    def test_heatmaps_are_keyed_by_model_version(self):
+        heatmaps.generate(self.prediction)
+        self.engine.model_version = 'v2'
+        self.assertIsNone(heatmaps.get_or_schedule(self.prediction))
+        self.wait_for_heatmap(f'/heatmap/{self.prediction.pk}/')
+        self.assertTrue(default_storage.exists(heatmaps.heatmap_name(self.prediction.pk, 'v1')))
+        self.assertTrue(default_storage.exists(heatmaps.heatmap_name(self.prediction.pk, 'v2')))
+
+    def test_occlusion_highlights_the_regions_the_model_used(self):
+        model_input = self.engine.prepare(default_storage.path(self.prediction.image.name))
+        saliency = heatmaps.saliency_map(self.engine, model_input, inference.STRESS_LEVELS.index('Low'))
+        # BrightnessModel's Low score only depends on the bright pixels
+        self.assertGreater(saliency[:, :20].mean(), saliency[:, 28:].mean())
+        self.assertAlmostEqual(float(saliency.max()), 1.0)
+
+    def test_a_failed_heatmap_is_reported_instead_of_queued_again(self):
+        os.remove(default_storage.path(self.prediction.image.name))
+        url = f'/heatmap/{self.prediction.pk}/'
+        with mock.patch.object(heatmaps, 'generate', wraps=heatmaps.generate) as generate, \
+                self.assertLogs('stressdetector.heatmaps', 'ERROR'):
+            response = self.wait_for_heatmap(url)
+            for _ in range(3):
+                self.assertEqual(self.client.get(url).status_code, 422)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual(generate.call_count, 1)
+
+    def test_other_users_heatmaps_are_404(self):
+        self.client.force_login(User.objects.create_user('stranger'))
+        self.assertEqual(self.client.get(f'/heatmap/{self.prediction.pk}/').status_code, 404)
+
+
+def digest_of(data):
+    return uploads.content_hash(SimpleUploadedFile('x', data))
+
+
+class ContentAddressedUploadTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user('uploader')
+        self.forged_name = 'a' * uploads.CONTENT_HASH_LENGTH + '.png'
+
+    def read(self, field_file):
+        with default_storage.open(field_file.name) as f:
+            return f.read()
+
+    def test_identical_uploads_share_one_stored_file(self):
+        names = []
+        for filename in ('first.png', 'second.png'):
+            upload = SimpleUploadedFile(filename, png_bytes(70))
+            uploads.ingest(upload)
+            prediction = StressPrediction.objects.create(
+                user=self.user, image=upload, stress_level='Low', mood_tag='Happy', confidence=90
+            )
+            names.append(prediction.image.name)
+        self.assertEqual(names[0], names[1])
+        self.assertEqual(os.path.basename(names[0]), digest_of(png_bytes(70)) + '.png')
+
+    def test_hash_like_client_names_do_not_share_other_users_files(self):
+        other = User.objects.create_user('other-uploader')
+        for user, value in ((self.user, 10), (other, 240)):
+            self.client.force_login(user)
+            self.client.post('/journal/', {'text': 'photo', 'image': SimpleUploadedFile(self.forged_name, png_bytes(value))})
+
+        mine, theirs = (MoodJournal.objects.get(user=user).image for user in (self.user, other))
+        self.assertNotEqual(mine.name, theirs.name)
+        self.assertEqual(self.read(mine), png_bytes(10))
+        self.assertEqual(self.read(theirs), png_bytes(240))
+        self.assertEqual(os.path.basename(theirs.name), digest_of(png_bytes(240)) + '.png')
+
+    def test_uploads_that_skip_ingest_are_renamed_after_their_content(self):
+        prediction = StressPrediction.objects.create(
+            user=self.user, image=SimpleUploadedFile(self.forged_name, png_bytes(90)),
+            stress_level='Low', mood_tag='Happy', confidence=90,
+        )
+        self.assertTrue(uploads.is_sharded(prediction.image.name))
+        self.assertEqual(os.path.basename(prediction.image.name), digest_of(png_bytes(90)) + '.png')
+        self.assertEqual(self.read(prediction.image), png_bytes(90))
+
+    def test_legacy_hash_like_names_are_not_trusted(self):
+        legacy = f'user_images/user_{self.user.id}/{self.forged_name}'
+        self.assertNotEqual(thumbnails.source_key(legacy), 'a' * uploads.CONTENT_HASH_LENGTH)
+
+        path = default_storage.path(legacy)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(png_bytes(30))
+        prediction = create_prediction(self.user)
+        StressPrediction.objects.filter(pk=prediction.pk).update(image=legacy)
+        call_command('gc_media', '--migrate-layout', stdout=StringIO())
+
+        prediction.refresh_from_db()
+        self.assertEqual(os.path.basename(prediction.image.name), digest_of(png_bytes(30)) + '.png')
+
+
+class MediaGarbageCollectorTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user('collector')
+
+        upload = SimpleUploadedFile('face.png', png_bytes(120))
+        uploads.ingest(upload)
+        self.current = StressPrediction.objects.create(
+            user=self.user, image=upload, stress_level='Low', mood_tag='Happy', confidence=90
+        )
+        self.legacy = create_prediction(self.user)
+        self.legacy.image = self.write('user_images/user_1/legacy.png', png_bytes(30))
+        self.legacy.save()
+        self.write('user_images/user_1/orphan.png', png_bytes(200))
+        self.write(thumbnails.thumbnail_name('user_images/user_1/orphan.png', 'small'), b'webp')
+        thumbnails.generate(self.current.image.name, 'small')
+
+    def write(self, name, data):
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return name
+
+    def gc(self, *args):
+        out = StringIO()
+        call_command('gc_media', '--min-age', 0, *args, stdout=out)
+        return out.getvalue()
+
+    def test_uploads_are_stored_in_the_sharded_layout(self):
+        name = self.current.image.name
+        self.assertTrue(uploads.is_sharded(name), name)
+        digest = os.path.basename(name)
+        self.assertTrue(name.startswith(f'user_images/{digest[:2]}/{digest[2:4]}/'))
+
+    def test_dry_run_only_reports_unreferenced_files(self):
+        output = self.gc()
+        self.assertIn('Would delete 2 unreferenced files', output)
+        self.assertTrue(default_storage.exists('user_images/user_1/orphan.png'))
+
+    def test_delete_keeps_referenced_files_and_their_thumbnails(self):
+        self.gc('--delete')
+
+        self.assertFalse(default_storage.exists('user_images/user_1/orphan.png'))
+        self.assertFalse(default_storage.exists(thumbnails.thumbnail_name('user_images/user_1/orphan.png', 'small')))
+        self.assertTrue(default_storage.exists(self.current.image.name))
+        self.assertTrue(default_storage.exists(self.legacy.image.name))
+        self.assertTrue(default_storage.exists(thumbnails.thumbnail_name(self.current.image.name, 'small')))
+
+    def test_delete_keeps_heatmaps_of_done_predictions(self):
+        kept = self.write(heatmaps.heatmap_name(self.current.pk, 'v1'), b'webp')
+        kept_older_version = self.write(heatmaps.heatmap_name(self.current.pk, 'v0'), b'webp')
+        orphan = self.write(heatmaps.heatmap_name(self.current.pk + 1000, 'v1'), b'webp')
+        self.gc('--delete')
+
+        self.assertTrue(default_storage.exists(kept))
+        self.assertTrue(default_storage.exists(kept_older_version))
+        self.assertFalse(default_storage.exists(orphan))
+
+    def test_recent_files_are_left_alone(self):
+        call_command('gc_media', '--delete', stdout=StringIO())
+        self.assertTrue(default_storage.exists('user_images/user_1/orphan.png'))
+
+    def test_migrate_layout_moves_legacy_uploads_to_content_addressed_names(self):
+        self.gc('--migrate-layout', '--delete')
+
+        self.legacy.refresh_from_db()
+        self.assertTrue(uploads.is_sharded(self.legacy.image.name), self.legacy.image.name)
+        with default_storage.open(self.legacy.image.name) as f:
+            self.assertEqual(f.read(), png_bytes(30))
+        self.assertFalse(os.path.exists(default_storage.path('user_images/user_1')))
+
+
+class StreamTests(TestCase):
+    def setUp(self):
+        self.engine = InferenceEngine('stress_model.pkl', crop_face=False)
+        self.engine._model, self.engine.model_version = BrightnessModel(), 'test'
+        patcher = mock.patch.object(inference, '_engine', self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = streaming.router(mock.Mock())
+
+    def test_face_box_is_detected_every_nth_frame_and_reused_between(self):
+        self.engine.crop_face = True
+        session = streaming.StreamSession(self.engine, detect_every=3)
+        with mock.patch.object(streaming.preprocessing, 'find_face', return_value=(8, 8, 32, 32)) as find_face:
+            results = [session.score(png_bytes(200)) for _ in range(7)]
+        self.assertEqual(find_face.call_count, 3)
+        self.assertEqual(results[-1]['face'], [8, 8, 32, 32])
+
+    def test_scores_are_exponentially_smoothed(self):
+        session = streaming.StreamSession(self.engine, smoothing=0.5)
+        calm = session.score(png_bytes(255))
+        self.assertEqual((calm['stress_level'], calm['score']), ('Low', 0.1667))
+        spike = session.score(png_bytes(0))
+        self.assertEqual(spike['frame_score'], 0.8333)
+        # One dark frame only moves the smoothed score halfway
+        self.assertEqual((spike['stress_level'], spike['score']), ('Low', 0.5))
+
+    def test_a_newer_frame_replaces_one_not_yet_scored(self):
+        async def exchange():
+            mailbox = streaming.LatestFrame()
+            mailbox.put(b'old')
+            mailbox.put(b'new')
+            frame, _ = await mailbox.get()
+            mailbox.close()
+            return frame, mailbox.dropped, await mailbox.get()
+
+        self.assertEqual(async_to_sync(exchange)(), (b'new', 1, (None, None)))
+
+    def converse(self, path='/ws/stream/', cookie=None, frames=()):
+        """Connect, send frames, hang up; return the handshake reply and the scores"""
+        headers = [(b'host', b'testserver')]
+        if cookie:
+            headers.append((b'cookie', cookie.encode()))
+        communicator = ApplicationCommunicator(self.app, {'type': 'websocket', 'path': path, 'headers': headers})
+
+        async def conversation():
+            await communicator.send_input({'type': 'websocket.connect'})
+            handshake = await communicator.receive_output(timeout=5)
+            scores = []
+            if handshake['type'] == 'websocket.accept':
+                for frame in frames:
+                    await communicator.send_input({'type': 'websocket.receive', 'bytes': frame})
+                    scores.append(json.loads((await communicator.receive_output(timeout=5))['text']))
+                await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(timeout=5)
+            return handshake, scores
+        return async_to_sync(conversation)()
+
+    def test_logged_in_stream_gets_a_score_per_frame(self):
+        self.client.force_login(User.objects.create_user('streamer'))
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        handshake, scores = self.converse(cookie=cookie, frames=[png_bytes(0), png_bytes(0)])
+        self.assertEqual(handshake, {'type': 'websocket.accept'})
+        self.assertEqual([(score['stress_level'], score['frame']) for score in scores], [('High', 1), ('High', 2)])
+        self.assertEqual(scores[0]['model_version'], 'test')
+        self.assertIn('latency_ms', scores[0])
+
+    def test_anonymous_and_unknown_paths_are_closed(self):
+        handshake, _ = self.converse()
+        self.assertEqual(handshake, {'type': 'websocket.close', 'code': streaming.CLOSE_UNAUTHORIZED})
+        handshake, _ = self.converse(path='/ws/other/')
+        self.assertEqual(handshake, {'type': 'websocket.close', 'code': streaming.CLOSE_NOT_FOUND})
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=self.media.name, STRESS_JOB_RETRY_BACKOFF=60)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        cache.clear()
+
+        engine = InferenceEngine('stress_model.pkl', crop_face=False)
+        engine._model, engine.model_version = BrightnessModel(), 'test'
+        patcher = mock.patch.object(inference, '_engine', engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user('queued')
+        self.client.force_login(self.user)
+
+    def upload(self, value=10):
+        response = self.client.post(
+            '/predict/', {'face_image': SimpleUploadedFile('face.png', png_bytes(value))}, HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def test_upload_returns_a_pending_prediction_that_a_worker_fills_in(self):
+        pending = self.upload()
+        self.assertEqual((pending['status'], pending['stress_level']), ('pending', ''))
+        self.assertFalse(DailyStressRollup.objects.exists())
+        self.assertEqual(self.client.get(pending['status_url'])['Retry-After'], '1')
+
+        call_command('run_jobs', '--once', stdout=StringIO())
+
+        done = self.client.get(pending['status_url']).json()
+        self.assertEqual((done['status'], done['stress_level'], done['model_version']), ('done', 'High', 'test'))
+        self.assertEqual(self.client.get(pending['job_url']).json()['status'], 'done')
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_predictions, 1)
+        self.assertEqual(DailyStressRollup.objects.get(user=self.user).count, 1)
+        self.assertEqual(jobs.queue_stats()['depth']['done'], 1)
+
+    def test_identical_queued_uploads_share_the_prediction_cache(self):
+        hits, misses = uploads.cache_hits.value, uploads.cache_misses.value
+        self.upload(200)
+        self.upload(200)
+        with mock.patch.object(BrightnessModel, 'predict_proba', autospec=True, side_effect=BrightnessModel.predict_proba) as model:
+            call_command('run_jobs', '--once', stdout=StringIO())
+
+        self.assertEqual(model.call_count, 1)
+        self.assertEqual((uploads.cache_hits.value - hits, uploads.cache_misses.value - misses), (1, 1))
+        self.assertEqual(
+            list(StressPrediction.objects.values_list('status', 'stress_level')),
+            [(StressPrediction.DONE, 'Low')] * 2,
+        )
+
+    def test_failures_are_retried_with_backoff_then_given_up(self):
+        job = Job.objects.get(pk=self.upload()['job_url'].split('/')[-2])
+        crash = mock.patch.object(jobs.inference, 'predict', side_effect=RuntimeError('model crashed'))
+        with crash, self.assertLogs('stressdetector.jobs', 'ERROR'):
+            retried = jobs.run_next('worker')
+            self.assertEqual((retried.status, retried.attempts), (Job.QUEUED, 1))
+            self.assertGreater(retried.run_after, timezone.now())
+            # Not due yet
+            self.assertIsNone(jobs.run_next('worker'))
+
+            for _ in range(job.max_attempts - 1):
+                Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+                failed = jobs.run_next('worker')
+        self.assertEqual((failed.status, failed.attempts), (Job.FAILED, job.max_attempts))
+        self.assertIn('model crashed', failed.error)
+        self.assertEqual(StressPrediction.objects.get(user=self.user).status, StressPrediction.FAILED)
+
+    def test_job_of_a_dead_worker_is_run_again_and_counted_once(self):
+        self.upload()
+        crashed = jobs.claim('crashed-worker')
+        self.assertIsNone(jobs.claim('other-worker'))
+
+        Job.objects.filter(pk=crashed.pk).update(leased_until=timezone.now() - timedelta(seconds=1))
+        rerun = jobs.run_next('other-worker')
+        self.assertEqual((rerun.status, rerun.attempts, rerun.worker), (Job.DONE, 2, 'other-worker'))
+
+        # A late duplicate delivery changes nothing
+        jobs.score_prediction(rerun.payload)
+        self.assertEqual(UserProfile.objects.get(user=self.user).total_predictions, 1)
+        self.assertEqual(DailyStressRollup.objects.get(user=self.user).count, 1)
+
+    def test_other_users_jobs_and_predictions_are_404(self):
+        pending = self.upload()
+        self.client.force_login(User.objects.create_user('nosy'))
+        self.assertEqual(self.client.get(pending['status_url']).status_code, 404)
+        self.assertEqual(self.client.get(pending['job_url']).status_code, 404)
+
+
+class JobLeaseTests(TransactionTestCase):
+    """The lease heartbeat runs on its own connection, so these jobs commit"""
+
+    def test_a_job_longer_than_its_lease_is_not_run_twice(self):
+        runs = []
+
+        def slow(payload):
+            runs.append(payload)
+            time.sleep(0.6)
+            # Well past the 0.2 s lease, yet the heartbeat still holds the job
+            self.assertIsNone(jobs.claim('other-worker', lease_seconds=0.2))
+
+        with mock.patch.dict(jobs.HANDLERS, slow=jobs.Handler(slow, None)):
+            jobs.enqueue('slow', {'n': 1})
+            job = jobs.run_next('worker', lease_seconds=0.2)
+        self.assertEqual((job.status, job.attempts, job.worker), (Job.DONE, 1, 'worker'))
+        self.assertEqual(runs, [{'n': 1}])
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('measured')
+        self.client.force_login(self.user)
+        create_prediction(self.user)
+
+    def view_histogram(self, name, view):
+        return metrics.histogram(name, '', (), {'view': view}).snapshot()
+
+    def test_views_get_wall_query_and_template_histograms(self):
+        before = self.view_histogram('stress_request_seconds', 'history')['count']
+        self.client.get('/history/')
+
+        self.assertEqual(self.view_histogram('stress_request_seconds', 'history')['count'], before + 1)
+        self.assertGreater(self.view_histogram('stress_request_db_queries', 'history')['sum'], 0)
+        self.assertGreater(self.view_histogram('stress_request_template_seconds', 'history')['sum'], 0)
+
+    def test_inference_time_is_recorded_for_predictions(self):
+        engine = InferenceEngine('stress_model.pkl', crop_face=False)
+        engine._model, engine.model_version = BrightnessModel(), 'test'
+        before = self.view_histogram('stress_request_inference_seconds', 'predict')['sum']
+        with tempfile.TemporaryDirectory() as media, mock.patch.object(inference, '_engine', engine), \
+                override_settings(MEDIA_ROOT=media, STRESS_BACKGROUND_PREDICTIONS=False):
+            self.client.post('/predict/', {'face_image': SimpleUploadedFile('face.png', png_bytes(40))})
+        self.assertGreater(self.view_histogram('stress_request_inference_seconds', 'predict')['sum'], before)
+
+    def test_metrics_are_served_in_prometheus_format_to_local_clients_only(self):
+        self.client.get('/trends-api/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertEqual(body.count('# TYPE stress_request_seconds histogram'), 1)
+        self.assertIn('stress_request_seconds_bucket{view="trends_api",le="+Inf"}', body)
+        self.assertIn('stress_request_db_queries_count{view="trends_api"}', body)
+
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 404)
+
+    def test_slow_requests_are_logged_with_their_slowest_queries(self):
+        with override_settings(STRESS_SLOW_REQUEST_SECONDS=0), \
+                self.assertLogs('stressdetector.slow_requests', 'WARNING') as logs:
+            self.client.get('/history/')
+        self.assertIn('Slow request GET /history/ (history)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    def test_label_values_are_escaped(self):
+        metrics.counter('stress_test_escaping', 'Escaping check', {'path': 'a"b\\c'}).inc()
+        self.assertIn('stress_test_escaping{path="a\\"b\\\\c"} 1', metrics.render_prometheus())
@@ -0,0 +1,182 @@
+"""
+Content hashing and de-duplication of uploaded images.
+
+Every upload is hashed once on ingest and renamed after its content, so the
+upload path functions in models.py produce the same name for the same bytes.
+ContentAddressedStorage then reuses the stored file instead of writing
+another ``_abc123`` suffixed copy, and the hash keys the prediction cache.
+
+A name that merely looks like a hash is never trusted: the storage checks
+it against the bytes and renames the file if they differ.
+
+Content-addressed files are sharded by the first two byte pairs of their
+hash (``user_images/3f/a2/3fa2....jpg``), which keeps every directory to a
+few hundred entries however many images are stored.
+"""
+import hashlib
+import os
+import re
+import zipfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+
+from . import metrics
+
+# Hex characters kept from the SHA-256 digest; 128 bits keeps paths well
+# inside the ImageField max_length
+CONTENT_HASH_LENGTH = 32
+
+CONTENT_NAME_RE = re.compile(r'^[0-9a-f]{%d}(\.[0-9a-z]+)?$' % CONTENT_HASH_LENGTH)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff'}
+
+dedup_hits = metrics.counter(
+    'stress_upload_dedup_hits_total',
+    'Uploads that reused an already stored file',
+)
+dedup_bytes_saved = metrics.counter(
+    'stress_upload_dedup_bytes_saved_total',
+    'Bytes not written to media storage thanks to de-duplication',
+)
+cache_hits = metrics.counter(
+    'stress_prediction_cache_hits_total',
+    'Predictions answered from the content-hash cache',
+)
+cache_misses = metrics.counter(
+    'stress_prediction_cache_misses_total',
+    'Predictions that had to run the model',
+)
+
+
+def content_hash(upload):
+    """Return the content hash of an upload, computing it only once"""
+    digest = getattr(upload, 'content_hash', None)
+    if digest is None:
+        hasher = hashlib.sha256()
+        for chunk in upload.chunks():
+            hasher.update(chunk)
+        upload.seek(0)
+        digest = upload.content_hash = hasher.hexdigest()[:CONTENT_HASH_LENGTH]
+    return digest
+
+
+def ingest(upload):
+    """Hash an upload and rename it after its content"""
+    digest = content_hash(upload)
+    extension = os.path.splitext(upload.name or '')[1].lower() or '.jpg'
+    upload.name = digest + extension
+    return digest
+
+
+class UploadRejected(ValueError):
+    """Raised when a batch upload breaks the file count or size limits"""
+
+
+def _zip_members(archive, max_image_bytes):
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+            continue
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        if info.file_size > max_image_bytes:
+            raise UploadRejected(f"{name} is larger than {max_image_bytes} bytes")
+        with archive.open(info) as member:
+            # Read one byte past the limit rather than trusting the header
+            data = member.read(max_image_bytes + 1)
+        if len(data) > max_image_bytes:
+            raise UploadRejected(f"{name} is larger than {max_image_bytes} bytes")
+        yield ContentFile(data, name=name)
+
+
+def expand_uploads(files, max_files, max_image_bytes):
+    """Return the images in a list of uploads, unpacking any zip archives"""
+    images = []
+    for upload in files:
+        if os.path.splitext(upload.name or '')[1].lower() == '.zip':
+            try:
+                with zipfile.ZipFile(upload) as archive:
+                    for image in _zip_members(archive, max_image_bytes):
+                        images.append(image)
+                        if len(images) > max_files:
+                            break
+            except zipfile.BadZipFile as exc:
+                raise UploadRejected(f"{upload.name} is not a valid zip archive") from exc
+        else:
+            if upload.size > max_image_bytes:
+                raise UploadRejected(f"{upload.name} is larger than {max_image_bytes} bytes")
+            images.append(upload)
+        if len(images) > max_files:
+            raise UploadRejected(f"At most {max_files} images can be analyzed at once")
+    return images
+
+
+def is_content_addressed(name):
+    return bool(CONTENT_NAME_RE.match(os.path.basename(name)))
+
+
+def sharded_name(prefix, name):
+    """Storage name of a content-addressed file under prefix, e.g. user_images/3f/a2/3fa2....jpg"""
+    base = os.path.basename(name)
+    return '/'.join([prefix, base[0:2], base[2:4], base])
+
+
+def is_sharded(name):
+    parts = name.split('/')
+    return (
+        len(parts) == 4 and is_content_addressed(parts[3])
+        and parts[1] == parts[3][0:2] and parts[2] == parts[3][2:4]
+    )
+
+
+def stored_content_hash(name):
+    """Content hash of a stored upload read from its sharded name, or None
+
+    Only the storage writes sharded names, after checking them against the
+    bytes, so unlike a client-chosen name they can be trusted.
+    """
+    if is_sharded(name):
+        return os.path.splitext(os.path.basename(name))[0]
+    return None
+
+
+def content_name(name, digest):
+    """A content-addressed storage name renamed, if needed, after the given hash"""
+    base = os.path.basename(name)
+    stem, extension = os.path.splitext(base)
+    if stem == digest:
+        return name
+    if is_sharded(name):
+        return sharded_name(name.split('/', 1)[0], digest + extension)
+    return os.path.join(os.path.dirname(name), digest + extension)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File storage that stores identical content-named uploads only once"""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if is_content_addressed(name):
+            # A hash-like name may come straight from the client, so it is
+            # only trusted once it matches the bytes: ingest() hashed the
+            # upload already, anything else is hashed (and renamed) here
+            name = content_name(name, content_hash(content))
+            if self.exists(name):
+                dedup_hits.inc()
+                dedup_bytes_saved.inc(content.size)
+                return name
+        return super().save(name, content, max_length=max_length)
+
+
+def stats():
+    """Prediction cache hit ratio and de-duplication savings"""
+    lookups = cache_hits.value + cache_misses.value
+    return {
+        'cache_hits': cache_hits.value,
+        'cache_misses': cache_misses.value,
+        'cache_hit_ratio': cache_hits.value / lookups if lookups else 0.0,
+        'dedup_hits': dedup_hits.value,
+        'dedup_bytes_saved': dedup_bytes_saved.value,
+    }
@@ -7,8 +7,17 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('predict/', views.predict, name='predict'),
+    path('predictions/<int:prediction_id>/status/', views.prediction_status, name='prediction_status'),
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('predict-batch/', views.predict_batch, name='predict_batch'),
     path('history/', views.history, name='history'),
+    path('history-api/', views.history_api, name='history_api'),
+    path('export/<str:export_format>/', views.export_history, name='export_history'),
+    path('thumbnails/<str:size>/<path:name>', views.thumbnail, name='thumbnail'),
+    path('heatmap/<int:prediction_id>/', views.heatmap, name='heatmap'),
     path('journal/', views.journal, name='journal'),
     path('compare/', views.compare, name='compare'),
     path('trends-api/', views.trends_api, name='trends_api'),
+    path('inference-stats/', views.inference_stats, name='inference_stats'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,52 +1,56 @@
-from django.shortcuts import render, redirect
-from django.core.files.storage import FileSystemStorage
-from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.core.files.storage import default_storage
+from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
 import json
-import random
-from .models import StressPrediction, UserProfile, StressTip, BreathingExercise, MotivationalQuote, MoodJournal, StressComparison
+from . import batching, content, dashboard, export, heatmaps, inference, jobs, lexicon, metrics, thumbnails, uploads
+from .pagination import InvalidCursor, keyset_page
+from .models import StressPrediction, UserProfile, MoodJournal, StressComparison, DailyStressRollup, Job
 
 @login_required(login_url='login')
 def home(request):
     # Get user profile
     profile, created = UserProfile.objects.get_or_create(user=request.user)
     
-    # Check for sleep mode (no activity for 3 days)
+    # Get latest scored prediction for avatar
+    latest_prediction = (
+        StressPrediction.objects.filter(user=request.user, status=StressPrediction.DONE)
+        .order_by('-created_at').first()
+    )
+    
+    # Sleep mode after 3 days without activity, else match the latest prediction
     days_inactive = (timezone.now() - profile.last_activity).days
+    avatar_state = profile.avatar_state
     if days_inactive >= 3:
-        profile.avatar_state = 'sleeping'
-        profile.save()
-    
-    # Get weekly stress data
-    end_date = timezone.now().date()
-    start_date = end_date - timedelta(days=6)
-    
-    # Get latest prediction for avatar
-    latest_prediction = StressPrediction.objects.filter(user=request.user).order_by('-created_at').first()
-    
-    # Update avatar state based on latest prediction
-    if latest_prediction and days_inactive < 3:
-        if latest_prediction.stress_level == 'Low':
-            profile.avatar_state = 'happy'
-        elif latest_prediction.stress_level == 'Medium':
-            profile.avatar_state = 'neutral'
-        else:
-            profile.avatar_state = 'stressed'
-        profile.save()
+        avatar_state = 'sleeping'
+    elif latest_prediction:
+        avatar_state = UserProfile.avatar_state_for(latest_prediction.stress_level)
     
-    # Get random tips and quotes
-    tips = list(StressTip.objects.filter(is_active=True))
-    exercises = list(BreathingExercise.objects.filter(is_active=True))
-    quotes = list(MotivationalQuote.objects.filter(is_active=True))
+    # Write only the avatar, so the counters other requests update with F()
+    # are never overwritten with this request's stale copy
+    if avatar_state != profile.avatar_state:
+        profile.avatar_state = avatar_state
+        profile.save(update_fields=['avatar_state'])
     
-    selected_tips = random.sample(tips, min(3, len(tips))) if tips else []
-    selected_exercise = random.choice(exercises) if exercises else None
-    selected_quote = random.choice(quotes) if quotes else None
+    # Get random tips and quotes from the in-process pools, matching tips to
+    # the user's latest stress level
+    pool = content.get_pool()
+    selected_tips = pool.sample_tips(latest_prediction.stress_level if latest_prediction else None)
+    selected_exercise = pool.random_exercise()
+    selected_quote = pool.random_quote()
+    
+    # Get weekly stress data (cached per user until new data is saved)
+    chart = dashboard.weekly_chart(request.user.id)
     
     context = {
         'profile': profile,
@@ -55,8 +59,8 @@ def home(request):
         'tips': selected_tips,
         'exercise': selected_exercise,
         'quote': selected_quote,
-        'labels': json.dumps(['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']),
-        'data': json.dumps([60, 70, 65, 80, 75, 60, 55])
+        'labels': json.dumps(chart['labels']),
+        'data': json.dumps(chart['data'])
     }
     
     return render(request, 'stressdetector/home.html', context)
@@ -68,26 +72,35 @@ def predict(request):
     
     if request.method == 'POST' and request.FILES.get('face_image'):
         image = request.FILES['face_image']
-        fs = FileSystemStorage()
-        filename = fs.save(image.name, image)
+        # Name the upload after its content so re-uploads share one file
+        uploads.ingest(image)
+        
+        if settings.STRESS_BACKGROUND_PREDICTIONS:
+            # Store the photo now and let a run_jobs worker score it
+            with transaction.atomic():
+                prediction = StressPrediction.objects.create(
+                    user=request.user,
+                    image=image,
+                    status=StressPrediction.PENDING
+                )
+                job = jobs.enqueue('predict', {'prediction_id': prediction.pk}, user=request.user)
+            if request.headers.get('Accept') == 'application/json':
+                return JsonResponse(prediction_payload(prediction, job), status=202)
+            messages.success(request, "Your photo is being analyzed; the result will appear in your history shortly.")
+            return redirect('home')
         
         try:
-            # Mock prediction - replace with actual ML model
-            prediction_data = {
-                'stress_level': 'Medium',
-                'mood_tag': 'Neutral',
-                'stress_type': 'Work',
-                'confidence': 78
-            }
+            # Decode the upload once and run the warm, process-wide model
+            result = inference.predict(image)
             
-            # Save to database
+            # Save to database; the ImageField is the only place the file is written
             prediction = StressPrediction.objects.create(
                 user=request.user,
                 image=image,
-                stress_level=prediction_data['stress_level'],
-                mood_tag=prediction_data['mood_tag'],
-                stress_type=prediction_data['stress_type'],
-                confidence=prediction_data['confidence']
+                stress_level=result.stress_level,
+                mood_tag=result.mood_tag,
+                confidence=result.confidence,
+                model_version=result.model_version
             )
             
             messages.success(request, "Stress analysis completed successfully!")
@@ -96,6 +109,104 @@ def predict(request):
     
     return redirect('home')
 
+def prediction_payload(prediction, job=None):
+    """JSON description of a prediction, with where to poll while it is pending"""
+    payload = {
+        'id': prediction.pk,
+        'status': prediction.status,
+        'stress_level': prediction.stress_level,
+        'mood_tag': prediction.mood_tag,
+        'confidence': prediction.confidence,
+        'model_version': prediction.model_version,
+        'status_url': reverse('prediction_status', args=[prediction.pk]),
+    }
+    if job is not None:
+        payload['job_url'] = reverse('job_status', args=[job.pk])
+    return payload
+
+@login_required(login_url='login')
+def prediction_status(request, prediction_id):
+    """Poll a prediction until a background job has scored it"""
+    prediction = get_object_or_404(StressPrediction, pk=prediction_id, user=request.user)
+    response = JsonResponse(prediction_payload(prediction))
+    if prediction.status == StressPrediction.PENDING:
+        response['Retry-After'] = '1'
+    return response
+
+@login_required(login_url='login')
+def job_status(request, job_id):
+    """Status, attempts and last error of one of the user's background jobs"""
+    job = get_object_or_404(Job, pk=job_id, user=request.user)
+    return JsonResponse({
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'error': job.error,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    })
+
+@login_required(login_url='login')
+def predict_batch(request):
+    """Analyze several images, or zip archives of images, in one request"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST one or more files as "images"'}, status=405)
+    
+    try:
+        images = uploads.expand_uploads(
+            request.FILES.getlist('images'),
+            settings.STRESS_BATCH_UPLOAD_MAX_FILES,
+            settings.STRESS_BATCH_UPLOAD_MAX_IMAGE_BYTES
+        )
+    except uploads.UploadRejected as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not images:
+        return JsonResponse({'error': 'No images uploaded'}, status=400)
+    
+    # Keep the uploaded names for the response before ingest renames them
+    filenames = [image.name for image in images]
+    for image in images:
+        uploads.ingest(image)
+    
+    try:
+        results = inference.predict_many(images)
+    except inference.ModelNotAvailable as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    
+    # One INSERT for every image that could be analyzed
+    predictions = StressPrediction.bulk_record(request.user.id, [
+        StressPrediction(
+            user=request.user,
+            image=image,
+            stress_level=result.stress_level,
+            mood_tag=result.mood_tag,
+            confidence=result.confidence,
+            model_version=result.model_version
+        )
+        for image, result in zip(images, results)
+        if not isinstance(result, Exception)
+    ])
+    dashboard.invalidate_weekly_chart(request.user.id)
+    
+    saved = iter(predictions)
+    response = []
+    for filename, result in zip(filenames, results):
+        if isinstance(result, Exception):
+            response.append({'filename': filename, 'error': str(result)})
+        else:
+            prediction = next(saved)
+            response.append({
+                'filename': filename,
+                'id': prediction.id,
+                'stress_level': prediction.stress_level,
+                'mood_tag': prediction.mood_tag,
+                'confidence': prediction.confidence,
+                'model_version': prediction.model_version
+            })
+    return JsonResponse({'results': response, 'saved': len(predictions)})
+
 def register(request):
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
@@ -134,32 +245,135 @@ def logout_view(request):
     messages.success(request, "You have been logged out successfully.")
     return redirect('login')
 
+HISTORY_PAGE_SIZE = 20
+HISTORY_API_MAX_LIMIT = 100
+
 @login_required(login_url='login')
 def history(request):
-    predictions = StressPrediction.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'stressdetector/history.html', {'predictions': predictions})
+    cursor = request.GET.get('cursor')
+    try:
+        predictions, next_cursor = keyset_page(
+            StressPrediction.objects.filter(user=request.user), cursor, HISTORY_PAGE_SIZE
+        )
+    except InvalidCursor:
+        return redirect('history')
+    return render(request, 'stressdetector/history.html', {
+        'predictions': predictions,
+        'next_cursor': next_cursor,
+        'is_first_page': not cursor
+    })
+
+@login_required(login_url='login')
+def history_api(request):
+    """JSON pages of the user's predictions with the same cursors as history"""
+    try:
+        limit = min(int(request.GET.get('limit', HISTORY_PAGE_SIZE)), HISTORY_API_MAX_LIMIT)
+        predictions, next_cursor = keyset_page(
+            StressPrediction.objects.filter(user=request.user), request.GET.get('cursor'), max(limit, 1)
+        )
+    except (InvalidCursor, ValueError):
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
+    
+    return JsonResponse({
+        'results': [
+            {
+                'id': prediction.id,
+                'created_at': prediction.created_at.isoformat(),
+                'stress_level': prediction.stress_level,
+                'mood_tag': prediction.mood_tag,
+                'stress_type': prediction.stress_type,
+                'confidence': prediction.confidence,
+                'model_version': prediction.model_version,
+                'image_url': prediction.image.url if prediction.image else None
+            }
+            for prediction in predictions
+        ],
+        'next_cursor': next_cursor
+    })
+
+@login_required(login_url='login')
+def export_history(request, export_format):
+    """Stream every prediction, journal entry and comparison as NDJSON or CSV"""
+    if export_format not in export.CONTENT_TYPES:
+        raise Http404("Unknown export format")
+    
+    filename = f"stress-history-{request.user.username}-{timezone.localdate():%Y%m%d}.{export_format}"
+    response = StreamingHttpResponse(
+        export.stream(request.user.id, export_format),
+        content_type=export.CONTENT_TYPES[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def owns_upload(user, name):
+    """Whether one of the user's predictions, comparisons or journal entries stores this file"""
+    return (
+        StressPrediction.objects.filter(user=user, image=name).exists()
+        or StressComparison.objects.filter(Q(before_image=name) | Q(after_image=name), user=user).exists()
+        or MoodJournal.objects.filter(user=user, image=name).exists()
+    )
+
+@login_required(login_url='login')
+def thumbnail(request, size, name):
+    """Generate a thumbnail of one of the user's uploads on its first request and serve it"""
+    if size not in settings.STRESS_THUMBNAIL_SIZES or '..' in name.split('/'):
+        raise Http404("No such image")
+    # Only the user's own uploads, like the heatmap view
+    if not owns_upload(request.user, name) or not default_storage.exists(name):
+        raise Http404("No such image")
+    
+    try:
+        target = thumbnails.generate(name, size)
+    except OSError:
+        raise Http404("Not a readable image")
+    
+    # Thumbnails are named by content hash, so they never change
+    response = FileResponse(default_storage.open(target), content_type='image/webp')
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@login_required(login_url='login')
+def heatmap(request, prediction_id):
+    """Serve a prediction's face heatmap, queueing it on the first view"""
+    prediction = get_object_or_404(StressPrediction, pk=prediction_id, user=request.user, status=StressPrediction.DONE)
+    
+    try:
+        name = heatmaps.get_or_schedule(prediction)
+    except inference.ModelNotAvailable as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    except heatmaps.HeatmapFailed as e:
+        # Polling again would not help
+        return JsonResponse({'status': 'failed', 'error': str(e)}, status=422)
+    
+    if name is None:
+        response = JsonResponse({'status': 'pending'}, status=202)
+        response['Retry-After'] = '1'
+        return response
+    
+    # Keyed by prediction and model version, so a stored heatmap never changes
+    response = FileResponse(default_storage.open(name), content_type='image/webp')
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
 
 @login_required(login_url='login')
 def journal(request):
     if request.method == 'POST':
         text = request.POST.get('text', '')
         image = request.FILES.get('image')
+        if image:
+            # Name the photo after its content, like every other upload
+            uploads.ingest(image)
         
-        # Simple sentiment analysis (mock)
-        text_lower = text.lower()
-        if any(word in text_lower for word in ['happy', 'good', 'great', 'excellent']):
-            text_sentiment = 'Positive'
-        elif any(word in text_lower for word in ['sad', 'bad', 'terrible', 'awful']):
-            text_sentiment = 'Negative'
-        else:
-            text_sentiment = 'Neutral'
+        # Sentiment and stress keywords from one pass of the compiled lexicon
+        analysis = lexicon.analyze(text)
         
         # Create journal entry
         journal = MoodJournal.objects.create(
             user=request.user,
             text=text,
             image=image if image else None,
-            text_sentiment=text_sentiment,
+            text_sentiment=analysis.sentiment,
+            stress_keywords=analysis.keywords,
             combined_stress_level='Medium'  # Default for now
         )
         
@@ -178,38 +392,34 @@ def compare(request):
         after_image = request.FILES.get('after_image')
         
         if before_image and after_image:
-            fs = FileSystemStorage()
-            
-            # Process before image
-            before_filename = fs.save(before_image.name, before_image)
-            
-            # Process after image
-            after_filename = fs.save(after_image.name, after_image)
+            uploads.ingest(before_image)
+            uploads.ingest(after_image)
             
             try:
-                # Mock predictions
-                before_stress = 'High'
-                after_stress = 'Medium'
+                # Decode both images concurrently and score them in one forward pass
+                before, after = inference.predict_many([before_image, after_image])
+                for result in (before, after):
+                    if isinstance(result, Exception):
+                        raise result
                 
-                # Determine improvement
-                improvement = after_stress != before_stress
-                
-                # Save comparison
-                comparison = StressComparison.objects.create(
+                comparison = StressComparison(
                     user=request.user,
                     before_image=before_image,
                     after_image=after_image,
-                    before_stress_level=before_stress,
-                    after_stress_level=after_stress,
-                    before_confidence=75,
-                    after_confidence=70,
-                    improvement_score=25  # Mock improvement score
+                    before_stress_level=before.stress_level,
+                    after_stress_level=after.stress_level,
+                    before_confidence=before.confidence,
+                    after_confidence=after.confidence
                 )
+                comparison.calculate_improvement()
+                
+                # Save comparison; the ImageFields write each upload exactly once
+                comparison.save()
                 
                 messages.success(request, 'Images compared successfully!')
                 return render(request, 'stressdetector/comparison_result.html', {
                     'comparison': comparison,
-                    'improvement': improvement
+                    'improvement': comparison.improvement_score > 0
                 })
                 
             except Exception as e:
@@ -218,32 +428,56 @@ def compare(request):
     
     return render(request, 'stressdetector/compare.html')
 
+TREND_WINDOWS = (7, 30, 90, 365)
+
 @login_required(login_url='login')
 def trends_api(request):
-    end_date = timezone.now().date()
-    start_date = end_date - timedelta(days=6)
+    try:
+        days = int(request.GET.get('days', 7))
+    except ValueError:
+        days = None
+    if days not in TREND_WINDOWS:
+        return JsonResponse({'error': f"days must be one of {', '.join(map(str, TREND_WINDOWS))}"}, status=400)
     
-    data = StressPrediction.objects.filter(
-        user=request.user,
-        created_at__date__range=[start_date, end_date]
-    ).extra(
-        select={'day': 'date(created_at)'}
-    ).values('day', 'stress_level').annotate(count=models.Count('id'))
+    end_date = timezone.localdate()
+    start_date = end_date - timedelta(days=days - 1)
+    
+    # One indexed read of the pre-aggregated rollup, at most days x 3 rows
+    counts = {
+        (day, level): count
+        for day, level, count in DailyStressRollup.objects.filter(
+            user=request.user,
+            day__range=[start_date, end_date]
+        ).values_list('day', 'stress_level', 'count')
+    }
     
     dates = []
     stress_counts = {'Low': [], 'Medium': [], 'High': []}
     
-    for i in range(7):
+    for i in range(days):
         current_date = start_date + timedelta(days=i)
         dates.append(current_date.strftime('%Y-%m-%d'))
         
-        day_data = [d for d in data if d['day'] == current_date]
-        
         for level in ['Low', 'Medium', 'High']:
-            count = next((d['count'] for d in day_data if d['stress_level'] == level), 0)
-            stress_counts[level].append(count)
+            stress_counts[level].append(counts.get((current_date, level), 0))
     
     return JsonResponse({
         'dates': dates,
         'stress_counts': stress_counts
-    })
\ No newline at end of file
+    })
+
+@staff_member_required
+def inference_stats(request):
+    """Micro-batching histograms, cache and de-duplication stats, loaded models and the job queue"""
+    return JsonResponse({
+        **batching.stats(),
+        'uploads': uploads.stats(),
+        'models': inference.model_stats(),
+        'jobs': jobs.queue_stats(),
+    })
+
+def prometheus_metrics(request):
+    """Every in-process metric in Prometheus text format, for local scrapers only"""
+    if request.META.get('REMOTE_ADDR') not in settings.STRESS_METRICS_ALLOWED_IPS:
+        raise Http404()
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')